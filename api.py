@@ -0,0 +1,134 @@
+import asyncio
+import os
+from typing import Optional
+from aiohttp import web, MultipartWriter
+import config
+from main import executor, warm_up
+from metrics import metrics
+from service import ServiceBusy, pipeline_service
+
+# 回傳格式與 Content-Type 的對應
+FORMATS = {
+    ".png": "image/png",
+    ".jpg": "image/jpeg",
+    ".webp": "image/webp",
+}
+FORMAT_ALIASES = {"png": ".png", "jpg": ".jpg", "jpeg": ".jpg", "webp": ".webp"}
+CONTENT_TYPES = {content_type: ext for ext, content_type in FORMATS.items()}
+
+ERROR_HEADER = "X-ItemGlow-Error"
+
+def client_id(request: web.Request) -> str:
+    """公平排程以用戶端位址區分使用者"""
+    return request.remote or "anonymous"
+
+async def process(request: web.Request, data: bytes, ext: str) -> bytes:
+    """交由與 Web UI 共用的處理服務排程並處理一張圖片"""
+    return await pipeline_service.run_async(pipeline_service.process(client_id(request), data, ext))
+
+def output_format(request: web.Request, content_type: Optional[str] = None, filename: Optional[str] = None) -> str:
+    """
+    決定輸出格式：優先使用 ?format= 參數，其次為上傳檔名的副檔名或 Content-Type，皆無法判斷時輸出 PNG。
+    """
+    requested = request.query.get("format")
+    if requested:
+        ext = FORMAT_ALIASES.get(requested.lower().lstrip("."))
+        if ext is None:
+            raise web.HTTPBadRequest(text=f"不支援的輸出格式: {requested}")
+        return ext
+    if filename:
+        ext = FORMAT_ALIASES.get(os.path.splitext(filename)[1].lower().lstrip("."))
+        if ext:
+            return ext
+    return CONTENT_TYPES.get(content_type or "", ".png")
+
+def output_filename(filename: Optional[str], index: int, ext: str) -> str:
+    stem = os.path.splitext(os.path.basename(filename))[0] if filename else f"image_{index}"
+    return f"{stem}_white_background{ext}"
+
+async def handle_process(request: web.Request) -> web.Response:
+    """POST /process：請求內容為圖片檔案，回傳處理後的圖片"""
+    ext = output_format(request, request.content_type)
+    data = await request.read()
+    if not data:
+        raise web.HTTPBadRequest(text="請求內容為空")
+    try:
+        pipeline_service.check_capacity(1)
+        output = await process(request, data, ext)
+    except ServiceBusy as e:
+        raise web.HTTPServiceUnavailable(text=str(e))
+    except ValueError as e:
+        raise web.HTTPBadRequest(text=str(e))
+    return web.Response(body=output, content_type=FORMATS[ext])
+
+async def handle_batch(request: web.Request) -> web.Response:
+    """
+    POST /batch：以 multipart/form-data 上傳多張圖片，回傳 multipart/mixed，每張圖片一個部分，順序與上傳相同。
+    單張圖片處理失敗時，該部分的內容為錯誤訊息並帶有 X-ItemGlow-Error 標頭，其餘圖片照常回傳。
+    """
+    if not request.content_type.startswith("multipart/"):
+        raise web.HTTPBadRequest(text="請以 multipart/form-data 上傳圖片")
+    uploads = []
+    reader = await request.multipart()
+    async for part in reader:
+        data = await part.read()
+        if data:
+            uploads.append((part.filename, part.headers.get("Content-Type"), bytes(data)))
+    if not uploads:
+        raise web.HTTPBadRequest(text="沒有上傳任何圖片")
+
+    # 整批先檢查排隊空間，避免只處理一部分就被拒絕
+    try:
+        pipeline_service.check_capacity(len(uploads))
+    except ServiceBusy as e:
+        raise web.HTTPServiceUnavailable(text=str(e))
+    formats = [output_format(request, content_type, filename) for filename, content_type, _ in uploads]
+    results = await asyncio.gather(
+        *(process(request, data, ext) for (_, _, data), ext in zip(uploads, formats)),
+        return_exceptions=True
+    )
+
+    with MultipartWriter("mixed") as writer:
+        for index, ((filename, _, _), ext, result) in enumerate(zip(uploads, formats, results)):
+            name = output_filename(filename, index, ext)
+            if isinstance(result, BaseException):
+                if not isinstance(result, Exception):
+                    raise result
+                part = writer.append(str(result), {"Content-Type": "text/plain; charset=utf-8"})
+                part.headers[ERROR_HEADER] = type(result).__name__
+            else:
+                part = writer.append(result, {"Content-Type": FORMATS[ext]})
+            part.set_content_disposition("attachment", filename=name)
+    return web.Response(body=writer)
+
+async def handle_health(request: web.Request) -> web.Response:
+    stats = pipeline_service.stats()
+    return web.json_response({
+        "status": "ok",
+        "queued": stats["queued"],
+        "inflight": sum(stats["inflight_by_user"].values()),
+    })
+
+async def handle_metrics(request: web.Request) -> web.Response:
+    return web.Response(
+        text=metrics.render_prometheus(), content_type="text/plain", charset="utf-8",
+        headers={"X-Content-Type-Options": "nosniff"}
+    )
+
+async def on_startup(app: web.Application) -> None:
+    # 啟動時先載入模型並編譯運算核心，第一個請求不必等待
+    loop = asyncio.get_running_loop()
+    print(f"預熱完成，耗時 {await loop.run_in_executor(executor, warm_up):.1f} 秒")
+    await loop.run_in_executor(executor, pipeline_service.start)
+
+def create_app() -> web.Application:
+    app = web.Application(client_max_size=config.API_MAX_UPLOAD_MB * 1024 * 1024)
+    app.router.add_post("/process", handle_process)
+    app.router.add_post("/batch", handle_batch)
+    app.router.add_get("/healthz", handle_health)
+    app.router.add_get("/metrics", handle_metrics)
+    app.on_startup.append(on_startup)
+    return app
+
+if __name__ == "__main__":
+    web.run_app(create_app(), port=config.API_PORT)
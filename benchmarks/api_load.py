@@ -0,0 +1,119 @@
+"""
+HTTP API 壓力測試：以固定的並行數持續對 /process（或 /batch）送出請求，
+回報每秒處理張數與延遲分佈 (p50/p90/p99)。
+需先另外啟動 API，並停用快速去背（ITEMGLOW_FAST_PATH=none python api.py）：合成的商品照片為單色背景，
+否則不會執行去背模型。測試結束時若 /metrics 顯示有圖片經由快速去背處理，會提出警告。
+未指定圖片時使用合成的商品照片；每個請求的圖片內容都稍有不同，避免直接命中結果快取。
+
+用法（於專案根目錄）：
+    python -m benchmarks.api_load [--url http://localhost:8000] [--concurrency 16] [--requests 200] [--batch 4] [圖片路徑]
+"""
+import argparse
+import asyncio
+import statistics
+import time
+import re
+import aiohttp
+import cv2
+import numpy as np
+from benchmarks.common import synthetic_images
+
+def percentile(values: list[float], q: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(q / 100 * (len(ordered) - 1))))]
+
+def request_bodies(image: np.ndarray, count: int) -> list[bytes]:
+    """產生 count 份內容各不相同的 JPEG：左上角一列 8x8 方塊以黑白表示編號，單一像素的差異會在 JPEG 壓縮後消失"""
+    bodies = []
+    for i in range(count):
+        variant = image.copy()
+        for bit in range(24):
+            variant[:8, bit * 8:(bit + 1) * 8] = 255 if i >> bit & 1 else 0
+        bodies.append(cv2.imencode(".jpg", variant)[1].tobytes())
+    return bodies
+
+# 不執行去背模型的快速去背方式
+FAST_PATH_METHODS = ("alpha", "backdrop")
+
+async def fast_path_count(session: aiohttp.ClientSession, url: str) -> int:
+    """伺服器 /metrics 中經由快速去背處理的累計張數"""
+    async with session.get(f"{url}/metrics") as response:
+        text = await response.text()
+    return sum(
+        int(float(value)) for method, value in re.findall(r'itemglow_segmentation_total\{method="(\w+)"\} (\S+)', text)
+        if method in FAST_PATH_METHODS
+    )
+
+async def send(session: aiohttp.ClientSession, url: str, bodies: list[bytes]) -> None:
+    if len(bodies) == 1:
+        async with session.post(f"{url}/process", data=bodies[0], headers={"Content-Type": "image/jpeg"}) as response:
+            response.raise_for_status()
+            await response.read()
+        return
+    form = aiohttp.FormData()
+    for i, body in enumerate(bodies):
+        form.add_field("files", body, filename=f"{i}.jpg", content_type="image/jpeg")
+    async with session.post(f"{url}/batch", data=form) as response:
+        response.raise_for_status()
+        await response.read()
+
+async def run(url: str, concurrency: int, total: int, batch: int, image: np.ndarray) -> None:
+    bodies = request_bodies(image, total * batch)
+    latencies: list[float] = []
+    failures = 0
+    next_request = 0
+
+    async def worker(session: aiohttp.ClientSession) -> None:
+        nonlocal next_request, failures
+        while next_request < total:
+            index = next_request
+            next_request += 1
+            start = time.perf_counter()
+            try:
+                await send(session, url, bodies[index * batch:(index + 1) * batch])
+            except aiohttp.ClientError:
+                failures += 1
+                continue
+            latencies.append(time.perf_counter() - start)
+
+    timeout = aiohttp.ClientTimeout(total=None)
+    async with aiohttp.ClientSession(timeout=timeout, connector=aiohttp.TCPConnector(limit=concurrency)) as session:
+        # 先送一個請求確認服務可用，不計入結果
+        fast_before = await fast_path_count(session, url)
+        await send(session, url, bodies[:batch])
+        start = time.perf_counter()
+        await asyncio.gather(*(worker(session) for _ in range(concurrency)))
+        elapsed = time.perf_counter() - start
+        fast = await fast_path_count(session, url) - fast_before
+
+    if fast:
+        print(f"警告：有 {fast} 張圖片經由快速去背處理，結果不反映去背模型的效能，請以 ITEMGLOW_FAST_PATH=none 啟動 API")
+
+    if not latencies:
+        print(f"全部 {failures} 個請求皆失敗")
+        return
+    ms = [latency * 1000 for latency in latencies]
+    print(f"並行數 {concurrency}，每個請求 {batch} 張，成功 {len(latencies)} 個請求，失敗 {failures} 個")
+    print(f"每秒處理 {len(latencies) * batch / elapsed:.2f} 張（{len(latencies) / elapsed:.2f} 個請求）")
+    print(f"延遲：平均 {statistics.mean(ms):.0f} ms，p50 {percentile(ms, 50):.0f} ms，"
+          f"p90 {percentile(ms, 90):.0f} ms，p99 {percentile(ms, 99):.0f} ms，最大 {max(ms):.0f} ms")
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("image", nargs="?")
+    parser.add_argument("--url", default="http://localhost:8000")
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--batch", type=int, default=1, help="每個請求的圖片數，大於 1 時使用 /batch")
+    args = parser.parse_args()
+
+    if args.image:
+        image = cv2.imread(args.image, cv2.IMREAD_COLOR)
+        if image is None:
+            parser.error(f"無法讀取圖片: {args.image}")
+    else:
+        image = synthetic_images(1)[0]
+    asyncio.run(run(args.url.rstrip("/"), args.concurrency, args.requests, args.batch, image))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,76 @@
+"""
+CPU 調色的記憶體配置測試：模擬長時間的批次處理，以同尺寸的合成圖片連續處理多張，比較
+逐步處理（每一步配置新陣列並經過 float64）、每張重新配置緩衝區的融合管線，以及由 BufferPool 重複使用緩衝區的融合管線，
+回報每張圖片的平均耗時、每張額外配置的記憶體峰值（以 tracemalloc 量測）與緩衝區池的配置次數。
+
+用法（於專案根目錄）：
+    python -m benchmarks.buffer_pool [--count N] [--size 高 寬]
+"""
+import argparse
+import time
+import tracemalloc
+from typing import Callable
+import numpy as np
+from benchmarks.color_pipeline import chained
+from benchmarks.common import stub_mask, synthetic_images
+from buffer_pool import BufferPool
+from color_pipeline import render_white_background
+from main import BRIGHTNESS_MULTIPLIER, SATURATION_SCALE
+from segmentation import cutout
+
+def stepwise(image: np.ndarray, mask: np.ndarray) -> np.ndarray:
+    return chained(cutout(image, mask))
+
+def fused(image: np.ndarray, mask: np.ndarray) -> np.ndarray:
+    return render_white_background(cutout(image, mask), SATURATION_SCALE, BRIGHTNESS_MULTIPLIER)
+
+def pooled(buffers: BufferPool) -> Callable[[np.ndarray, np.ndarray], np.ndarray]:
+    def run(image: np.ndarray, mask: np.ndarray) -> np.ndarray:
+        shape = image.shape[:2]
+        bgra = cutout(image, mask, buffers.acquire((*shape, 4)))
+        result = render_white_background(
+            bgra, SATURATION_SCALE, BRIGHTNESS_MULTIPLIER, out=buffers.acquire((*shape, 3))
+        )
+        buffers.release(bgra)
+        # 實際流程中結果圖在編碼後歸還
+        buffers.release(result)
+        return result
+    return run
+
+def measure(fn: Callable[[np.ndarray, np.ndarray], np.ndarray], frames: list[tuple[np.ndarray, np.ndarray]]) -> tuple[float, float]:
+    """回傳 (每張平均耗時 ms, 每張額外配置的平均記憶體峰值 MB)"""
+    fn(*frames[0])
+    # 先量測耗時，tracemalloc 會拖慢配置，另外再跑一次量測記憶體
+    start = time.perf_counter()
+    for image, mask in frames:
+        fn(image, mask)
+    elapsed = time.perf_counter() - start
+    peaks = []
+    for image, mask in frames:
+        tracemalloc.start()
+        fn(image, mask)
+        peaks.append(tracemalloc.get_traced_memory()[1])
+        tracemalloc.stop()
+    return elapsed / len(frames) * 1000, sum(peaks) / len(peaks) / 1024 / 1024
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--count", type=int, default=10)
+    parser.add_argument("--size", type=int, nargs=2, default=(3000, 4000), metavar=("HEIGHT", "WIDTH"))
+    args = parser.parse_args()
+
+    # 逐步處理在去背後某個通道全為 0 時會除以零，略過這類圖片
+    frames = [
+        (image, mask) for image, mask in (
+            (image, stub_mask(image)) for image in synthetic_images(args.count * 2, tuple(args.size))
+        )
+        if cutout(image, mask)[:, :, :3].max(axis=(0, 1)).all()
+    ][:args.count]
+    buffers = BufferPool(1024 * 1024 * 1024)
+    for name, fn in (("逐步處理", stepwise), ("融合管線", fused), ("融合管線 + 緩衝區池", pooled(buffers))):
+        ms, mb = measure(fn, frames)
+        print(f"{name}: 每張 {ms:.0f} ms，每張額外配置峰值 {mb:.1f} MB")
+    print(buffers.report())
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,56 @@
+"""
+調色管線效能測試：比較逐步處理（白平衡 x4、飽和度、亮度、白底合成）與融合管線的耗時及結果差異。
+
+用法（於專案根目錄）：
+    python -m benchmarks.color_pipeline [--repeat N]
+"""
+import argparse
+import time
+import cv2
+import numpy as np
+from benchmarks.common import synthetic_images
+from color_pipeline import render_white_background
+from main import BRIGHTNESS_MULTIPLIER, SATURATION_SCALE, adjust_brightness, fill_white_background, increase_saturation
+from white_balance import apply_multiple_white_balance
+
+# 12 MP 與 24 MP
+SIZES = {"12MP": (3000, 4000), "24MP": (4000, 6000)}
+
+def chained(image: np.ndarray) -> np.ndarray:
+    b, g, r, a = cv2.split(image)
+    result_img = apply_multiple_white_balance(cv2.merge([b, g, r]), False)
+    result_img = increase_saturation(result_img, SATURATION_SCALE)
+    result_img = adjust_brightness(result_img, BRIGHTNESS_MULTIPLIER)
+    return fill_white_background(result_img, a / 255.0)
+
+def fused(image: np.ndarray) -> np.ndarray:
+    return render_white_background(image, SATURATION_SCALE, BRIGHTNESS_MULTIPLIER)
+
+def best_time(fn, image: np.ndarray, repeat: int) -> tuple[float, np.ndarray]:
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn(image)
+        times.append(time.perf_counter() - start)
+    return min(times), result
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    # 先以小圖觸發 numba 編譯
+    warmup = synthetic_images(1, (64, 64), alpha=True)[0]
+    chained(warmup)
+    fused(warmup)
+
+    for name, size in SIZES.items():
+        image = synthetic_images(1, size, alpha=True)[0]
+        before, expected = best_time(chained, image, args.repeat)
+        after, result = best_time(fused, image, args.repeat)
+        diff = np.abs(expected.astype(np.int16) - result.astype(np.int16)).max()
+        print(f"{name}: 逐步處理 {before * 1000:.0f} ms，融合管線 {after * 1000:.0f} ms，"
+              f"加速 {before / after:.1f} 倍，最大通道誤差 {diff}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,52 @@
+from typing import Optional
+import cv2
+import numpy as np
+
+def synthetic_images(count: int, size: tuple[int, int] = (1200, 1600), alpha: bool = False, seed: int = 0) -> list[np.ndarray]:
+    """
+    產生淺灰背景上帶有彩色物體的合成商品照片 (BGR)。
+    alpha=True 時產生去背後的 BGRA 圖片：物體外為透明，邊緣為半透明。
+    """
+    rng = np.random.default_rng(seed)
+    images = []
+    for _ in range(count):
+        image = np.full((size[0], size[1], 3), 225, dtype=np.uint8)
+        image += rng.integers(0, 20, image.shape, dtype=np.uint8)
+        color = tuple(int(c) for c in rng.integers(0, 255, 3))
+        center = (int(size[1] * rng.uniform(0.3, 0.7)), int(size[0] * rng.uniform(0.3, 0.7)))
+        axes = (size[1] // 4, size[0] // 5)
+        cv2.ellipse(image, center, axes, 0, 0, 360, color, -1)
+        if alpha:
+            mask = np.zeros(size, dtype=np.uint8)
+            cv2.ellipse(mask, center, axes, 0, 0, 360, 255, -1)
+            mask = cv2.GaussianBlur(mask, (15, 15), 0)
+            alpha_factor = mask.astype(np.float32) / 255.0
+            image = cv2.merge([(image * alpha_factor[:, :, None]).astype(np.uint8), mask])
+        images.append(image)
+    return images
+
+def stub_mask(image: np.ndarray) -> np.ndarray:
+    """離線用的假去背：與淺灰背景差異夠大的像素視為前景，邊緣稍微模糊成半透明"""
+    gray = cv2.cvtColor(image[:, :, :3], cv2.COLOR_BGR2GRAY)
+    mask = np.where(np.abs(gray.astype(np.int16) - 232) > 20, 255, 0).astype(np.uint8)
+    return cv2.GaussianBlur(mask, (15, 15), 0)
+
+def install_stub_segmenter() -> None:
+    """以 stub_mask 取代共用 session 池的模型推論，不需下載或載入模型即可測試整個流程"""
+    from segmentation import cutout, downscale, segment_lowres, session_pool
+
+    def remove_background(image: np.ndarray, max_side: int = 0, out: Optional[np.ndarray] = None) -> np.ndarray:
+        small = downscale(image, max_side)
+        return segment_lowres(image, small, stub_mask(small), out)
+
+    session_pool.preload = lambda: None
+    session_pool.predict_masks = lambda images: [stub_mask(image) for image in images]
+    session_pool.remove_background = remove_background
+
+    def remove(data: np.ndarray, only_mask: bool = False, **kwargs) -> np.ndarray:
+        # 與 rembg.remove 相同，輸入為 RGB，stub_mask 則以 BGR 計算
+        rgb = np.asarray(data)
+        mask = stub_mask(cv2.cvtColor(rgb, cv2.COLOR_RGB2BGR))
+        return mask if only_mask else cutout(rgb, mask)
+
+    session_pool.remove = remove
@@ -0,0 +1,51 @@
+"""
+GPU 調色效能測試：比較舊版逐步處理（每一步都在主機與裝置間來回傳輸）與裝置常駐的融合管線，
+並檢查 GPU 結果與 CPU 融合管線是否相同。
+
+用法（於專案根目錄）：
+    python -m benchmarks.gpu_pipeline [--repeat N] [--size 高 寬]
+沒有 GPU 時可用 numba 的 CUDA 模擬器驗證結果（速度極慢，請搭配小尺寸）：
+    NUMBA_ENABLE_CUDASIM=1 python -m benchmarks.gpu_pipeline --repeat 1 --size 48 64
+"""
+import argparse
+import time
+import numpy as np
+from benchmarks.common import synthetic_images
+from color_pipeline import render_white_background
+from gpu_pipeline import render_white_background_gpu
+from main import BRIGHTNESS_MULTIPLIER, SATURATION_SCALE, render_white_background_cuda
+
+# 12 MP 與 24 MP
+SIZES = {"12MP": (3000, 4000), "24MP": (4000, 6000)}
+
+def best_time(fn, image: np.ndarray, repeat: int) -> tuple[float, np.ndarray]:
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn(image, SATURATION_SCALE, BRIGHTNESS_MULTIPLIER)
+        times.append(time.perf_counter() - start)
+    return min(times), result
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--size", type=int, nargs=2, metavar=("HEIGHT", "WIDTH"))
+    args = parser.parse_args()
+    sizes = {f"{args.size[0]}x{args.size[1]}": tuple(args.size)} if args.size else SIZES
+
+    # 先以小圖觸發編譯並上傳常數查表
+    warmup = synthetic_images(1, (32, 32), alpha=True)[0]
+    render_white_background_cuda(warmup, SATURATION_SCALE, BRIGHTNESS_MULTIPLIER)
+    render_white_background_gpu(warmup, SATURATION_SCALE, BRIGHTNESS_MULTIPLIER)
+
+    for name, size in sizes.items():
+        image = synthetic_images(1, size, alpha=True)[0]
+        before, _ = best_time(render_white_background_cuda, image, args.repeat)
+        after, result = best_time(render_white_background_gpu, image, args.repeat)
+        expected = render_white_background(image, SATURATION_SCALE, BRIGHTNESS_MULTIPLIER)
+        diff = np.abs(expected.astype(np.int16) - result.astype(np.int16)).max()
+        print(f"{name}: 逐步處理 {before * 1000:.0f} ms，裝置常駐 {after * 1000:.0f} ms，"
+              f"加速 {before / after:.1f} 倍，與 CPU 融合管線的最大通道誤差 {diff}")
+
+if __name__ == "__main__":
+    main()
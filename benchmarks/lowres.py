@@ -0,0 +1,77 @@
+"""
+低解析度模式效能與品質測試：比較原尺寸去背＋完整白平衡統計，與縮圖去背＋取樣統計的每張耗時及結果差異。
+結果差異以 PSNR、平均與 99 百分位通道誤差表示；PSNR 低於 --min-psnr 時以非零狀態結束，可作為品質檢查。
+
+用法（於專案根目錄）：
+    python -m benchmarks.lowres [圖片目錄] [--count N] [--side N] [--min-psnr DB]
+    python -m benchmarks.lowres --stub   # 以 stub 遮罩取代去背模型，不需模型檔即可檢查導向濾波放大與取樣統計
+未指定圖片目錄時使用 24 MP 的合成商品照片。
+"""
+import argparse
+import sys
+import time
+import cv2
+import numpy as np
+from benchmarks.common import install_stub_segmenter, synthetic_images
+from color_pipeline import render_white_background
+from main import BRIGHTNESS_MULTIPLIER, SATURATION_SCALE, get_all_images
+from segmentation import session_pool
+
+def process(image: np.ndarray, side: int) -> np.ndarray:
+    image_np = session_pool.remove_background(image, side)
+    return render_white_background(image_np, SATURATION_SCALE, BRIGHTNESS_MULTIPLIER, stats_side=side)
+
+def timed(image: np.ndarray, side: int) -> tuple[float, np.ndarray]:
+    start = time.perf_counter()
+    result = process(image, side)
+    return time.perf_counter() - start, result
+
+def psnr(expected: np.ndarray, result: np.ndarray) -> float:
+    mse = np.mean((expected.astype(np.float64) - result.astype(np.float64)) ** 2)
+    return float("inf") if mse == 0 else 10 * np.log10(255 ** 2 / mse)
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("input_dir", nargs="?")
+    parser.add_argument("--count", type=int, default=3)
+    parser.add_argument("--side", type=int, default=1024)
+    parser.add_argument("--min-psnr", type=float, default=35.0)
+    parser.add_argument("--stub", action="store_true", help="以 stub 遮罩取代去背模型（不需要模型檔）")
+    args = parser.parse_args()
+
+    if args.stub:
+        install_stub_segmenter()
+
+    if args.input_dir:
+        images = [cv2.imread(path) for path in get_all_images(args.input_dir)[:args.count]]
+    else:
+        images = synthetic_images(args.count, (4000, 6000))
+
+    # 先載入模型並觸發 numba 編譯，避免混入結果
+    session_pool.preload()
+    warmup = synthetic_images(1, (64, 64))[0]
+    process(warmup, 0)
+    process(warmup, 32)
+
+    full_times, lowres_times, scores = [], [], []
+    for i, image in enumerate(images):
+        full_time, expected = timed(image, 0)
+        lowres_time, result = timed(image, args.side)
+        diff = np.abs(expected.astype(np.int16) - result.astype(np.int16))
+        score = psnr(expected, result)
+        full_times.append(full_time)
+        lowres_times.append(lowres_time)
+        scores.append(score)
+        print(f"#{i} {image.shape[1]}x{image.shape[0]}: 原尺寸 {full_time * 1000:.0f} ms，"
+              f"低解析度 {lowres_time * 1000:.0f} ms，PSNR {score:.1f} dB，"
+              f"平均誤差 {diff.mean():.2f}，99 百分位誤差 {np.percentile(diff, 99):.0f}")
+
+    full, lowres = sum(full_times) / len(images), sum(lowres_times) / len(images)
+    print(f"平均每張: 原尺寸 {full * 1000:.0f} ms，低解析度 (長邊 {args.side}) {lowres * 1000:.0f} ms，加速 {full / lowres:.1f} 倍")
+    if min(scores) < args.min_psnr:
+        print(f"品質檢查未通過：最低 PSNR {min(scores):.1f} dB 低於 {args.min_psnr} dB")
+        sys.exit(1)
+    print(f"品質檢查通過：最低 PSNR {min(scores):.1f} dB")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,83 @@
+"""
+去背模型比較：對同一組圖片依序載入各模型，回報模型載入時間（INT8 版本第一次使用時含量化）、
+單張推論延遲 (p50/p90)、以 session 池並行推論時的每秒處理張數，以及遮罩與基準模型（預設為完整精度的 u2net）的差異：
+以 128 為門檻的 IoU 與平均 alpha 誤差。
+
+每個 session 的 ONNX Runtime 線程數預設為 CPU 核心數 / 並行數，與主程式的線程預算相同。
+
+用法（於專案根目錄）：
+    python -m benchmarks.models [圖片目錄] [--models u2net u2netp u2net-int8 u2netp-int8] [--reference u2net]
+                                [--count N] [--concurrency N] [--intra-op-threads N]
+未指定圖片目錄時使用合成的商品照片（僅適合比較速度，遮罩差異請以實際的商品照片衡量）。
+"""
+import argparse
+import os
+import statistics
+import time
+from concurrent.futures import ThreadPoolExecutor
+import cv2
+import numpy as np
+from benchmarks.api_load import percentile
+from benchmarks.common import synthetic_images
+from main import get_all_images
+from segmentation import SessionPool
+
+def mask_iou(expected: np.ndarray, mask: np.ndarray) -> float:
+    expected, mask = expected >= 128, mask >= 128
+    union = np.count_nonzero(expected | mask)
+    return 1.0 if union == 0 else np.count_nonzero(expected & mask) / union
+
+def predict(pool: SessionPool, images: list[np.ndarray], concurrency: int) -> tuple[list[np.ndarray], list[float], float]:
+    """回傳 (各圖片的遮罩, 單張推論延遲 ms, 並行推論的每秒處理張數)"""
+    latencies = []
+    masks = []
+    for image in images:
+        start = time.perf_counter()
+        masks.append(pool.predict_masks([image])[0])
+        latencies.append((time.perf_counter() - start) * 1000)
+    with ThreadPoolExecutor(concurrency) as executor:
+        start = time.perf_counter()
+        list(executor.map(lambda image: pool.predict_masks([image]), images))
+        elapsed = time.perf_counter() - start
+    return masks, latencies, len(images) / elapsed
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("input_dir", nargs="?")
+    parser.add_argument("--models", nargs="+", default=["u2net", "u2net-int8", "u2netp", "u2netp-int8"])
+    parser.add_argument("--reference", default="u2net")
+    parser.add_argument("--count", type=int, default=16)
+    parser.add_argument("--concurrency", type=int, default=max(1, min(4, os.cpu_count() or 1)))
+    parser.add_argument("--intra-op-threads", type=int, default=0, help="每個 session 的運算線程數，0 表示 CPU 核心數 / 並行數")
+    args = parser.parse_args()
+
+    if args.input_dir:
+        images = [cv2.imread(path, cv2.IMREAD_COLOR) for path in get_all_images(args.input_dir)[:args.count]]
+        images = [image for image in images if image is not None]
+        if not images:
+            parser.error(f"{args.input_dir} 中沒有可讀取的圖片")
+    else:
+        images = synthetic_images(args.count)
+    threads = args.intra_op_threads or max(1, (os.cpu_count() or 1) // args.concurrency)
+    print(f"圖片數: {len(images)}，並行數: {args.concurrency}，每個 session 的運算線程數: {threads}")
+
+    names = [args.reference] + [name for name in args.models if name != args.reference]
+    reference: list[np.ndarray] = []
+    for name in names:
+        pool = SessionPool(name, args.concurrency, intra_op_threads=threads)
+        start = time.perf_counter()
+        pool.preload()
+        load = time.perf_counter() - start
+        # 第一次推論會配置記憶體，不計入結果
+        pool.predict_masks(images[:1])
+        masks, latencies, throughput = predict(pool, images, args.concurrency)
+        if name == args.reference:
+            reference = masks
+        ious = [mask_iou(expected, mask) for expected, mask in zip(reference, masks)]
+        errors = [np.abs(expected.astype(np.int16) - mask).mean() for expected, mask in zip(reference, masks)]
+        print(f"{name}: 載入 {load:.1f} 秒，延遲 p50 {percentile(latencies, 50):.0f} ms、p90 {percentile(latencies, 90):.0f} ms，"
+              f"每秒 {throughput:.2f} 張，與 {args.reference} 的 IoU 平均 {statistics.mean(ious):.4f}、"
+              f"最低 {min(ious):.4f}，平均 alpha 誤差 {statistics.mean(errors):.2f}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,200 @@
+"""
+處理流程分段效能測試：以合成的商品照片（多種解析度，不透明與含透明兩種）分別量測每個步驟的耗時，
+並在獨立行程中量測 process_multiple_images 的每秒處理張數與記憶體峰值 (peak RSS)。
+預設以假去背取代模型，不需網路或模型檔即可執行。結果寫成 JSON，方便比較不同版本。
+
+用法（於專案根目錄）：
+    python -m benchmarks.pipeline_stages [--sizes 2MP 12MP] [--repeat N] [--output 結果.json] [--compare 先前結果.json]
+    python -m benchmarks.pipeline_stages --real-model   # 使用實際的去背模型
+"""
+import argparse
+import datetime
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Any, Callable
+import cv2
+import numpy as np
+from benchmarks.common import install_stub_segmenter, stub_mask, synthetic_images
+
+SIZES = {"2MP": (1200, 1600), "12MP": (3000, 4000), "24MP": (4000, 6000)}
+
+PROJECT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+def stage_functions(image: np.ndarray) -> dict[str, Callable[[], Any]]:
+    """一張圖片各步驟的呼叫；含透明的圖片直接使用自身的 alpha，不透明的圖片以假去背產生遮罩"""
+    from color_pipeline import render_white_background, render_white_background_tiled
+    from main import BRIGHTNESS_MULTIPLIER, SATURATION_SCALE, adjust_brightness, fill_white_background, increase_saturation
+    from segmentation import cutout, session_pool
+    from white_balance import (
+        adaptive_white_balance,
+        gray_world_white_balance,
+        perfect_reflector_white_balance,
+        white_patch_white_balance,
+    )
+
+    bgr = np.ascontiguousarray(image[:, :, :3])
+    mask = image[:, :, 3].copy() if image.shape[2] == 4 else stub_mask(bgr)
+    bgra = cutout(bgr, mask)
+    alpha_factor = mask / 255.0
+    encoded = {ext: cv2.imencode(ext, image)[1] for ext in (".png", ".webp")}
+    if image.shape[2] == 3:
+        encoded[".jpg"] = cv2.imencode(".jpg", image)[1]
+
+    stages: dict[str, Callable[[], Any]] = {}
+    for ext, data in encoded.items():
+        stages[f"decode{ext}"] = lambda data=data: cv2.imdecode(data, cv2.IMREAD_UNCHANGED)
+    stages.update({
+        "segmentation": lambda: session_pool.predict_masks([bgr]),
+        "cutout": lambda: cutout(bgr, mask),
+        "white_patch_white_balance": lambda: white_patch_white_balance(bgr, False),
+        "gray_world_white_balance": lambda: gray_world_white_balance(bgr, False),
+        "perfect_reflector_white_balance": lambda: perfect_reflector_white_balance(bgr, False),
+        "adaptive_white_balance": lambda: adaptive_white_balance(bgr, False),
+        "increase_saturation": lambda: increase_saturation(bgr, SATURATION_SCALE),
+        "adjust_brightness": lambda: adjust_brightness(bgr, BRIGHTNESS_MULTIPLIER),
+        "fill_white_background": lambda: fill_white_background(bgr, alpha_factor),
+        "render_white_background": lambda: render_white_background(bgra, SATURATION_SCALE, BRIGHTNESS_MULTIPLIER),
+        "render_white_background_tiled": lambda: render_white_background_tiled(
+            bgr, mask, SATURATION_SCALE, BRIGHTNESS_MULTIPLIER
+        ),
+    })
+    for ext in (".jpg", ".png", ".webp"):
+        stages[f"encode{ext}"] = lambda ext=ext: cv2.imencode(ext, bgr)
+    return stages
+
+def time_stage(fn: Callable[[], Any], repeat: int) -> dict[str, float]:
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        times.append((time.perf_counter() - start) * 1000)
+    return {"min_ms": round(min(times), 3), "median_ms": round(statistics.median(times), 3)}
+
+def run_stages(sizes: list[str], repeat: int) -> dict[str, Any]:
+    # 先以小圖觸發 numba 編譯，避免編譯時間混入結果
+    for image in (synthetic_images(1, (64, 64))[0], synthetic_images(1, (64, 64), alpha=True)[0]):
+        for fn in stage_functions(image).values():
+            fn()
+
+    results: dict[str, Any] = {}
+    for name in sizes:
+        results[name] = {}
+        for variant, alpha in (("opaque", False), ("alpha", True)):
+            image = synthetic_images(1, SIZES[name], alpha=alpha)[0]
+            results[name][variant] = {
+                stage: time_stage(fn, repeat) for stage, fn in stage_functions(image).items()
+            }
+            print(f"{name} {variant}: " + "，".join(
+                f"{stage} {timing['min_ms']:.1f} ms" for stage, timing in results[name][variant].items()
+            ))
+    return results
+
+# 在獨立行程中執行，記憶體峰值不受分段測試影響
+END_TO_END = """
+import asyncio, json, resource, sys, time
+real_model = sys.argv[3] == "1"
+if not real_model:
+    from benchmarks.common import install_stub_segmenter
+    install_stub_segmenter()
+import main
+main.warm_up(load_model=real_model)
+start = time.perf_counter()
+asyncio.run(main.process_multiple_images(sys.argv[1], sys.argv[2], incremental=False))
+elapsed = time.perf_counter() - start
+print("RESULT " + json.dumps({"seconds": elapsed, "peak_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024}))
+"""
+
+def run_end_to_end(size: str, count: int, real_model: bool) -> dict[str, Any]:
+    with tempfile.TemporaryDirectory() as temp_dir:
+        input_dir = os.path.join(temp_dir, "input")
+        os.makedirs(input_dir)
+        for i, image in enumerate(synthetic_images(count, SIZES[size], seed=1)):
+            cv2.imwrite(os.path.join(input_dir, f"{i}.jpg"), image)
+        # 合成圖片皆為單色背景，停用快速去背，量測的是去背模型的流程
+        env = {**os.environ, "ITEMGLOW_CACHE_MAX_MB": "0", "ITEMGLOW_BACKEND": "thread", "ITEMGLOW_FAST_PATH": "none"}
+        output = subprocess.run(
+            [sys.executable, "-c", END_TO_END, input_dir, os.path.join(temp_dir, "output"), "1" if real_model else "0"],
+            cwd=PROJECT_DIR, env=env, capture_output=True, text=True, check=True
+        ).stdout
+    line = next(line for line in output.splitlines() if line.startswith("RESULT "))
+    result = json.loads(line[len("RESULT "):])
+    return {
+        "size": size,
+        "images": count,
+        "images_per_sec": round(count / result["seconds"], 3),
+        "peak_rss_mb": round(result["peak_rss_mb"], 1),
+    }
+
+def environment() -> dict[str, Any]:
+    import config
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=PROJECT_DIR, capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        "timestamp": datetime.datetime.now().isoformat(timespec="seconds"),
+        "commit": commit,
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "opencv": cv2.__version__,
+        "config": {name: getattr(config, name) for name in dir(config) if name.isupper()},
+    }
+
+def compare(previous: dict[str, Any], current: dict[str, Any]) -> None:
+    """列出與先前結果相比變化的倍率（大於 1 表示變慢）"""
+    for size, variants in current["stages"].items():
+        for variant, stages in variants.items():
+            for stage, timing in stages.items():
+                before = previous.get("stages", {}).get(size, {}).get(variant, {}).get(stage)
+                if before:
+                    print(f"{size} {variant} {stage}: {before['min_ms']:.1f} -> {timing['min_ms']:.1f} ms "
+                          f"({timing['min_ms'] / before['min_ms']:.2f}x)")
+    before = previous.get("end_to_end")
+    after = current.get("end_to_end")
+    if before and after:
+        print(f"端到端: {before['images_per_sec']:.2f} -> {after['images_per_sec']:.2f} 張/秒，"
+              f"記憶體峰值 {before['peak_rss_mb']:.0f} -> {after['peak_rss_mb']:.0f} MB")
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", nargs="+", choices=list(SIZES), default=list(SIZES))
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--e2e-size", choices=list(SIZES), default="2MP")
+    parser.add_argument("--e2e-count", type=int, default=24)
+    parser.add_argument("--real-model", action="store_true", help="使用實際的去背模型（需要模型檔）")
+    parser.add_argument("--output", default=f"benchmark_{datetime.datetime.now():%Y%m%d_%H%M%S}.json")
+    parser.add_argument("--compare", help="與先前輸出的 JSON 結果比較")
+    args = parser.parse_args()
+
+    if not args.real_model:
+        install_stub_segmenter()
+
+    results = {
+        "environment": environment(),
+        "segmenter": "model" if args.real_model else "stub",
+        "stages": run_stages(args.sizes, args.repeat),
+        "end_to_end": run_end_to_end(args.e2e_size, args.e2e_count, args.real_model),
+    }
+    end_to_end = results["end_to_end"]
+    print(f"端到端 ({end_to_end['size']} x {end_to_end['images']} 張): {end_to_end['images_per_sec']:.2f} 張/秒，"
+          f"記憶體峰值 {end_to_end['peak_rss_mb']:.0f} MB")
+
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(results, f, ensure_ascii=False, indent=2)
+    print(f"結果已寫入 {args.output}")
+
+    if args.compare:
+        with open(args.compare, "r", encoding="utf-8") as f:
+            compare(json.load(f), results)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,60 @@
+"""
+多行程模式擴展性測試：以 1 到 N 個工作行程處理同一批圖片，回報每秒處理張數與加速比。
+模型載入與 numba 編譯在計時前先以暖機圖片完成。
+合成圖片為單色背景，工作行程停用快速去背，確保量測的是去背模型推論。
+
+用法（於專案根目錄）：
+    python -m benchmarks.process_scaling [--max-workers N] [--count N] [--threads-per-worker N]
+"""
+import argparse
+import asyncio
+import os
+import time
+import numpy as np
+import config
+from benchmarks.common import synthetic_images
+from fast_path import fast_path
+from main import BRIGHTNESS_MULTIPLIER, SATURATION_SCALE
+from process_pool import ProcessBackend
+
+async def measure(backend: ProcessBackend, images: list[np.ndarray]) -> float:
+    # 每個工作行程至少處理一張暖機圖片
+    await asyncio.gather(*(
+        backend.process(images[0], SATURATION_SCALE, BRIGHTNESS_MULTIPLIER) for _ in range(backend.workers * 2)
+    ))
+    start = time.perf_counter()
+    await asyncio.gather(*(backend.process(image, SATURATION_SCALE, BRIGHTNESS_MULTIPLIER) for image in images))
+    return time.perf_counter() - start
+
+def worker_counts(max_workers: int) -> list[int]:
+    counts = [1]
+    while counts[-1] * 2 < max_workers:
+        counts.append(counts[-1] * 2)
+    if counts[-1] != max_workers:
+        counts.append(max_workers)
+    return counts
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--max-workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--count", type=int, default=64)
+    parser.add_argument("--threads-per-worker", type=int, default=1)
+    args = parser.parse_args()
+
+    images = synthetic_images(args.count, (1500, 2000))
+    # 工作行程依 fast_path.modes 建立各自的快速分類器
+    fast_path.modes = frozenset()
+    baseline = None
+    for workers in worker_counts(args.max_workers):
+        backend = ProcessBackend(config.MODEL_NAME, workers, args.threads_per_worker)
+        try:
+            elapsed = asyncio.run(measure(backend, images))
+        finally:
+            backend.shutdown()
+        throughput = len(images) / elapsed
+        baseline = baseline or throughput
+        print(f"{workers:>3} 個工作行程: {throughput:.2f} 張/秒，加速 {throughput / baseline:.2f} 倍，"
+              f"效率 {throughput / baseline / workers:.0%}")
+
+if __name__ == "__main__":
+    main()
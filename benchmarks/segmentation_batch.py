@@ -0,0 +1,55 @@
+"""
+批次去背效能測試：比較逐張推論（每張各自呼叫 predict_masks）與批次推論的每秒處理張數，兩者都只計算遮罩推論。
+
+用法（於專案根目錄）：
+    python -m benchmarks.segmentation_batch [圖片目錄] [--count N] [--batch-size N] [--max-wait-ms N]
+未指定圖片目錄時使用合成的商品照片。
+"""
+import argparse
+import asyncio
+import time
+import cv2
+import numpy as np
+from benchmarks.common import synthetic_images
+from main import executor, get_all_images
+from segmentation import SegmentationBatcher, session_pool
+
+async def run_single(images: list[np.ndarray]) -> float:
+    loop = asyncio.get_running_loop()
+    start = time.perf_counter()
+    await asyncio.gather(*(loop.run_in_executor(executor, session_pool.predict_masks, [image]) for image in images))
+    return time.perf_counter() - start
+
+async def run_batched(images: list[np.ndarray], batch_size: int, max_wait: float) -> float:
+    batcher = SegmentationBatcher(session_pool, executor, batch_size, max_wait)
+    start = time.perf_counter()
+    try:
+        await asyncio.gather(*(batcher.segment(image) for image in images))
+    finally:
+        await batcher.close()
+    return time.perf_counter() - start
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("input_dir", nargs="?")
+    parser.add_argument("--count", type=int, default=32)
+    parser.add_argument("--batch-size", type=int, default=4)
+    parser.add_argument("--max-wait-ms", type=int, default=20)
+    args = parser.parse_args()
+
+    if args.input_dir:
+        images = [cv2.imread(path) for path in get_all_images(args.input_dir)[:args.count]]
+    else:
+        images = synthetic_images(args.count)
+
+    # 先載入所有 session，避免模型載入時間混入結果
+    session_pool.preload()
+
+    single = asyncio.run(run_single(images))
+    batched = asyncio.run(run_batched(images, args.batch_size, args.max_wait_ms / 1000))
+    print(f"圖片數: {len(images)}，session 池大小: {session_pool.size}")
+    print(f"逐張推論: {len(images) / single:.2f} 張/秒")
+    print(f"批次推論 (batch={args.batch_size}): {len(images) / batched:.2f} 張/秒")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,83 @@
+"""
+啟動效能測試：在全新的 Python 行程中量測從啟動到處理完第一張圖片的時間，
+分為匯入 main、預熱（載入模型與編譯運算核心）與第一張圖片三段。
+依序測試：清除 numba 編譯快取並預熱（同時重新產生快取）、使用編譯快取但不預熱、使用編譯快取並預熱。
+
+用法（於專案根目錄）：
+    python -m benchmarks.startup [圖片路徑]
+未指定圖片時使用合成的商品照片。處理時停用結果快取與快速去背，避免直接命中先前的結果或略過去背模型。
+"""
+import argparse
+import glob
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+import cv2
+from benchmarks.common import synthetic_images
+
+PROJECT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# 在子行程中執行，依序回報各階段完成的時間點
+CHILD = """
+import asyncio, json, sys, time
+marks = {}
+import main
+marks["import"] = time.time()
+if sys.argv[3] == "1":
+    main.warm_up()
+marks["warm_up"] = time.time()
+with open(sys.argv[2], "rb") as f:
+    data = f.read()
+asyncio.run(main.process_bytes(data, ".png"))
+marks["first_image"] = time.time()
+print("MARKS " + json.dumps({"launch": float(sys.argv[1]), **marks}))
+"""
+
+def clear_numba_cache() -> None:
+    """刪除專案中 numba 的編譯快取（.nbi 索引與 .nbc 編譯結果）"""
+    cache_dir = os.getenv("NUMBA_CACHE_DIR") or PROJECT_DIR
+    for pattern in ("*.nbi", "*.nbc"):
+        for path in glob.glob(os.path.join(cache_dir, "**", pattern), recursive=True):
+            os.remove(path)
+
+def run_once(image_path: str, warm_up: bool) -> dict[str, float]:
+    # 合成圖片為單色背景，停用快速去背，第一張圖片才會用到去背模型
+    env = {**os.environ, "ITEMGLOW_CACHE_MAX_MB": "0", "ITEMGLOW_FAST_PATH": "none"}
+    launch = time.time()
+    output = subprocess.run(
+        [sys.executable, "-c", CHILD, str(launch), image_path, "1" if warm_up else "0"],
+        cwd=PROJECT_DIR, env=env, capture_output=True, text=True, check=True
+    ).stdout
+    line = next(line for line in output.splitlines() if line.startswith("MARKS "))
+    return json.loads(line[len("MARKS "):])
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("image", nargs="?")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        image_path = args.image
+        if image_path is None:
+            image_path = os.path.join(temp_dir, "sample.png")
+            cv2.imwrite(image_path, synthetic_images(1)[0])
+
+        scenarios = [
+            ("無編譯快取、預熱", True, True),
+            ("有編譯快取、不預熱", False, False),
+            ("有編譯快取、預熱", False, True),
+        ]
+        for name, clear, warm_up in scenarios:
+            if clear:
+                clear_numba_cache()
+            marks = run_once(image_path, warm_up)
+            print(f"{name}: 匯入 {marks['import'] - marks['launch']:.2f} 秒，"
+                  f"預熱 {marks['warm_up'] - marks['import']:.2f} 秒，"
+                  f"第一張圖片 {marks['first_image'] - marks['warm_up']:.2f} 秒，"
+                  f"從啟動到第一張完成共 {marks['first_image'] - marks['launch']:.2f} 秒")
+
+if __name__ == "__main__":
+    main()
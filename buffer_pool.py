@@ -0,0 +1,70 @@
+import threading
+import weakref
+from collections import OrderedDict
+from typing import Any
+import numpy as np
+
+class BufferPool:
+    """
+    依形狀與型別重複使用的 ndarray 緩衝區：批次處理中同尺寸的圖片反覆需要同樣大小的去背圖與結果圖，
+    用完歸還後下一張圖片直接取用，不必每張重新配置與歸零記憶體。
+    閒置的緩衝區總大小超過 max_bytes 時，先丟棄最久未使用形狀的緩衝區。
+    呼叫端只應歸還由本池借出的陣列；歸還其他陣列時直接忽略。
+    """
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self._free: OrderedDict[tuple, list[np.ndarray]] = OrderedDict()
+        self._free_bytes = 0
+        # 借出中的陣列，以 id 為鍵的弱參照：處理失敗而未歸還的陣列照常被回收，
+        # 歸還時比對陣列本身，id 被其他陣列重複使用時不會誤收
+        self._issued: weakref.WeakValueDictionary[int, np.ndarray] = weakref.WeakValueDictionary()
+        self._lock = threading.Lock()
+        self.allocations = 0
+        self.reuses = 0
+
+    def acquire(self, shape: tuple[int, ...], dtype: Any = np.uint8) -> np.ndarray:
+        """借出一個指定形狀的緩衝區，內容未初始化"""
+        key = (tuple(shape), np.dtype(dtype).str)
+        with self._lock:
+            buffers = self._free.get(key)
+            if buffers:
+                array = buffers.pop()
+                if not buffers:
+                    del self._free[key]
+                self._free_bytes -= array.nbytes
+                self.reuses += 1
+            else:
+                array = None
+                self.allocations += 1
+        if array is None:
+            array = np.empty(shape, dtype=dtype)
+        with self._lock:
+            self._issued[id(array)] = array
+        return array
+
+    def release(self, array: np.ndarray) -> None:
+        """歸還緩衝區；歸還後呼叫端不可再使用該陣列"""
+        with self._lock:
+            if self._issued.get(id(array)) is not array:
+                return
+            del self._issued[id(array)]
+            if array.nbytes > self.max_bytes:
+                return
+            key = (array.shape, array.dtype.str)
+            self._free.setdefault(key, []).append(array)
+            self._free.move_to_end(key)
+            self._free_bytes += array.nbytes
+            while self._free_bytes > self.max_bytes:
+                oldest, buffers = next(iter(self._free.items()))
+                self._free_bytes -= buffers.pop(0).nbytes
+                if not buffers:
+                    del self._free[oldest]
+
+    def report(self) -> str:
+        with self._lock:
+            allocations, reuses = self.allocations, self.reuses
+        if allocations + reuses == 0:
+            return "緩衝區池 - 未使用"
+        return (f"緩衝區池 - 配置 {allocations} 次，重複使用 {reuses} 次"
+                f"（{reuses / (allocations + reuses):.0%}）")
@@ -0,0 +1,216 @@
+from typing import Optional
+import cv2
+import numpy as np
+from numba import jit
+from segmentation import CUTOUT_TABLE, cutout
+from white_balance import channel_histograms, multiple_white_balance_lut, sampled_channel_histograms
+
+# OpenCV 8 位元 BGR -> HSV 使用的定點除法表（H 範圍 0-180）
+HSV_SHIFT = 12
+_SDIV_TABLE = np.array([0] + [round((255 << HSV_SHIFT) / i) for i in range(1, 256)], dtype=np.int64)
+_HDIV_TABLE = np.array([0] + [round((180 << HSV_SHIFT) / (6 * i)) for i in range(1, 256)], dtype=np.int64)
+
+def _composite_table() -> np.ndarray:
+    """
+    與白色背景合成的查表 [alpha, 像素值]，與 fill_white_background 的浮點運算
+    clip((1 - a / 255) * 255 + a / 255 * 像素值) 截斷取整的結果相同，逐像素運算只需整數查表。
+    """
+    alpha_factor = np.arange(256)[:, None] / 255.0
+    pixel = np.arange(256, dtype=np.uint8)[None, :]
+    return np.clip((1 - alpha_factor) * 255 + alpha_factor * pixel, 0, 255).astype(np.uint8)
+
+_COMPOSITE_TABLE = _composite_table()
+
+def _hsv2bgr_simd_width() -> int:
+    """
+    cv2.COLOR_HSV2BGR 在每列中以 SIMD 處理整數倍區塊寬度的像素並截斷取整，
+    剩下的尾端像素則以純量程式四捨五入。區塊寬度依 CPU 指令集而定，以探測取得；沒有截斷行為時回傳 0。
+    """
+    probe = np.array([4, 255, 7], dtype=np.uint8)  # G 通道為 0.93：截斷得 0，四捨五入得 1
+    for width in range(1, 257):
+        row = np.tile(probe, (1, width, 1))
+        if cv2.cvtColor(row, cv2.COLOR_HSV2BGR)[0, 0, 1] == 0:
+            return width
+    return 0
+
+HSV2BGR_SIMD_WIDTH = _hsv2bgr_simd_width()
+
+def scale_lut(factor: float) -> np.ndarray:
+    """x -> clip(x * factor) 的查表，與 np.clip(uint8 陣列 * factor, 0, 255).astype(np.uint8) 相同"""
+    return np.clip(np.arange(256, dtype=np.uint8) * factor, 0, 255).astype(np.uint8)
+
+@jit(nopython=True, nogil=True, cache=True)
+def _render_pass(image, wb_lut, saturation_lut, brightness_lut, composite_table, sdiv_table, hdiv_table, simd_width, out):
+    simd_end = (image.shape[1] // simd_width) * simd_width if simd_width > 0 else 0
+    half = 1 << (HSV_SHIFT - 1)
+    hscale = np.float32(6.0 / 180.0)
+    inv255 = np.float32(1.0 / 255.0)
+    one = np.float32(1.0)
+    tab = np.empty(4, dtype=np.float32)
+    for i in range(image.shape[0]):
+        for j in range(image.shape[1]):
+            # 白平衡
+            b = np.int64(wb_lut[0, image[i, j, 0]])
+            g = np.int64(wb_lut[1, image[i, j, 1]])
+            r = np.int64(wb_lut[2, image[i, j, 2]])
+
+            # BGR -> HSV（與 cv2.COLOR_BGR2HSV 相同的整數運算）
+            v = max(b, g, r)
+            diff = v - min(b, g, r)
+            s = (diff * sdiv_table[v] + half) >> HSV_SHIFT
+            if v == r:
+                h = g - b
+            elif v == g:
+                h = b - r + 2 * diff
+            else:
+                h = r - g + 4 * diff
+            h = (h * hdiv_table[diff] + half) >> HSV_SHIFT
+            if h < 0:
+                h += 180
+
+            # 提升飽和度
+            s = saturation_lut[s]
+
+            # HSV -> BGR（與 cv2.COLOR_HSV2BGR 相同的單精度運算，1 - s * h 為融合乘加）
+            sf = np.float32(s) * inv255
+            vf = np.float32(v) * inv255
+            if s == 0:
+                bf = gf = rf = vf
+            else:
+                hf = np.float32(h) * hscale
+                if hf >= 6:
+                    hf -= np.float32(6.0)
+                sector = int(np.floor(hf))
+                hf -= np.float32(sector)
+                tab[0] = vf
+                tab[1] = vf * (one - sf)
+                tab[2] = vf * np.float32(1.0 - np.float64(sf) * np.float64(hf))
+                tab[3] = vf * np.float32(1.0 - np.float64(sf) * np.float64(one - hf))
+                if sector == 0:
+                    bf, gf, rf = tab[1], tab[3], tab[0]
+                elif sector == 1:
+                    bf, gf, rf = tab[1], tab[0], tab[2]
+                elif sector == 2:
+                    bf, gf, rf = tab[3], tab[0], tab[1]
+                elif sector == 3:
+                    bf, gf, rf = tab[0], tab[2], tab[1]
+                elif sector == 4:
+                    bf, gf, rf = tab[0], tab[1], tab[3]
+                else:
+                    bf, gf, rf = tab[2], tab[1], tab[0]
+
+            # 調高亮度後與白色背景依 alpha 合成（兩者皆為整數查表）
+            composite = composite_table[image[i, j, 3]]
+            for c, value in enumerate((bf, gf, rf)):
+                value *= np.float32(255.0)
+                out[i, j, c] = composite[brightness_lut[min(int(value) if j < simd_end else round(value), 255)]]
+    return out
+
+@jit(nopython=True, nogil=True, cache=True)
+def _masked_histograms(image, mask, cutout_table, step):
+    """
+    不產生去背圖片，直接統計去背後（顏色乘上 alpha，與 cutout 相同的查表）前三個通道的直方圖。
+    step 為 1 時統計所有像素，與對去背圖片呼叫 channel_histograms 相同；
+    step 大於 1 時每隔 step 個像素取樣且只統計前景，與 sampled_channel_histograms 相同。
+    """
+    hist = np.zeros((3, 256), dtype=np.int64)
+    for i in range(0, image.shape[0], step):
+        for j in range(0, image.shape[1], step):
+            if step > 1 and mask[i, j] == 0:
+                continue
+            row = cutout_table[mask[i, j]]
+            for c in range(3):
+                hist[c, row[image[i, j, c]]] += 1
+    return hist
+
+def white_balance_histograms(image: np.ndarray, stats_side: int = 0) -> np.ndarray:
+    """白平衡統計用的直方圖；stats_side > 0 時依長邊取樣，沒有取樣到前景時退回完整統計"""
+    step = max(image.shape[0], image.shape[1]) // stats_side if stats_side > 0 else 1
+    if step > 1:
+        hist = sampled_channel_histograms(image, step)
+        if hist[0].sum() > 0:
+            return hist
+    return channel_histograms(image)
+
+def white_balance_lut(image: np.ndarray, stats_side: int = 0) -> np.ndarray:
+    """去背後 BGRA 圖片的多重白平衡查表 (3, 256)，可先行算出後傳給 render_white_background 的 wb_lut"""
+    return multiple_white_balance_lut(white_balance_histograms(image, stats_side))
+
+def masked_white_balance_lut(image: np.ndarray, mask: np.ndarray, stats_side: int = 0) -> np.ndarray:
+    """與 white_balance_lut(cutout(image, mask), stats_side) 相同，但不產生去背圖片"""
+    step = max(image.shape[0], image.shape[1]) // stats_side if stats_side > 0 else 1
+    hist = _masked_histograms(image, mask, CUTOUT_TABLE, step) if step > 1 else None
+    if hist is None or hist[0].sum() == 0:
+        hist = _masked_histograms(image, mask, CUTOUT_TABLE, 1)
+    return multiple_white_balance_lut(hist)
+
+def render_white_background(
+    image: np.ndarray,
+    saturation_scale: float,
+    brightness_multiplier: float,
+    out: Optional[np.ndarray] = None,
+    stats_side: int = 0,
+    wb_lut: Optional[np.ndarray] = None
+) -> np.ndarray:
+    """
+    融合管線：將去背後的 BGRA 圖片依序套用多重白平衡、提升飽和度、調高亮度並填充白色背景。
+    先掃描一次統計直方圖，再以一次逐像素運算寫出最終的白底 BGR 圖片，
+    結果與逐步呼叫 apply_multiple_white_balance、increase_saturation、adjust_brightness、fill_white_background 相同（誤差 ±1）。
+    可傳入 out 直接寫入既有的 (H, W, 3) uint8 緩衝區。
+    stats_side > 0 時，白平衡統計只取樣約 stats_side x stats_side 個前景像素；
+    傳入 wb_lut 時直接使用該白平衡查表，不再統計。
+    """
+    if wb_lut is None:
+        wb_lut = white_balance_lut(image, stats_side)
+    if out is None:
+        out = np.empty((image.shape[0], image.shape[1], 3), dtype=np.uint8)
+    return _render_pass(
+        image,
+        wb_lut,
+        scale_lut(saturation_scale),
+        scale_lut(brightness_multiplier),
+        _COMPOSITE_TABLE,
+        _SDIV_TABLE,
+        _HDIV_TABLE,
+        HSV2BGR_SIMD_WIDTH,
+        out
+    )
+
+def render_white_background_tiled(
+    image: np.ndarray,
+    mask: np.ndarray,
+    saturation_scale: float,
+    brightness_multiplier: float,
+    out: Optional[np.ndarray] = None,
+    stats_side: int = 0,
+    tile_rows: int = 256,
+    wb_lut: Optional[np.ndarray] = None
+) -> np.ndarray:
+    """
+    分塊版的 render_white_background：輸入去背前的 BGR 圖片與遮罩，不產生完整的 BGRA 去背圖片。
+    先以一次串流掃描統計白平衡直方圖（已傳入 wb_lut 時略過），再每次取 tile_rows 列去背到重複使用的小緩衝區，調色後寫入 out 的對應列。
+    除了輸入與輸出之外，額外的記憶體只有一個 (tile_rows, W, 4) 的緩衝區，結果與 render_white_background(cutout(image, mask)) 完全相同。
+    """
+    height, width = image.shape[:2]
+    if wb_lut is None:
+        wb_lut = masked_white_balance_lut(image, mask, stats_side)
+    saturation_lut = scale_lut(saturation_scale)
+    brightness_lut = scale_lut(brightness_multiplier)
+    if out is None:
+        out = np.empty((height, width, 3), dtype=np.uint8)
+    tile = np.empty((min(tile_rows, height), width, 4), dtype=np.uint8)
+    for top in range(0, height, tile_rows):
+        bottom = min(top + tile_rows, height)
+        band = cutout(image[top:bottom], mask[top:bottom], tile[:bottom - top])
+        _render_pass(
+            band,
+            wb_lut,
+            saturation_lut,
+            brightness_lut,
+            _COMPOSITE_TABLE,
+            _SDIV_TABLE,
+            _HDIV_TABLE,
+            HSV2BGR_SIMD_WIDTH,
+            out[top:bottom]
+        )
+    return out
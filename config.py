@@ -0,0 +1,86 @@
+import os
+
+# ItemGlow 執行設定，皆可透過環境變數覆寫
+
+def _env_int(name: str, default: int) -> int:
+    value = os.getenv(name)
+    return int(value) if value else default
+
+# 去背模型名稱（models.MODEL_REGISTRY 中的模型，例如 u2netp 或 INT8 量化的 u2net-int8，或任一 rembg 的 session 名稱）
+MODEL_NAME = os.getenv("ITEMGLOW_MODEL", "u2net")
+
+# 去背模型 session 池大小：每個 session 各自持有一份模型，數量越多記憶體用量越大
+SESSION_POOL_SIZE = _env_int("ITEMGLOW_SESSION_POOL_SIZE", max(1, min(4, os.cpu_count() or 1)))
+
+# 共用線程池的工作線程數（與 Python 預設相同）
+EXECUTOR_WORKERS = _env_int("ITEMGLOW_EXECUTOR_WORKERS", min(32, (os.cpu_count() or 1) + 4))
+
+# ONNX Runtime 線程預算：同時推論的 session 數不超過 session 池大小與工作線程數，
+# 預設把 CPU 核心平均分給這些 session，避免每個 session 各自開滿全部核心；inter-op 線程數大於 1 時才平行執行不同運算
+ORT_INTRA_OP_THREADS = _env_int(
+    "ITEMGLOW_ORT_INTRA_OP_THREADS", max(1, (os.cpu_count() or 1) // max(1, min(SESSION_POOL_SIZE, EXECUTOR_WORKERS)))
+)
+ORT_INTER_OP_THREADS = _env_int("ITEMGLOW_ORT_INTER_OP_THREADS", 1)
+
+# 批次去背：每批最多幾張圖片（設為 1 即停用批次推論），以及湊批時最多等待的毫秒數
+SEGMENT_BATCH_SIZE = _env_int("ITEMGLOW_SEGMENT_BATCH_SIZE", 4)
+SEGMENT_BATCH_MAX_WAIT_MS = _env_int("ITEMGLOW_SEGMENT_BATCH_MAX_WAIT_MS", 20)
+
+# 批次處理時同時處理中的圖片上限：張數與估計記憶體用量 (MB)
+MAX_INFLIGHT_IMAGES = _env_int("ITEMGLOW_MAX_INFLIGHT_IMAGES", 16)
+MAX_INFLIGHT_MB = _env_int("ITEMGLOW_MAX_INFLIGHT_MB", 1024)
+
+# 批次處理各階段之間佇列的長度上限
+STAGE_QUEUE_SIZE = _env_int("ITEMGLOW_STAGE_QUEUE_SIZE", 8)
+
+# 批次處理的執行方式："thread" 在單一行程中以線程池處理，"process" 以多個工作行程處理
+EXECUTION_BACKEND = os.getenv("ITEMGLOW_BACKEND", "thread")
+
+# 多行程模式的工作行程數，以及每個行程的運算線程數
+PROCESS_WORKERS = _env_int("ITEMGLOW_PROCESS_WORKERS", os.cpu_count() or 1)
+THREADS_PER_WORKER = _env_int("ITEMGLOW_THREADS_PER_WORKER", 1)
+
+# 處理結果快取：存放目錄與大小上限 (MB，設為 0 即停用)，以及記憶體中保留的去背遮罩數量
+CACHE_DIR = os.getenv("ITEMGLOW_CACHE_DIR", "cache")
+CACHE_MAX_MB = _env_int("ITEMGLOW_CACHE_MAX_MB", 1024)
+MASK_CACHE_ITEMS = _env_int("ITEMGLOW_MASK_CACHE_ITEMS", 64)
+# Web UI 與 HTTP API 是否使用處理結果快取：使用者上傳圖片的結果會存放在 CACHE_DIR 且不分使用者共用，預設停用
+SERVICE_CACHE = _env_int("ITEMGLOW_SERVICE_CACHE", 0) != 0
+
+# 增量處理：依輸出目錄中的處理紀錄略過輸出已是最新的圖片，中斷後可接續處理 (設為 0 即每次全部重新處理)
+INCREMENTAL = _env_int("ITEMGLOW_INCREMENTAL", 1) != 0
+# 增量處理時是否重新嘗試上次處理失敗的圖片；預設只在檔案有變更時才重新嘗試
+RETRY_FAILED = _env_int("ITEMGLOW_RETRY_FAILED", 0) != 0
+
+# 低解析度模式：去背在長邊縮至此像素數的縮圖上進行、白平衡只取樣約此邊長平方數的前景像素 (設為 0 即停用)
+LOWRES_SIDE = _env_int("ITEMGLOW_LOWRES_SIDE", 0)
+
+# 效能指標：是否記錄，以及提供 Prometheus 格式 /metrics 的連接埠 (設為 0 即不提供)
+METRICS_ENABLED = _env_int("ITEMGLOW_METRICS", 1) != 0
+METRICS_PORT = _env_int("ITEMGLOW_METRICS_PORT", 0)
+
+# Web UI 共用處理服務：每位使用者同時處理中的圖片數上限，以及全體排隊中的圖片數上限 (超過時拒絕新的上傳)
+USER_MAX_INFLIGHT_IMAGES = _env_int("ITEMGLOW_USER_MAX_INFLIGHT_IMAGES", 4)
+MAX_QUEUED_IMAGES = _env_int("ITEMGLOW_MAX_QUEUED_IMAGES", 2000)
+
+# HTTP API：監聽的連接埠，以及單一請求的大小上限 (MB)
+API_PORT = _env_int("ITEMGLOW_API_PORT", 8000)
+API_MAX_UPLOAD_MB = _env_int("ITEMGLOW_API_MAX_UPLOAD_MB", 200)
+
+# 分塊處理：像素數達此百萬像素數的圖片不產生完整的去背圖片，調色與白底合成每次處理 TILE_ROWS 列 (設為 0 即停用，僅 CPU)
+TILED_MIN_MP = _env_int("ITEMGLOW_TILED_MIN_MP", 40)
+TILE_ROWS = _env_int("ITEMGLOW_TILE_ROWS", 256)
+
+# 批次處理時重複使用的去背圖與結果圖緩衝區，閒置緩衝區的總大小上限 (MB，設為 0 即停用)
+BUFFER_POOL_MB = _env_int("ITEMGLOW_BUFFER_POOL_MB", 512)
+
+# 快速去背：alpha 沿用圖片既有的透明度，backdrop 以單色背景的顏色統計產生遮罩，無法明確判斷時才使用去背模型
+# (以逗號分隔，預設 none 即全部使用去背模型；啟用後這些圖片的輸出會與先前版本不同)；以及單色背景的容許色差
+FAST_PATH = [mode.strip() for mode in os.getenv("ITEMGLOW_FAST_PATH", "none").split(",") if mode.strip() not in ("", "none")]
+BACKDROP_TOLERANCE = _env_int("ITEMGLOW_BACKDROP_TOLERANCE", 24)
+
+# 近似重複偵測：批次處理中感知雜湊相近的圖片只去背與統計白平衡一次，同組其他圖片沿用結果；
+# 各組共用結果（遮罩）保留在記憶體中的總大小上限 (MB，預設 0 即停用，僅用於 thread 模式) 與雜湊的漢明距離上限。
+# 誤判為同組的圖片會沿用其他圖片的遮罩與白平衡，因此需明確啟用
+DEDUP_MAX_MB = _env_int("ITEMGLOW_DEDUP_MAX_MB", 0)
+DEDUP_DISTANCE = _env_int("ITEMGLOW_DEDUP_DISTANCE", 4)
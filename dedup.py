@@ -0,0 +1,157 @@
+import asyncio
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Optional
+import cv2
+import numpy as np
+from metrics import metrics
+from segmentation import refine_mask
+
+# 差異雜湊 (dHash) 的邊長，雜湊共 HASH_SIZE * HASH_SIZE 位元；
+# 相鄰像素的亮度差須超過 HASH_MARGIN 才記為 1，單色背景上的雜訊與壓縮失真不會讓位元隨機翻轉
+HASH_SIZE = 8
+HASH_MARGIN = 1
+# 比對顏色用的縮圖邊長，以及同組圖片縮圖各格的通道差異上限：
+# 只換顏色的同款商品或局部不同的照片雜湊可能相同，但遮罩與白平衡統計不能共用；
+# 重新縮放或壓縮的同一張圖片各格差異只有幾個色階
+THUMBNAIL_SIDE = 16
+MAX_THUMBNAIL_DIFFERENCE = 12
+# 同組圖片長寬比的相對差異上限，遮罩才能直接縮放套用
+MAX_ASPECT_DIFFERENCE = 0.01
+
+@dataclass
+class ImageFingerprint:
+    """判斷近似重複用的圖片特徵：感知雜湊、長寬比與彩色縮圖"""
+    hash: int
+    aspect: float
+    thumbnail: np.ndarray
+
+def fingerprint(image: np.ndarray) -> ImageFingerprint:
+    """
+    BGR 圖片的特徵。感知雜湊為差異雜湊：灰階縮圖中每個像素是否明顯比右側相鄰像素暗，
+    與尺寸、壓縮格式與輕微的壓縮失真無關。
+    """
+    height, width = image.shape[:2]
+    thumbnail = cv2.resize(image, (THUMBNAIL_SIDE, THUMBNAIL_SIDE), interpolation=cv2.INTER_AREA)
+    gray = cv2.resize(
+        cv2.cvtColor(thumbnail, cv2.COLOR_BGR2GRAY), (HASH_SIZE + 1, HASH_SIZE), interpolation=cv2.INTER_AREA
+    ).astype(np.int16)
+    bits = np.packbits(gray[:, :-1] + HASH_MARGIN < gray[:, 1:])
+    return ImageFingerprint(int.from_bytes(bits.tobytes(), "big"), width / height, thumbnail)
+
+def rescale_mask(image: np.ndarray, mask: np.ndarray) -> np.ndarray:
+    """
+    同組另一張圖片的遮罩 -> 這張圖片尺寸的遮罩：尺寸相同時直接沿用，縮小時以 INTER_AREA，
+    放大時與低解析度模式相同以導向濾波放大，讓邊緣貼齊這張圖片的細節。
+    """
+    height, width = image.shape[:2]
+    if mask.shape == (height, width):
+        return mask
+    if mask.size > height * width:
+        return cv2.resize(mask, (width, height), interpolation=cv2.INTER_AREA)
+    small = cv2.resize(image, (mask.shape[1], mask.shape[0]), interpolation=cv2.INTER_AREA)
+    return refine_mask(image, small, mask)
+
+class DuplicateGroup:
+    """
+    一組近似重複的圖片：第一張進入去背階段的圖片照常去背並統計白平衡，
+    把遮罩與白平衡查表交給同組的其他圖片沿用。必須在事件迴圈中使用。
+    """
+
+    def __init__(self, group_id: int, fp: ImageFingerprint):
+        self.id = group_id
+        self.fingerprint = fp
+        self.members = 1
+        self.nbytes = 0
+        self._shared: Optional[asyncio.Future] = None
+
+    def claim(self) -> bool:
+        """由第一張呼叫的圖片負責產生共用結果，回傳是否由呼叫者負責"""
+        if self._shared is not None:
+            return False
+        self._shared = asyncio.get_running_loop().create_future()
+        return True
+
+    async def shared(self) -> Optional[tuple[np.ndarray, np.ndarray]]:
+        """等待負責的圖片完成，回傳 (遮罩, 白平衡查表)，無法共用時回傳 None"""
+        return await self._shared
+
+class DuplicateIndex:
+    """
+    批次處理中的近似重複偵測：感知雜湊的漢明距離不超過 max_distance、長寬比相同且縮圖各處顏色相近的圖片歸為同一組，
+    也就是同一張照片的不同尺寸、格式或重新壓縮的版本；構圖不同的重拍照片遮罩無法對齊，不會歸為同一組。
+    各組的共用結果總大小超過 max_bytes 時，先移除最久沒有新成員的組，記憶體用量不會隨輸入數量增加；
+    同一商品的多張照片或多種輸出尺寸通常在目錄中相鄰。
+    """
+
+    def __init__(self, max_bytes: int, max_distance: int, max_groups: int = 1024):
+        self.max_bytes = max_bytes
+        self.max_distance = max_distance
+        self.max_groups = max_groups
+        self._groups: OrderedDict[int, DuplicateGroup] = OrderedDict()
+        self._bytes = 0
+        self._next_id = 0
+        self._lock = threading.Lock()
+        self.grouped = 0
+        self.reused = 0
+
+    def _matches(self, group: DuplicateGroup, fp: ImageFingerprint) -> bool:
+        other = group.fingerprint
+        return (
+            bin(other.hash ^ fp.hash).count("1") <= self.max_distance
+            and abs(other.aspect - fp.aspect) <= MAX_ASPECT_DIFFERENCE * other.aspect
+            and np.abs(other.thumbnail.astype(np.int16) - fp.thumbnail).max() <= MAX_THUMBNAIL_DIFFERENCE
+        )
+
+    def _evict(self, keep: DuplicateGroup) -> None:
+        while len(self._groups) > self.max_groups or self._bytes > self.max_bytes:
+            oldest = next(iter(self._groups.values()))
+            if oldest is keep:
+                break
+            del self._groups[oldest.id]
+            self._bytes -= oldest.nbytes
+
+    def assign(self, fp: ImageFingerprint) -> DuplicateGroup:
+        """把圖片歸入相符的組，沒有相符的組時成立新的一組"""
+        with self._lock:
+            for group in reversed(self._groups.values()):
+                if self._matches(group, fp):
+                    self._groups.move_to_end(group.id)
+                    group.members += 1
+                    if group.members == 2:
+                        self.grouped += 1
+                    return group
+            group = DuplicateGroup(self._next_id, fp)
+            self._next_id += 1
+            self._groups[group.id] = group
+            self._evict(group)
+            return group
+
+    def publish(self, group: DuplicateGroup, mask: Optional[np.ndarray], wb_lut: Optional[np.ndarray]) -> None:
+        """
+        負責的圖片交出共用結果，交給等待中與之後加入的同組圖片；
+        處理失敗時傳入 None，同組的圖片改為各自處理。
+        """
+        if group._shared is None or group._shared.done():
+            return
+        if mask is None or wb_lut is None:
+            group._shared.set_result(None)
+            return
+        group._shared.set_result((mask, wb_lut))
+        with self._lock:
+            if group.id in self._groups:
+                group.nbytes = mask.nbytes + wb_lut.nbytes
+                self._bytes += group.nbytes
+                self._evict(group)
+
+    def record_reuse(self) -> None:
+        """記錄一張沿用同組結果、不需去背與白平衡統計的圖片"""
+        with self._lock:
+            self.reused += 1
+        metrics.count_segmentation("duplicate")
+
+    def report(self) -> str:
+        with self._lock:
+            grouped, reused = self.grouped, self.reused
+        return f"近似重複 - {grouped} 組，其中 {reused} 張沿用同組的去背與白平衡結果"
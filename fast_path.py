@@ -0,0 +1,133 @@
+import threading
+from typing import Iterable, Optional
+import cv2
+import numpy as np
+from numba import jit
+import config
+from metrics import metrics
+from segmentation import downscale
+
+# 可用的快速去背方式："alpha" 沿用圖片既有的透明度，"backdrop" 以單色背景的顏色統計產生遮罩
+FAST_PATH_MODES = ("alpha", "backdrop")
+
+# 既有 alpha 視為有效去背的條件：非不透明的像素與前景像素各至少佔此比例
+MIN_TRANSPARENT_FRACTION = 0.01
+MIN_FOREGROUND_FRACTION = 0.01
+# 單色背景判斷在長邊縮至此像素數的縮圖上進行
+CLASSIFY_SIDE = 256
+# 取樣邊框的寬度（短邊的比例），以及邊框中接近背景色的像素須佔的比例
+BORDER_FRACTION = 0.03
+MIN_BORDER_UNIFORMITY = 0.95
+# 前景佔畫面的比例上限，超過時多半是商品貼齊邊框或背景判斷錯誤
+MAX_FOREGROUND_FRACTION = 0.85
+# 前景中落在過渡帶的像素比例上限，超過表示商品與背景顏色太接近
+MAX_AMBIGUOUS_FRACTION = 0.2
+
+@jit(nopython=True, nogil=True, cache=True)
+def _backdrop_mask_pass(image, color, tolerance, out):
+    """
+    依與背景色的最大通道差異產生遮罩：差異不超過 tolerance 為透明，達 2 * tolerance 為不透明，
+    之間線性過渡，讓邊緣保有半透明。
+    """
+    for i in range(image.shape[0]):
+        for j in range(image.shape[1]):
+            diff = 0
+            for c in range(3):
+                diff = max(diff, abs(np.int64(image[i, j, c]) - color[c]))
+            if diff <= tolerance:
+                out[i, j] = 0
+            elif diff >= 2 * tolerance:
+                out[i, j] = 255
+            else:
+                out[i, j] = ((diff - tolerance) * 255 + tolerance // 2) // tolerance
+    return out
+
+def _border_pixels(image: np.ndarray, width: int) -> np.ndarray:
+    """四邊寬度為 width 的邊框像素 (N, 3)"""
+    return np.concatenate([
+        image[:width].reshape(-1, 3),
+        image[-width:].reshape(-1, 3),
+        image[:, :width].reshape(-1, 3),
+        image[:, -width:].reshape(-1, 3),
+    ])
+
+def _fill_holes(mask: np.ndarray) -> np.ndarray:
+    """不透明前景所包圍、沒有與邊框相連的透明區域（例如商品上接近背景色的部分）設為不透明"""
+    count, labels = cv2.connectedComponents((mask < 255).astype(np.uint8), connectivity=4)
+    background = np.zeros(count, dtype=bool)
+    # 標籤 0 為不透明前景本身
+    background[0] = True
+    background[np.concatenate([labels[0], labels[-1], labels[:, 0], labels[:, -1]])] = True
+    mask[~background[labels]] = 255
+    return mask
+
+class FastPathClassifier:
+    """
+    去背前的快速分類：已有有效透明度的圖片直接沿用 alpha，
+    單色背景（白色或灰色背景紙等）的圖片以邊框顏色統計與門檻產生遮罩，兩者都不需執行去背模型。
+    無法明確判斷的圖片回傳 None，交由模型處理。並統計各方式處理的張數。
+    """
+
+    def __init__(self, modes: Iterable[str], tolerance: int):
+        self.modes = frozenset(modes)
+        unknown = self.modes - set(FAST_PATH_MODES)
+        if unknown:
+            raise ValueError(f"未知的快速去背方式: {', '.join(sorted(unknown))}")
+        if tolerance < 1:
+            raise ValueError(f"背景色容許差異必須大於 0: {tolerance}")
+        self.tolerance = tolerance
+        self.counts = {"alpha": 0, "backdrop": 0, "model": 0}
+        self._lock = threading.Lock()
+
+    @property
+    def uses_alpha(self) -> bool:
+        return "alpha" in self.modes
+
+    def classify(self, image: np.ndarray, alpha: Optional[np.ndarray] = None) -> Optional[tuple[str, np.ndarray]]:
+        """BGR 圖片（與既有的 alpha 通道）-> (處理方式, 原圖尺寸的遮罩)，需要模型時回傳 None"""
+        if alpha is not None and "alpha" in self.modes and self._alpha_is_meaningful(alpha):
+            return "alpha", alpha
+        if "backdrop" in self.modes:
+            mask = self._backdrop_mask(image)
+            if mask is not None:
+                return "backdrop", mask
+        return None
+
+    def _alpha_is_meaningful(self, alpha: np.ndarray) -> bool:
+        small = downscale(alpha, CLASSIFY_SIDE)
+        transparent = np.count_nonzero(small < 255) / small.size
+        foreground = np.count_nonzero(small) / small.size
+        return transparent >= MIN_TRANSPARENT_FRACTION and foreground >= MIN_FOREGROUND_FRACTION
+
+    def _backdrop_mask(self, image: np.ndarray) -> Optional[np.ndarray]:
+        small = downscale(image, CLASSIFY_SIDE)
+        border = _border_pixels(small, max(1, round(min(small.shape[:2]) * BORDER_FRACTION)))
+        color = np.round(np.median(border, axis=0)).astype(np.int64)
+        uniform = np.abs(border.astype(np.int64) - color).max(axis=1) <= self.tolerance
+        if uniform.mean() < MIN_BORDER_UNIFORMITY:
+            return None
+
+        small_mask = _backdrop_mask_pass(small, color, self.tolerance, np.empty(small.shape[:2], dtype=np.uint8))
+        foreground = np.count_nonzero(small_mask)
+        if not MIN_FOREGROUND_FRACTION <= foreground / small_mask.size <= MAX_FOREGROUND_FRACTION:
+            return None
+        if np.count_nonzero(small_mask < 255) - np.count_nonzero(small_mask == 0) > foreground * MAX_AMBIGUOUS_FRACTION:
+            return None
+
+        mask = _backdrop_mask_pass(image, color, self.tolerance, np.empty(image.shape[:2], dtype=np.uint8))
+        return _fill_holes(mask)
+
+    def record(self, method: str) -> None:
+        """記錄一張圖片的去背方式（"alpha"、"backdrop" 或 "model"）"""
+        with self._lock:
+            self.counts[method] += 1
+        metrics.count_segmentation(method)
+
+    def report(self) -> str:
+        with self._lock:
+            counts = dict(self.counts)
+        return (f"去背方式 - 沿用透明度 {counts['alpha']} 張，單色背景 {counts['backdrop']} 張，"
+                f"去背模型 {counts['model']} 張")
+
+# 全域共用的快速分類器
+fast_path = FastPathClassifier(config.FAST_PATH, config.BACKDROP_TOLERANCE)
@@ -0,0 +1,207 @@
+import math
+import threading
+from typing import Optional
+import numpy as np
+from numba import cuda, float32, float64, int64, uint8
+from color_pipeline import HSV_SHIFT, HSV2BGR_SIMD_WIDTH, _HDIV_TABLE, _SDIV_TABLE, scale_lut
+
+THREADS_PER_BLOCK = (16, 16)
+
+@cuda.jit(cache=True)
+def _histogram_kernel(image, step, foreground_only, hist):
+    """每個區塊先在共享記憶體中累計直方圖，再一次加到全域直方圖，減少原子運算的競爭"""
+    local = cuda.shared.array((3, 256), dtype=int64)
+    tid = cuda.threadIdx.x * cuda.blockDim.y + cuda.threadIdx.y
+    nthreads = cuda.blockDim.x * cuda.blockDim.y
+    for k in range(tid, 3 * 256, nthreads):
+        local[k // 256, k % 256] = 0
+    cuda.syncthreads()
+
+    i, j = cuda.grid(2)
+    i *= step
+    j *= step
+    if i < image.shape[0] and j < image.shape[1]:
+        if not (foreground_only and image[i, j, 3] == 0):
+            for c in range(3):
+                cuda.atomic.add(local, (c, image[i, j, c]), 1)
+    cuda.syncthreads()
+
+    for k in range(tid, 3 * 256, nthreads):
+        count = local[k // 256, k % 256]
+        if count > 0:
+            cuda.atomic.add(hist, (k // 256, k % 256), count)
+
+@cuda.jit(cache=True)
+def _white_balance_lut_kernel(hist, lut):
+    """
+    由直方圖推算多重白平衡的查表，與 white_balance.multiple_white_balance_lut 相同。
+    資料量只有 3 x 256，由單一線程完成，結果留在裝置上供調色核心使用。
+    """
+    if cuda.grid(1) != 0:
+        return
+    total = 0
+    for x in range(256):
+        total += hist[0, x]
+    for c in range(3):
+        for x in range(256):
+            lut[c, x] = x
+    if total == 0:
+        return
+
+    gains = cuda.local.array(3, dtype=np.float64)
+    # 依序為白點法、灰度世界、完美反射、自適應
+    for step in range(4):
+        if step % 2 == 0:
+            for c in range(3):
+                max_c = 0
+                for x in range(256):
+                    if hist[c, x] > 0 and lut[c, x] > max_c:
+                        max_c = lut[c, x]
+                gains[c] = 255 / max_c if max_c > 0 else 1.0
+        else:
+            avg_gray = 0.0
+            for c in range(3):
+                acc = 0
+                for x in range(256):
+                    acc += hist[c, x] * int64(lut[c, x])
+                gains[c] = acc / total
+                avg_gray += gains[c]
+            avg_gray /= 3
+            for c in range(3):
+                gains[c] = avg_gray / gains[c] if gains[c] > 0 else 1.0
+        for c in range(3):
+            for x in range(256):
+                lut[c, x] = uint8(min(max(lut[c, x] * gains[c], 0.0), 255.0))
+
+@cuda.jit(cache=True)
+def _render_kernel(image, wb_lut, saturation_lut, brightness_lut, sdiv_table, hdiv_table, simd_width, out):
+    """逐像素套用白平衡、提升飽和度、調高亮度並與白色背景合成，與 color_pipeline._render_pass 相同的運算"""
+    i, j = cuda.grid(2)
+    if i >= image.shape[0] or j >= image.shape[1]:
+        return
+    simd_end = (image.shape[1] // simd_width) * simd_width if simd_width > 0 else 0
+    half = 1 << (HSV_SHIFT - 1)
+
+    # 白平衡
+    b = int64(wb_lut[0, image[i, j, 0]])
+    g = int64(wb_lut[1, image[i, j, 1]])
+    r = int64(wb_lut[2, image[i, j, 2]])
+
+    # BGR -> HSV（與 cv2.COLOR_BGR2HSV 相同的整數運算）
+    v = max(b, g, r)
+    diff = v - min(b, g, r)
+    s = (diff * sdiv_table[v] + half) >> HSV_SHIFT
+    if v == r:
+        h = g - b
+    elif v == g:
+        h = b - r + 2 * diff
+    else:
+        h = r - g + 4 * diff
+    h = (h * hdiv_table[diff] + half) >> HSV_SHIFT
+    if h < 0:
+        h += 180
+
+    # 提升飽和度
+    s = saturation_lut[s]
+
+    # HSV -> BGR（與 cv2.COLOR_HSV2BGR 相同的單精度運算，1 - s * h 為融合乘加）
+    sf = float32(s) * float32(1.0 / 255.0)
+    vf = float32(v) * float32(1.0 / 255.0)
+    tab = cuda.local.array(3, dtype=float32)
+    if s == 0:
+        tab[0] = vf
+        tab[1] = vf
+        tab[2] = vf
+    else:
+        hf = float32(h) * float32(6.0 / 180.0)
+        if hf >= 6:
+            hf -= float32(6.0)
+        sector = int(math.floor(hf))
+        hf -= float32(sector)
+        p = vf * (float32(1.0) - sf)
+        q = vf * float32(1.0 - float64(sf) * float64(hf))
+        t = vf * float32(1.0 - float64(sf) * float64(float32(1.0) - hf))
+        if sector == 0:
+            tab[0], tab[1], tab[2] = p, t, vf
+        elif sector == 1:
+            tab[0], tab[1], tab[2] = p, vf, q
+        elif sector == 2:
+            tab[0], tab[1], tab[2] = t, vf, p
+        elif sector == 3:
+            tab[0], tab[1], tab[2] = vf, q, p
+        elif sector == 4:
+            tab[0], tab[1], tab[2] = vf, p, t
+        else:
+            tab[0], tab[1], tab[2] = q, p, vf
+
+    # 調高亮度後與白色背景依 alpha 合成
+    alpha_factor = image[i, j, 3] / 255.0
+    for c in range(3):
+        value = tab[c] * float32(255.0)
+        pixel = brightness_lut[min(int(value) if j < simd_end else int(round(value)), 255)]
+        out[i, j, c] = uint8(min(max((1 - alpha_factor) * 255 + alpha_factor * pixel, 0.0), 255.0))
+
+# 常數查表只上傳一次，供所有圖片共用
+_device_tables: dict = {}
+_tables_lock = threading.Lock()
+
+def _device_table(key: object, table: np.ndarray):
+    with _tables_lock:
+        if key not in _device_tables:
+            _device_tables[key] = cuda.to_device(table)
+        return _device_tables[key]
+
+def _blocks(height: int, width: int) -> tuple[int, int]:
+    return (math.ceil(height / THREADS_PER_BLOCK[0]), math.ceil(width / THREADS_PER_BLOCK[1]))
+
+def render_white_background_gpu(
+    image: np.ndarray,
+    saturation_scale: float,
+    brightness_multiplier: float,
+    out: Optional[np.ndarray] = None,
+    stats_side: int = 0,
+    wb_lut: Optional[np.ndarray] = None
+) -> np.ndarray:
+    """
+    GPU 版融合管線：去背後的 BGRA 圖片只上傳一次，直方圖統計、白平衡查表推算、
+    調色與白底合成都在裝置上完成，最後只下載白底 BGR 結果，與 CPU 融合管線的結果相同。
+    每次呼叫使用各自的 CUDA stream，多個線程可同時處理不同圖片。
+    stats_side > 0 時，白平衡統計只取樣約 stats_side x stats_side 個前景像素；
+    傳入 wb_lut 時直接上傳該白平衡查表，不再統計。
+    """
+    height, width = image.shape[:2]
+    stream = cuda.stream()
+    device_image = cuda.to_device(np.ascontiguousarray(image), stream=stream)
+
+    if wb_lut is not None:
+        device_lut = cuda.to_device(wb_lut, stream=stream)
+    else:
+        step = max(height, width) // stats_side if stats_side > 0 else 1
+        step = max(step, 1)
+        hist = cuda.to_device(np.zeros((3, 256), dtype=np.int64), stream=stream)
+        _histogram_kernel[_blocks(math.ceil(height / step), math.ceil(width / step)), THREADS_PER_BLOCK, stream](
+            device_image, step, step > 1, hist
+        )
+        if step > 1 and hist.copy_to_host(stream=stream)[0].sum() == 0:
+            # 與 CPU 版相同：沒有取樣到前景時退回完整統計
+            hist = cuda.to_device(np.zeros((3, 256), dtype=np.int64), stream=stream)
+            _histogram_kernel[_blocks(height, width), THREADS_PER_BLOCK, stream](device_image, 1, False, hist)
+        device_lut = cuda.device_array((3, 256), dtype=np.uint8, stream=stream)
+        _white_balance_lut_kernel[1, 1, stream](hist, device_lut)
+
+    result = cuda.device_array((height, width, 3), dtype=np.uint8, stream=stream)
+    _render_kernel[_blocks(height, width), THREADS_PER_BLOCK, stream](
+        device_image,
+        device_lut,
+        _device_table(("saturation", saturation_scale), scale_lut(saturation_scale)),
+        _device_table(("brightness", brightness_multiplier), scale_lut(brightness_multiplier)),
+        _device_table("sdiv", _SDIV_TABLE),
+        _device_table("hdiv", _HDIV_TABLE),
+        HSV2BGR_SIMD_WIDTH,
+        result
+    )
+    if out is None:
+        out = np.empty((height, width, 3), dtype=np.uint8)
+    result.copy_to_host(out, stream=stream)
+    stream.synchronize()
+    return out
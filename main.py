@@ -1,27 +1,110 @@
 import os
 import asyncio
+import time
+import json
+import hashlib
 import aiofiles
 from concurrent.futures import ThreadPoolExecutor
-from rembg import remove
+from dataclasses import dataclass
+from functools import lru_cache, partial
+from io import BytesIO
 import cv2
-from typing import Any
+from PIL import Image
+from typing import Any, Awaitable, Callable, Iterator, Optional, Union
 from tqdm import tqdm
 import numpy as np
-from white_balance import apply_multiple_white_balance
+from white_balance import WHITE_BALANCE_CHAIN, apply_multiple_white_balance
+from color_pipeline import masked_white_balance_lut, render_white_background, render_white_background_tiled, white_balance_lut
+from gpu_pipeline import render_white_background_gpu
+from segmentation import SegmentationBatcher, cutout, downscale, segment_lowres, session_pool, upsample_mask
+from scheduler import InflightLimiter, Stage, StreamingPipeline
+from process_pool import ProcessBackend
+from result_cache import ResultCache
+from buffer_pool import BufferPool
+from dedup import DuplicateGroup, DuplicateIndex, fingerprint, rescale_mask
+from fast_path import fast_path
+from manifest import Manifest
+from metrics import metrics
+import config
 from numba import jit, cuda
 
 # 建立線程池
-executor = ThreadPoolExecutor()
+executor = ThreadPoolExecutor(config.EXECUTOR_WORKERS)
+# 等待執行的工作數，可看出線程池是否已滿載
+metrics.register_gauge("executor_queue_depth", lambda: executor._work_queue.qsize())
 
-# 檢查CUDA支援
-SUPPORT_CUDA = cuda.is_available()
-print(f"CUDA支援狀態: {'可用' if SUPPORT_CUDA else '不可用'}")
+# 支援的圖片副檔名
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.webp')
 
-@jit(nopython=True)
+# 估計每個像素在處理過程中佔用的記憶體：原圖 3、遮罩 1、去背圖 4、結果圖 3 位元組，再加上暫存空間
+ESTIMATED_BYTES_PER_PIXEL = 16
+# 分塊處理不產生完整的去背圖：原圖 3、遮罩 1、結果圖 3 位元組，再加上編碼暫存空間
+TILED_BYTES_PER_PIXEL = 8
+
+# 飽和度與亮度的調整倍率
+SATURATION_SCALE = 1.1
+BRIGHTNESS_MULTIPLIER = 1.3
+
+# 檢查CUDA支援：初始化 CUDA 驅動很慢，第一次需要時才檢查
+@lru_cache(maxsize=None)
+def support_cuda() -> bool:
+    available = cuda.is_available()
+    print(f"CUDA支援狀態: {'可用' if available else '不可用'}")
+    return available
+
+def __getattr__(name: str) -> Any:
+    # 相容舊程式碼的 main.SUPPORT_CUDA
+    if name == "SUPPORT_CUDA":
+        return support_cuda()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+# 處理流程版本：演算法改變而輸出不同時遞增，讓舊的快取失效
+PIPELINE_VERSION = 1
+
+def pipeline_fingerprint() -> str:
+    """所有會影響輸出結果的處理參數"""
+    return json.dumps({
+        "version": PIPELINE_VERSION,
+        "model": config.MODEL_NAME,
+        "white_balance": WHITE_BALANCE_CHAIN,
+        "saturation": SATURATION_SCALE,
+        "brightness": BRIGHTNESS_MULTIPLIER,
+        "lowres": config.LOWRES_SIDE,
+        "fast_path": sorted(fast_path.modes),
+        "backdrop_tolerance": fast_path.tolerance,
+    }, sort_keys=True)
+
+_result_cache: Optional[ResultCache] = None
+
+def get_result_cache() -> Optional[ResultCache]:
+    """取得處理結果快取，第一次使用時才建立；設定大小為 0 時停用並回傳 None"""
+    global _result_cache
+    if _result_cache is None and config.CACHE_MAX_MB > 0:
+        _result_cache = ResultCache(
+            config.CACHE_DIR,
+            config.CACHE_MAX_MB * 1024 * 1024,
+            pipeline_fingerprint(),
+            config.MASK_CACHE_ITEMS
+        )
+    return _result_cache
+
+def mask_cache_key(content_hash: str) -> str:
+    fast_path_key = ",".join(sorted(fast_path.modes))
+    return f"{config.MODEL_NAME}|{config.LOWRES_SIDE}|{fast_path_key}|{fast_path.tolerance}|{content_hash}"
+
+def dedup_enabled() -> bool:
+    """批次處理是否偵測近似重複的圖片（僅限線程池處理方式）"""
+    return config.DEDUP_MAX_MB > 0 and config.EXECUTION_BACKEND != "process"
+
+def tiled_mode(height: int, width: int) -> bool:
+    """是否以分塊處理這張圖片：像素數達 config.TILED_MIN_MP 百萬像素且使用 CPU 處理時"""
+    return 0 < config.TILED_MIN_MP * 1_000_000 <= height * width and not support_cuda()
+
+@jit(nopython=True, cache=True)
 def adjust_brightness(image: np.ndarray, factor: float) -> np.ndarray:
     return np.clip(image * factor, 0, 255).astype(np.uint8)
 
-@jit(nopython=True)
+@jit(nopython=True, cache=True)
 def fill_white_background(result_img: np.ndarray, alpha_factor: np.ndarray) -> np.ndarray:
     white_background = np.ones_like(result_img, dtype=np.uint8) * 255
     for c in range(3):  # RGB 通道
@@ -32,7 +115,7 @@ def fill_white_background(result_img: np.ndarray, alpha_factor: np.ndarray) -> n
         ).astype(np.uint8)
     return white_background
 
-@cuda.jit
+@cuda.jit(cache=True)
 def adjust_brightness_cuda(b, g, r, factor):
     i, j = cuda.grid(2)
     if i < b.shape[0] and j < b.shape[1]:
@@ -40,10 +123,317 @@ def adjust_brightness_cuda(b, g, r, factor):
         g[i, j] = min(g[i, j] * factor, 255)
         r[i, j] = min(r[i, j] * factor, 255)
 
-async def process_image(input_path: str, output_path: str) -> None:
+def render_white_background_cuda(image_np: np.ndarray, saturation_scale: float, brightness_multiplier: float) -> np.ndarray:
+    """舊版 GPU 處理：逐步套用多重白平衡、提升飽和度、調高亮度並填充白色背景，每一步都在主機與裝置間來回傳輸，保留供效能比較"""
+    b, g, r, a = cv2.split(image_np)
+    result_img = apply_multiple_white_balance(cv2.merge([b, g, r]), True)
+
+    # 飽和度
+    result_img = increase_saturation(result_img, saturation_scale)
+
+    # 調高亮度
+    b_device = cuda.to_device(result_img[:, :, 0].astype(np.float32))
+    g_device = cuda.to_device(result_img[:, :, 1].astype(np.float32))
+    r_device = cuda.to_device(result_img[:, :, 2].astype(np.float32))
+
+    threadsperblock = (16, 16)
+    blockspergrid_x = int(np.ceil(result_img.shape[0] / threadsperblock[0]))
+    blockspergrid_y = int(np.ceil(result_img.shape[1] / threadsperblock[1]))
+    blockspergrid = (blockspergrid_x, blockspergrid_y)
+
+    adjust_brightness_cuda[blockspergrid, threadsperblock](b_device, g_device, r_device, brightness_multiplier)
+
+    result_img[:, :, 0] = b_device.copy_to_host().astype(np.uint8)
+    result_img[:, :, 1] = g_device.copy_to_host().astype(np.uint8)
+    result_img[:, :, 2] = r_device.copy_to_host().astype(np.uint8)
+
+    # 填充白色背景
+    alpha_factor = a / 255.0
+    return fill_white_background(result_img, alpha_factor)
+
+def decode_image(data: bytes) -> np.ndarray:
+    """將圖片檔案內容解碼為 BGR 圖片"""
+    image = cv2.imdecode(np.frombuffer(data, np.uint8), cv2.IMREAD_COLOR)
+    if image is None:
+        raise ValueError("無法讀取圖片")
+    return image
+
+# 可帶有透明度、以 IMREAD_UNCHANGED 解碼保留 alpha 的格式
+ALPHA_FORMATS = ("PNG", "WEBP")
+
+# EXIF 方向標記 -> 轉正圖片的運算，與 cv2.IMREAD_COLOR 解碼時相同；IMREAD_UNCHANGED 不會依 EXIF 轉正
+EXIF_ORIENTATION = {
+    2: lambda image: cv2.flip(image, 1),
+    3: lambda image: cv2.rotate(image, cv2.ROTATE_180),
+    4: lambda image: cv2.flip(image, 0),
+    5: cv2.transpose,
+    6: lambda image: cv2.rotate(image, cv2.ROTATE_90_CLOCKWISE),
+    7: lambda image: cv2.flip(cv2.transpose(image), -1),
+    8: lambda image: cv2.rotate(image, cv2.ROTATE_90_COUNTERCLOCKWISE),
+}
+
+def decode_input(data: bytes) -> tuple[np.ndarray, Optional[np.ndarray]]:
+    """
+    解碼輸入圖片為 BGR 圖片與 alpha 通道；啟用沿用透明度的快速去背時，
+    才對檔頭標示有透明度的 PNG、WebP 圖片保留 alpha，並自行依 EXIF 方向轉正，其餘圖片的 alpha 為 None。
+    """
+    if fast_path.uses_alpha:
+        try:
+            with Image.open(BytesIO(data)) as img:
+                has_alpha = img.format in ALPHA_FORMATS and (
+                    img.mode in ("RGBA", "LA", "PA") or "transparency" in img.info
+                )
+                orientation = img.getexif().get(0x0112, 1) if has_alpha else 1
+        except Exception:
+            has_alpha = False
+        if has_alpha:
+            raw = cv2.imdecode(np.frombuffer(data, np.uint8), cv2.IMREAD_UNCHANGED)
+            if raw is not None and orientation in EXIF_ORIENTATION:
+                raw = EXIF_ORIENTATION[orientation](raw)
+            if raw is not None and raw.ndim == 3 and raw.shape[2] == 4:
+                if raw.dtype == np.uint8:
+                    return cv2.cvtColor(raw, cv2.COLOR_BGRA2BGR), np.ascontiguousarray(raw[:, :, 3])
+                if raw.dtype == np.uint16:
+                    # 16 位元圖片的顏色沿用一般解碼的轉換
+                    return decode_image(data), (raw[:, :, 3] >> 8).astype(np.uint8)
+    return decode_image(data), None
+
+def encode_image(image: np.ndarray, ext: str) -> bytes:
+    """依副檔名（如 .jpg、.png、.webp）將圖片編碼為檔案內容"""
+    ok, buffer = cv2.imencode(ext, image)
+    if not ok:
+        raise ValueError(f"無法編碼圖片: {ext}")
+    return buffer.tobytes()
+
+def create_batcher() -> Optional[SegmentationBatcher]:
+    """依設定建立批次去背器，批次大小為 1 時不使用批次推論"""
+    if config.SEGMENT_BATCH_SIZE <= 1:
+        return None
+    return SegmentationBatcher(
+        session_pool,
+        executor,
+        config.SEGMENT_BATCH_SIZE,
+        config.SEGMENT_BATCH_MAX_WAIT_MS / 1000
+    )
+
+def warm_up(load_model: bool = True) -> float:
+    """
+    預熱：預先載入去背模型，並以小圖執行一次去背、調色與編碼，讓 numba 核心在此完成編譯
+    （已有磁碟上的編譯快取時直接載入），第一張實際圖片不必承擔這些時間。回傳耗時（秒）。
+    load_model=False 時只預熱運算核心，可在建置映像檔時預先產生編譯快取。
+    """
+    start = time.perf_counter()
+    image = np.full((64, 64, 3), 220, dtype=np.uint8)
+    cv2.circle(image, (32, 32), 20, (40, 120, 200), -1)
+    mask = np.zeros((64, 64), dtype=np.uint8)
+    cv2.circle(mask, (32, 32), 20, 255, -1)
+
+    if load_model:
+        session_pool.preload()
+        if config.SEGMENT_BATCH_SIZE > 1:
+            session_pool.predict_masks([image])
+        else:
+            session_pool.remove_background(image, config.LOWRES_SIDE)
+
+    small = downscale(image, 32)
+    image_np = segment_lowres(image, small, downscale(mask, 32))
+    for stats_side in (0, 16):
+        result = render_white_background(image_np, SATURATION_SCALE, BRIGHTNESS_MULTIPLIER, stats_side=stats_side)
+        render_white_background_tiled(
+            image, mask, SATURATION_SCALE, BRIGHTNESS_MULTIPLIER, stats_side=stats_side, tile_rows=16
+        )
+        if support_cuda():
+            render_white_background_gpu(image_np, SATURATION_SCALE, BRIGHTNESS_MULTIPLIER, stats_side=stats_side)
+    for ext in (".png", ".jpg", ".webp"):
+        decode_image(encode_image(result, ext))
+    fast_path.classify(image, mask)
+    fast_path.classify(image)
+    return time.perf_counter() - start
+
+async def fast_segment(image: np.ndarray, alpha: Optional[np.ndarray]) -> Optional[np.ndarray]:
+    """快速去背：沿用既有透明度或以單色背景產生遮罩，需要去背模型時回傳 None"""
+    if not fast_path.modes:
+        return None
+    loop = asyncio.get_event_loop()
+    result = await loop.run_in_executor(executor, fast_path.classify, image, alpha)
+    if result is None:
+        return None
+    method, mask = result
+    fast_path.record(method)
+    return mask
+
+async def segment_array(
+    image: np.ndarray,
+    batcher: Optional[SegmentationBatcher] = None,
+    content_hash: Optional[str] = None,
+    out: Optional[np.ndarray] = None,
+    alpha: Optional[np.ndarray] = None
+) -> np.ndarray:
+    """
+    去背：BGR 圖片 -> BGRA 圖片。傳入 batcher 時，去背會與其他圖片合併成批次推論。
+    傳入輸入檔案的 content_hash 時，會先查詢記憶體中的遮罩快取。
+    已有透明度（傳入 alpha）或單色背景的圖片先嘗試快速去背，無法明確判斷時才使用去背模型。
+    config.LOWRES_SIDE > 0 時在縮圖上去背，再把遮罩放大回原圖尺寸。
+    可傳入 out 寫入既有的 (H, W, 4) 緩衝區；直接使用 rembg 結果時不會寫入 out，以回傳值為準。
+    """
+    loop = asyncio.get_event_loop()
+    cache = get_result_cache() if content_hash is not None else None
+    if cache is not None:
+        mask = cache.get_mask(mask_cache_key(content_hash))
+        if mask is not None:
+            return await loop.run_in_executor(executor, cutout, image, mask, out)
+
+    mask = await fast_segment(image, alpha)
+    if mask is not None:
+        image_np = await loop.run_in_executor(executor, cutout, image, mask, out)
+        if cache is not None:
+            cache.put_mask(mask_cache_key(content_hash), mask)
+        return image_np
+
+    fast_path.record("model")
+    if batcher is not None:
+        # 批次去背：遮罩由批次推論產生，直接套用到圖片上
+        small = await loop.run_in_executor(executor, downscale, image, config.LOWRES_SIDE)
+        mask = await batcher.segment(small)
+        image_np = await loop.run_in_executor(executor, segment_lowres, image, small, mask, out)
+    else:
+        # 在線程池中執行耗時的去背（去背模型由 session 池提供，不會每張重新載入）
+        image_np = await loop.run_in_executor(
+            executor, session_pool.remove_background, image, config.LOWRES_SIDE, out
+        )
+
+    if cache is not None:
+        cache.put_mask(mask_cache_key(content_hash), image_np[:, :, 3].copy())
+    return image_np
+
+async def segment_mask(
+    image: np.ndarray,
+    batcher: Optional[SegmentationBatcher] = None,
+    content_hash: Optional[str] = None,
+    alpha: Optional[np.ndarray] = None
+) -> np.ndarray:
+    """
+    分塊處理用的去背：BGR 圖片 -> 原圖尺寸的遮罩，不產生完整的 BGRA 去背圖片。
+    遮罩快取、快速去背與低解析度模式的行為與 segment_array 相同。
+    """
+    loop = asyncio.get_event_loop()
+    cache = get_result_cache() if content_hash is not None else None
+    if cache is not None:
+        mask = cache.get_mask(mask_cache_key(content_hash))
+        if mask is not None:
+            return mask
+
+    mask = await fast_segment(image, alpha)
+    if mask is None:
+        fast_path.record("model")
+        if batcher is not None:
+            small = await loop.run_in_executor(executor, downscale, image, config.LOWRES_SIDE)
+            small_mask = await batcher.segment(small)
+            mask = await loop.run_in_executor(executor, upsample_mask, image, small, small_mask)
+        else:
+            mask = await loop.run_in_executor(executor, session_pool.segment_mask, image, config.LOWRES_SIDE)
+
+    if cache is not None:
+        cache.put_mask(mask_cache_key(content_hash), mask)
+    return mask
+
+async def render_array(
+    image_np: np.ndarray, out: Optional[np.ndarray] = None, wb_lut: Optional[np.ndarray] = None
+) -> np.ndarray:
+    """
+    調色：BGRA 去背圖片 -> 白底 BGR 圖片。
+    自動決定使用 GPU 或 CPU 處理，兩者都以融合管線一次完成調色與白底合成，結果相同；
+    GPU 版只上傳與下載圖片各一次。可傳入 out 寫入既有的 (H, W, 3) 緩衝區，
+    傳入 wb_lut 時沿用該白平衡查表，不再統計。
+    """
+    print("使用CUDA加速" if support_cuda() else "使用CPU處理圖片")
+
+    # 在線程池中處理圖片
+    loop = asyncio.get_event_loop()
+    render = render_white_background_gpu if support_cuda() else render_white_background
+    return await loop.run_in_executor(
+        executor,
+        partial(render, out=out, stats_side=config.LOWRES_SIDE, wb_lut=wb_lut),
+        image_np,
+        SATURATION_SCALE,
+        BRIGHTNESS_MULTIPLIER
+    )
+
+async def render_tiled(
+    image: np.ndarray, mask: np.ndarray, out: Optional[np.ndarray] = None, wb_lut: Optional[np.ndarray] = None
+) -> np.ndarray:
+    """分塊調色：BGR 圖片與遮罩 -> 白底 BGR 圖片，結果與 render_array 相同"""
+    loop = asyncio.get_event_loop()
+    return await loop.run_in_executor(
+        executor,
+        partial(
+            render_white_background_tiled,
+            out=out, stats_side=config.LOWRES_SIDE, tile_rows=config.TILE_ROWS, wb_lut=wb_lut
+        ),
+        image,
+        mask,
+        SATURATION_SCALE,
+        BRIGHTNESS_MULTIPLIER
+    )
+
+async def process_array(image: np.ndarray, batcher: Optional[SegmentationBatcher] = None) -> np.ndarray:
+    """
+    非同步處理已解碼的 BGR 圖片：去背、白點法白平衡、適度提升飽和度、提高亮度，最後填充白色背景。
+    去背結果以 BGRA 陣列直接交給調色步驟，不經過 PNG 編解碼。
+    """
+    image_np = await segment_array(image, batcher)
+    return await render_array(image_np)
+
+async def process_bytes(
+    data: bytes, ext: str = ".png", batcher: Optional[SegmentationBatcher] = None, use_cache: bool = True
+) -> bytes:
+    """
+    在記憶體中處理圖片：輸入圖片檔案內容，回傳依 ext 編碼後的結果。
+    use_cache 為 True 時，相同內容與參數的圖片直接回傳快取中的結果。各階段耗時記錄在 metrics 中。
+    """
+    loop = asyncio.get_event_loop()
+    cache = get_result_cache() if use_cache else None
+    content_hash = None
+    metrics.add_bytes("in", len(data))
+    with metrics.track_inflight(), metrics.timer("total"):
+        try:
+            if cache is not None:
+                with metrics.timer("cache_lookup"):
+                    content_hash = await loop.run_in_executor(executor, ResultCache.content_hash, data)
+                    output = await loop.run_in_executor(executor, cache.get, cache.key(content_hash, ext))
+                if output is not None:
+                    metrics.add_bytes("out", len(output))
+                    metrics.count_image()
+                    return output
+
+            with metrics.timer("decode"):
+                image, alpha = await loop.run_in_executor(executor, decode_input, data)
+            tiled = tiled_mode(*image.shape[:2])
+            with metrics.timer("segment"):
+                if tiled:
+                    mask = await segment_mask(image, batcher, content_hash, alpha)
+                else:
+                    image_np = await segment_array(image, batcher, content_hash, alpha=alpha)
+            with metrics.timer("render"):
+                white_background = await (render_tiled(image, mask) if tiled else render_array(image_np))
+            # 編碼前先釋放原圖與去背結果，降低記憶體峰值
+            image = alpha = mask = image_np = None
+            with metrics.timer("encode"):
+                output = await loop.run_in_executor(executor, encode_image, white_background, ext)
+        except Exception as e:
+            metrics.count_error(e)
+            raise
+
+    if cache is not None:
+        await loop.run_in_executor(executor, cache.put, cache.key(content_hash, ext), output)
+    metrics.add_bytes("out", len(output))
+    metrics.count_image()
+    return output
+
+async def process_image(input_path: str, output_path: str, batcher: Optional[SegmentationBatcher] = None) -> None:
     """
-    非同步處理圖片：去背、白點法白平衡、適度提升飽和度、提高亮度，最後填充白色背景。
-    自動決定使用 GPU 或 CPU 處理。
+    非同步處理圖片檔案，輸出格式依 output_path 的副檔名而定。
+    每張圖片只讀取與解碼一次，處理流程見 process_array。
     """
     try:
         if not os.path.exists(input_path):
@@ -52,80 +442,14 @@ async def process_image(input_path: str, output_path: str) -> None:
         # 確保輸出目錄存在
         os.makedirs(os.path.dirname(output_path), exist_ok=True)
 
-        # 讀取圖片
-        image = cv2.imread(input_path)
-        if image is None:
-            raise ValueError(f"無法讀取圖片: {input_path}")
-
         # 非同步讀取檔案
         async with aiofiles.open(input_path, "rb") as f:
             input_image = await f.read()
 
-        # 在線程池中執行耗時的圖片處理
-        loop = asyncio.get_event_loop()
-        output_image = await loop.run_in_executor(executor, remove, input_image)
-        image_np = await loop.run_in_executor(
-            executor,
-            lambda: cv2.imdecode(np.frombuffer(output_image, np.uint8), cv2.IMREAD_UNCHANGED)
-        )
-        
-        print("使用CUDA加速" if SUPPORT_CUDA else "使用CPU處理圖片")
-
-        # 在線程池中處理圖片
-        if len(image_np.shape) == 3 and image_np.shape[2] == 4:  # RGBA 圖片
-            b, g, r, a = cv2.split(image_np)
-            result_img = await loop.run_in_executor(
-                executor,
-                apply_multiple_white_balance,
-                cv2.merge([b, g, r]),
-                SUPPORT_CUDA
-            )
-
-            # 飽和度
-            result_img = await loop.run_in_executor(
-                executor,
-                increase_saturation,
-                result_img,
-                1.1
-            )
-            
-            # 調高亮度
-            brightness_multiplier = 1.3
-            if SUPPORT_CUDA:
-                b_device = cuda.to_device(result_img[:, :, 0].astype(np.float32))
-                g_device = cuda.to_device(result_img[:, :, 1].astype(np.float32))
-                r_device = cuda.to_device(result_img[:, :, 2].astype(np.float32))
-
-                threadsperblock = (16, 16)
-                blockspergrid_x = int(np.ceil(result_img.shape[0] / threadsperblock[0]))
-                blockspergrid_y = int(np.ceil(result_img.shape[1] / threadsperblock[1]))
-                blockspergrid = (blockspergrid_x, blockspergrid_y)
-
-                adjust_brightness_cuda[blockspergrid, threadsperblock](b_device, g_device, r_device, brightness_multiplier)
-
-                result_img[:, :, 0] = b_device.copy_to_host().astype(np.uint8)
-                result_img[:, :, 1] = g_device.copy_to_host().astype(np.uint8)
-                result_img[:, :, 2] = r_device.copy_to_host().astype(np.uint8)
-            else:
-                result_img = await loop.run_in_executor(
-                    executor,
-                    adjust_brightness,
-                    result_img,
-                    brightness_multiplier
-                )
-
-            # 填充白色背景
-            alpha_factor = a / 255.0
-            white_background = await loop.run_in_executor(
-                executor,
-                fill_white_background,
-                result_img,
-                alpha_factor
-            )
+        output_image = await process_bytes(input_image, os.path.splitext(output_path)[1], batcher)
 
-            await loop.run_in_executor(executor, cv2.imwrite, output_path, white_background)
-        else:
-            print("圖片格式錯誤，無法處理！")
+        async with aiofiles.open(output_path, "wb") as f:
+            await f.write(output_image)
 
     except Exception as e:
         print(f"處理圖片時發生錯誤 {input_path}: {str(e)}")
@@ -145,43 +469,351 @@ def increase_saturation(image: Any, saturation_scale: float) -> Any:
     hsv = cv2.merge([h, s, v])
     return cv2.cvtColor(hsv, cv2.COLOR_HSV2BGR)
 
-def get_all_images(input_dir: str) -> list[str]:
-    """遞迴搜尋所有圖片檔案"""
-    image_files = []
+def group_results(image: np.ndarray, mask: Optional[np.ndarray] = None) -> tuple[np.ndarray, np.ndarray]:
+    """
+    近似重複組共用的結果：(原圖尺寸的遮罩, 白平衡查表)。
+    image 為去背後的 BGRA 圖片；分塊處理時為原圖，並另外傳入遮罩。
+    """
+    if mask is not None:
+        return mask, masked_white_balance_lut(image, mask, config.LOWRES_SIDE)
+    return image[:, :, 3].copy(), white_balance_lut(image, config.LOWRES_SIDE)
+
+def is_image_file(path: str) -> bool:
+    return path.lower().endswith(IMAGE_EXTENSIONS)
+
+def iter_images(input_dir: str) -> Iterator[str]:
+    """遞迴搜尋圖片檔案，邊搜尋邊回傳"""
     for root, _, files in os.walk(input_dir):
         for file in files:
-            if file.lower().endswith(('.jpg', '.jpeg', '.png', '.webp')):
-                image_files.append(os.path.join(root, file))
-    return image_files
+            if is_image_file(file):
+                yield os.path.join(root, file)
+
+def get_all_images(input_dir: str) -> list[str]:
+    """遞迴搜尋所有圖片檔案"""
+    return list(iter_images(input_dir))
+
+def estimate_image_bytes(source: Union[str, bytes]) -> int:
+    """只讀取檔頭估計處理一張圖片需要的記憶體，source 可為檔案路徑或檔案內容"""
+    try:
+        with Image.open(BytesIO(source) if isinstance(source, bytes) else source) as img:
+            width, height = img.size
+    except Exception:
+        # 無法讀取檔頭時以檔案大小粗估，實際錯誤留待解碼時回報
+        size = len(source) if isinstance(source, bytes) else os.path.getsize(source)
+        return size * ESTIMATED_BYTES_PER_PIXEL
+    if tiled_mode(height, width):
+        return width * height * TILED_BYTES_PER_PIXEL
+    return width * height * ESTIMATED_BYTES_PER_PIXEL
 
-async def process_multiple_images(input_dir: str, output_dir: str) -> None:
-    """批次處理多張圖片"""
+@dataclass
+class ImageJob:
+    """
+    批次處理中的一張圖片，image 依階段依序為原圖、去背圖與結果圖。
+    分塊處理的圖片在去背後 image 仍為原圖，遮罩另存於 mask。
+    近似重複組中由其他圖片負責去背時，遮罩與白平衡查表沿用該圖片的結果。
+    output 為編碼後的結果；命中快取時在解碼階段就會填入，之後的階段直接略過。
+    """
+    input_path: str
+    output_path: str
+    rel_path: str = ""
+    size: int = 0
+    mtime_ns: int = 0
+    image: Optional[np.ndarray] = None
+    mask: Optional[np.ndarray] = None
+    # 輸入圖片既有的 alpha 通道，供快速去背沿用
+    alpha: Optional[np.ndarray] = None
+    # 所屬的近似重複組，以及沿用的白平衡查表
+    group: Optional[DuplicateGroup] = None
+    wb_lut: Optional[np.ndarray] = None
+    # 沿用同組其他圖片的去背與白平衡結果，輸出與單獨處理時不同，不存入處理結果快取
+    reused: bool = False
+    content_hash: Optional[str] = None
+    output: Optional[bytes] = None
+    # image 為緩衝區池借出的陣列時即為該陣列，只歸還由緩衝區池借出的陣列
+    buffer: Optional[np.ndarray] = None
+    # 內容與處理紀錄相同、輸出已是最新（或上次處理失敗且不重新嘗試），不需重新處理
+    up_to_date: bool = False
+
+async def process_multiple_images(
+    input_dir: str, output_dir: str, incremental: Optional[bool] = None, retry_failed: Optional[bool] = None
+) -> None:
+    """
+    批次處理多張圖片：邊搜尋檔案邊處理，依序經過解碼、去背、調色、編碼四個階段。
+    同時處理中的圖片受張數與記憶體上限限制，記憶體用量不會隨輸入數量增加。
+    config.EXECUTION_BACKEND 為 "process" 時，去背與調色改由多個工作行程處理。
+    incremental 為 True 時（預設依 config.INCREMENTAL），依輸出目錄中的處理紀錄略過輸出已是最新的圖片，
+    以及上次處理失敗且沒有變更的圖片；retry_failed 為 True 時（預設依 config.RETRY_FAILED）重新嘗試這些圖片。
+    近似重複的圖片（同一張照片的不同尺寸、格式或重新壓縮的版本，以及構圖幾乎相同的重拍）歸為一組，只有一張執行去背與白平衡統計，
+    其餘沿用其遮罩（縮放至各自的尺寸）與白平衡查表。
+    單張圖片處理失敗時回報並略過，其他圖片照常處理。
+    """
     if not os.path.exists(input_dir):
         raise FileNotFoundError(f"輸入目錄不存在: {input_dir}")
 
     # 確保輸出目錄存在
     os.makedirs(output_dir, exist_ok=True)
 
-    # 取得所有圖片檔案
-    image_files = get_all_images(input_dir)
-    if not image_files:
-        print("未找到任何圖片檔案")
-        return
+    loop = asyncio.get_event_loop()
 
-    print(f"找到 {len(image_files)} 個圖片檔案")
-    
-    # 建立進度條
-    tasks = []
-    with tqdm(total=len(image_files), desc="處理圖片") as pbar:
-        for input_path in image_files:
+    batcher = None
+
+    if incremental is None:
+        incremental = config.INCREMENTAL
+    if retry_failed is None:
+        retry_failed = config.RETRY_FAILED
+    manifest = Manifest(
+        output_dir, hashlib.sha256(pipeline_fingerprint().encode()).hexdigest(), retry_failed
+    ) if incremental else None
+    skipped = 0
+    # 上次處理失敗且沒有變更、這次略過的圖片數
+    skipped_failed = 0
+
+    def skip(rel_path: str) -> None:
+        nonlocal skipped, skipped_failed
+        if manifest.is_failed(rel_path):
+            skipped_failed += 1
+        else:
+            skipped += 1
+
+    def jobs() -> Iterator[ImageJob]:
+        for input_path in iter_images(input_dir):
             # 保持相同的目錄結構
             rel_path = os.path.relpath(input_path, input_dir)
-            output_path = os.path.join(output_dir, rel_path)
-            task = asyncio.create_task(process_image(input_path, output_path))
-            task.add_done_callback(lambda _: pbar.update(1))
-            tasks.append(task)
-        
-        await asyncio.gather(*tasks)
+            stat = os.stat(input_path)
+            if manifest is not None and manifest.is_up_to_date(rel_path, stat.st_size, stat.st_mtime_ns):
+                skip(rel_path)
+                continue
+            yield ImageJob(input_path, os.path.join(output_dir, rel_path), rel_path, stat.st_size, stat.st_mtime_ns)
+
+    def stage(name: str, fn: Callable[[ImageJob], Awaitable[None]]) -> Callable[[ImageJob], Awaitable[ImageJob]]:
+        """包裝一個階段：記錄耗時；發生錯誤時由管線略過這張圖片並交給 on_error"""
+        async def run(job: ImageJob) -> ImageJob:
+            with metrics.timer(name):
+                await fn(job)
+            return job
+        return run
+
+    cache = get_result_cache()
+    # 去背圖與結果圖的緩衝區在同尺寸的圖片間重複使用
+    buffers = BufferPool(config.BUFFER_POOL_MB * 1024 * 1024)
+    duplicates = DuplicateIndex(config.DEDUP_MAX_MB * 1024 * 1024, config.DEDUP_DISTANCE) if dedup_enabled() else None
+
+    def keep(job: ImageJob, out: np.ndarray) -> None:
+        """job.image 為借出的 out 時記錄在 job.buffer，否則立即歸還 out"""
+        if job.image is out:
+            job.buffer = out
+        else:
+            buffers.release(out)
+
+    def release_buffer(job: ImageJob) -> None:
+        if job.buffer is not None:
+            buffers.release(job.buffer)
+            job.buffer = None
+
+    def output_ext(job: ImageJob) -> str:
+        return os.path.splitext(job.output_path)[1]
+
+    async def decode(job: ImageJob) -> None:
+        async with aiofiles.open(job.input_path, "rb") as f:
+            data = await f.read()
+        metrics.add_bytes("in", len(data))
+        if cache is not None or manifest is not None:
+            job.content_hash = await loop.run_in_executor(executor, ResultCache.content_hash, data)
+        if manifest is not None and manifest.is_content_up_to_date(job.rel_path, job.content_hash, job.size, job.mtime_ns):
+            job.up_to_date = True
+            return
+        if cache is not None:
+            job.output = await loop.run_in_executor(executor, cache.get, cache.key(job.content_hash, output_ext(job)))
+            if job.output is not None:
+                return
+        job.image, job.alpha = await loop.run_in_executor(executor, decode_input, data)
+        if duplicates is not None:
+            job.group = duplicates.assign(await loop.run_in_executor(executor, fingerprint, job.image))
+
+    async def segment_own(job: ImageJob) -> None:
+        height, width = job.image.shape[:2]
+        if tiled_mode(height, width):
+            job.mask = await segment_mask(job.image, batcher, job.content_hash, job.alpha)
+            job.alpha = None
+            return
+        out = buffers.acquire((height, width, 4))
+        try:
+            job.image = await segment_array(job.image, batcher, job.content_hash, out, job.alpha)
+            job.alpha = None
+        finally:
+            keep(job, out)
+
+    async def segment_shared(job: ImageJob, mask: np.ndarray, wb_lut: np.ndarray) -> None:
+        """沿用同組圖片的遮罩與白平衡查表，不執行去背"""
+        height, width = job.image.shape[:2]
+        mask = await loop.run_in_executor(executor, rescale_mask, job.image, mask)
+        job.alpha = None
+        job.wb_lut = wb_lut
+        job.reused = True
+        duplicates.record_reuse()
+        if tiled_mode(height, width):
+            job.mask = mask
+            return
+        out = buffers.acquire((height, width, 4))
+        try:
+            job.image = await loop.run_in_executor(executor, cutout, job.image, mask, out)
+        finally:
+            keep(job, out)
+
+    async def segment(job: ImageJob) -> None:
+        if job.image is None:
+            return
+        group, job.group = job.group, None
+        if group is None:
+            await segment_own(job)
+            return
+        if not group.claim():
+            shared = await group.shared()
+            if shared is not None:
+                await segment_shared(job, *shared)
+                return
+            # 負責的圖片處理失敗，改為自行去背
+            await segment_own(job)
+            return
+        # 第一張進入去背的圖片負責產生同組共用的結果
+        try:
+            await segment_own(job)
+            mask, job.wb_lut = await loop.run_in_executor(executor, group_results, job.image, job.mask)
+        except BaseException:
+            duplicates.publish(group, None, None)
+            raise
+        duplicates.publish(group, mask, job.wb_lut)
+
+    async def render(job: ImageJob) -> None:
+        if job.image is None:
+            return
+        out = buffers.acquire((job.image.shape[0], job.image.shape[1], 3))
+        try:
+            if job.mask is not None:
+                result = await render_tiled(job.image, job.mask, out, job.wb_lut)
+                job.mask = None
+            else:
+                result = await render_array(job.image, out, job.wb_lut)
+            job.wb_lut = None
+        except BaseException:
+            buffers.release(out)
+            raise
+        # 歸還去背圖的緩衝區（分塊處理時 image 為解碼的原圖，沒有借出的緩衝區）
+        release_buffer(job)
+        job.image = result
+        keep(job, out)
+
+    async def encode(job: ImageJob) -> None:
+        if job.up_to_date:
+            return
+        if job.output is None:
+            job.output = await loop.run_in_executor(executor, encode_image, job.image, output_ext(job))
+            release_buffer(job)
+            job.image = None
+            if cache is not None and not job.reused:
+                await loop.run_in_executor(executor, cache.put, cache.key(job.content_hash, output_ext(job)), job.output)
+        os.makedirs(os.path.dirname(job.output_path), exist_ok=True)
+        async with aiofiles.open(job.output_path, "wb") as f:
+            await f.write(job.output)
+        metrics.add_bytes("out", len(job.output))
+        job.output = None
+        if manifest is not None:
+            # 輸出完整寫入後才記錄為完成，中途中斷的圖片下次會重新處理
+            await loop.run_in_executor(
+                executor, manifest.record,
+                job.rel_path, job.size, job.mtime_ns, job.content_hash, job.output_path, "done"
+            )
+
+    cpu_workers = os.cpu_count() or 1
+    if config.EXECUTION_BACKEND == "process":
+        # 多行程模式：去背與調色在工作行程中完成
+        backend = ProcessBackend(
+            config.MODEL_NAME, config.PROCESS_WORKERS, config.THREADS_PER_WORKER, config.LOWRES_SIDE,
+            config.TILED_MIN_MP * 1_000_000, config.TILE_ROWS
+        )
+
+        async def process_in_worker(job: ImageJob) -> None:
+            if job.image is not None:
+                out = buffers.acquire((job.image.shape[0], job.image.shape[1], 3))
+                try:
+                    job.image = await backend.process(
+                        job.image, SATURATION_SCALE, BRIGHTNESS_MULTIPLIER, out, job.alpha
+                    )
+                    job.alpha = None
+                finally:
+                    keep(job, out)
+
+        stages = [
+            Stage("解碼", stage("decode", decode), cpu_workers),
+            Stage("去背與調色", stage("process", process_in_worker), backend.workers),
+            Stage("編碼", stage("encode", encode), cpu_workers),
+        ]
+    else:
+        backend = None
+        # 批次去背
+        batcher = create_batcher()
+        # 批次去背時需要足夠的工作者同時等待，才湊得滿一批
+        segment_workers = max(1, config.SEGMENT_BATCH_SIZE) * session_pool.size
+        stages = [
+            Stage("解碼", stage("decode", decode), cpu_workers),
+            Stage("去背", stage("segment", segment), segment_workers),
+            Stage("調色", stage("render", render), cpu_workers),
+            Stage("編碼", stage("encode", encode), cpu_workers),
+        ]
+
+    limiter = InflightLimiter(config.MAX_INFLIGHT_IMAGES, config.MAX_INFLIGHT_MB * 1024 * 1024)
+    pipeline = StreamingPipeline(stages, config.STAGE_QUEUE_SIZE, limiter)
+    unregister_inflight = metrics.register_gauge("inflight_images", lambda: limiter.items)
+
+    # 建立進度條（總數未知，邊搜尋邊累計），並顯示各階段佇列深度
+    try:
+        with tqdm(desc="處理圖片", unit="張") as pbar:
+            def on_done(job: ImageJob) -> None:
+                if job.up_to_date:
+                    skip(job.rel_path)
+                    return
+                metrics.count_image()
+                pbar.update(1)
+                pbar.set_postfix(pipeline.queue_depths(), refresh=False)
+
+            def on_error(job: ImageJob, error: Exception) -> None:
+                release_buffer(job)
+                metrics.count_error(error)
+                print(f"處理圖片時發生錯誤 {job.input_path}: {str(error)}")
+                if manifest is not None:
+                    manifest.record(job.rel_path, job.size, job.mtime_ns, job.content_hash, job.output_path, "failed")
+
+            await pipeline.run(jobs(), lambda job: estimate_image_bytes(job.input_path), on_done, on_error)
+            processed = pbar.n
+    finally:
+        unregister_inflight()
+        if batcher is not None:
+            await batcher.close()
+        if backend is not None:
+            backend.shutdown()
+        if manifest is not None:
+            manifest.flush()
+
+    if processed == 0 and skipped == 0 and skipped_failed == 0 and pipeline.failed == 0:
+        print("未找到任何圖片檔案")
+        return
+
+    if skipped:
+        print(f"略過 {skipped} 個輸出已是最新的圖片檔案")
+    if skipped_failed:
+        print(f"略過 {skipped_failed} 個上次處理失敗且沒有變更的圖片檔案（設定 ITEMGLOW_RETRY_FAILED=1 可重新嘗試）")
+    print(f"共處理 {processed} 個圖片檔案")
+    if pipeline.failed:
+        print(f"{pipeline.failed} 個圖片檔案處理失敗，已略過")
+    print("各階段佇列最大深度: " + "，".join(f"{name} {depth}" for name, depth in pipeline.max_depths.items()))
+    if backend is None:
+        print(session_pool.timing_report())
+    if cache is not None:
+        print(cache.report())
+    print(fast_path.report())
+    if duplicates is not None:
+        print(duplicates.report())
+    print(buffers.report())
 
 def main():
     input_dir = "input"
@@ -0,0 +1,151 @@
+import json
+import os
+import threading
+import time
+from typing import Any, Optional
+
+# 處理紀錄檔名，存放在輸出目錄中
+MANIFEST_NAME = ".itemglow_manifest.json"
+MANIFEST_VERSION = 1
+
+# 兩次寫入處理紀錄的最短間隔（秒）；中途中斷時最多只會重新處理這段時間內完成的圖片
+FLUSH_INTERVAL = 2.0
+
+class Manifest:
+    """
+    批次處理紀錄：記錄每張輸入圖片的大小、修改時間、內容雜湊、處理參數、輸出路徑與狀態。
+    重新執行時略過輸出已是最新的圖片，中斷後可從上次的進度繼續。
+    上次處理失敗且檔案沒有變更的圖片同樣略過，retry_failed 為 True 時才重新嘗試。
+    紀錄檔以暫存檔加上 os.replace 寫入，寫到一半被中斷時仍保留上一份完整的紀錄。
+    寫入時只在複製紀錄的瞬間持有 _lock，序列化與寫入磁碟期間其他線程照常查詢與記錄。
+    """
+
+    def __init__(self, output_dir: str, params: str, retry_failed: bool = False):
+        self.path = os.path.join(output_dir, MANIFEST_NAME)
+        self.params = params
+        self.retry_failed = retry_failed
+        self._lock = threading.Lock()
+        # 依序寫入紀錄檔，較新的快照不會被較舊的覆蓋
+        self._write_lock = threading.Lock()
+        self._entries: dict[str, dict[str, Any]] = {}
+        self._dirty = False
+        self._last_flush = time.monotonic()
+        self._load()
+
+    def _load(self) -> None:
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+        except FileNotFoundError:
+            return
+        except (OSError, ValueError) as e:
+            print(f"無法讀取處理紀錄 {self.path}，將重新處理所有圖片: {str(e)}")
+            return
+        if data.get("version") == MANIFEST_VERSION:
+            self._entries = data.get("files", {})
+
+    def _output_matches(self, entry: dict[str, Any]) -> bool:
+        try:
+            return os.path.getsize(entry["output"]) == entry["output_size"]
+        except OSError:
+            return False
+
+    def _settled(self, entry: dict[str, Any]) -> bool:
+        """紀錄中的結果不需重新處理：已完成且輸出仍在，或處理失敗且不重新嘗試"""
+        if entry["status"] == "failed":
+            return not self.retry_failed
+        return entry["status"] == "done" and self._output_matches(entry)
+
+    def is_up_to_date(self, rel_path: str, size: int, mtime_ns: int) -> bool:
+        """檔案大小與修改時間都沒變、參數相同且輸出仍在（或上次處理失敗且不重新嘗試）時，視為已是最新"""
+        with self._lock:
+            entry = self._entries.get(rel_path)
+        return (
+            entry is not None
+            and entry["params"] == self.params
+            and entry["size"] == size
+            and entry["mtime_ns"] == mtime_ns
+            and self._settled(entry)
+        )
+
+    def is_failed(self, rel_path: str) -> bool:
+        """紀錄中這張圖片上次是否處理失敗"""
+        with self._lock:
+            entry = self._entries.get(rel_path)
+        return entry is not None and entry["status"] == "failed"
+
+    def is_content_up_to_date(self, rel_path: str, content_hash: str, size: int, mtime_ns: int) -> bool:
+        """
+        修改時間改變但內容相同（例如重新複製檔案）時，以內容雜湊判斷是否已是最新。
+        判斷為最新時順便更新紀錄中的大小與修改時間，下次不必再讀取檔案。
+        """
+        with self._lock:
+            entry = self._entries.get(rel_path)
+            if (
+                entry is None
+                or entry["params"] != self.params
+                or entry["content_hash"] != content_hash
+                or not self._settled(entry)
+            ):
+                return False
+            # 各筆紀錄不就地修改，寫入時淺層複製的快照才會一致
+            self._entries[rel_path] = {**entry, "size": size, "mtime_ns": mtime_ns}
+            self._dirty = True
+        return True
+
+    def record(
+        self,
+        rel_path: str,
+        size: int,
+        mtime_ns: int,
+        content_hash: Optional[str],
+        output_path: str,
+        status: str
+    ) -> None:
+        """記錄一張圖片的處理結果（status 為 "done" 或 "failed"），並視需要寫入紀錄檔"""
+        try:
+            output_size = os.path.getsize(output_path) if status == "done" else None
+        except OSError:
+            output_size = None
+        with self._lock:
+            self._entries[rel_path] = {
+                "size": size,
+                "mtime_ns": mtime_ns,
+                "content_hash": content_hash,
+                "params": self.params,
+                "output": output_path,
+                "output_size": output_size,
+                "status": status,
+            }
+            self._dirty = True
+            due = time.monotonic() - self._last_flush >= FLUSH_INTERVAL
+        if due:
+            # 其他線程正在寫入時不等待，這筆變更由下一次寫入一併寫出
+            self.flush(wait=False)
+
+    def flush(self, wait: bool = True) -> None:
+        """有變更時以原子方式寫入紀錄檔；wait 為 False 時若其他線程正在寫入則直接返回"""
+        if not self._write_lock.acquire(blocking=wait):
+            return
+        try:
+            with self._lock:
+                if not self._dirty:
+                    return
+                entries = dict(self._entries)
+                self._dirty = False
+                self._last_flush = time.monotonic()
+            try:
+                data = json.dumps({"version": MANIFEST_VERSION, "files": entries}, ensure_ascii=False, separators=(",", ":"))
+                tmp_path = f"{self.path}.tmp"
+                with open(tmp_path, "w", encoding="utf-8") as f:
+                    f.write(data)
+                    f.flush()
+                    os.fsync(f.fileno())
+                os.replace(tmp_path, self.path)
+            except BaseException:
+                # 寫入失敗時保留變更，下次再寫
+                with self._lock:
+                    self._dirty = True
+                raise
+        finally:
+            self._write_lock.release()
@@ -0,0 +1,225 @@
+import bisect
+import threading
+import time
+from contextlib import contextmanager, nullcontext
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Callable, Iterator
+import config
+
+# 各階段耗時直方圖的上界（秒）
+STAGE_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+_NULL_TIMER = nullcontext()
+
+class Histogram:
+    """固定上界的耗時直方圖，與 Prometheus histogram 相同的累計方式"""
+
+    def __init__(self, buckets: tuple[float, ...] = STAGE_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def cumulative(self) -> list[tuple[str, int]]:
+        """(上界, 小於等於此上界的次數)，最後一項為 +Inf"""
+        result, total = [], 0
+        for bound, count in zip([*map(str, self.buckets), "+Inf"], self.counts):
+            total += count
+            result.append((bound, total))
+        return result
+
+class _Timer:
+    def __init__(self, metrics: "Metrics", stage: str):
+        self.metrics = metrics
+        self.stage = stage
+
+    def __enter__(self) -> None:
+        self.start = time.perf_counter()
+
+    def __exit__(self, *exc: Any) -> None:
+        self.metrics.observe(self.stage, time.perf_counter() - self.start)
+
+class Metrics:
+    """
+    處理效能指標：各階段耗時直方圖、處理張數、輸入輸出位元組數、依例外類型分類的錯誤數、各去背方式的張數，
+    以及執行時讀取的量測值（線程池佇列深度、處理中的圖片數等）。
+    可透過 snapshot() 在程式中取得，或以 render_prometheus() 輸出 Prometheus 文字格式。
+    停用時所有記錄方法都會立即返回，幾乎沒有額外成本。
+    """
+
+    def __init__(self, enabled: bool = True):
+        self.enabled = enabled
+        self._lock = threading.Lock()
+        self._stages: dict[str, Histogram] = {}
+        self._bytes = {"in": 0, "out": 0}
+        self._images = 0
+        self._errors: dict[str, int] = {}
+        self._segmentation: dict[str, int] = {}
+        self._inflight = 0
+        self._gauges: dict[str, list[Callable[[], float]]] = {}
+
+    def timer(self, stage: str) -> Any:
+        """量測一個階段的耗時：with metrics.timer("decode"): ..."""
+        if not self.enabled:
+            return _NULL_TIMER
+        return _Timer(self, stage)
+
+    def observe(self, stage: str, seconds: float) -> None:
+        if not self.enabled:
+            return
+        with self._lock:
+            histogram = self._stages.get(stage)
+            if histogram is None:
+                histogram = self._stages[stage] = Histogram()
+            histogram.observe(seconds)
+
+    def add_bytes(self, direction: str, nbytes: int) -> None:
+        """累計輸入 ("in") 或輸出 ("out") 的檔案位元組數"""
+        if not self.enabled:
+            return
+        with self._lock:
+            self._bytes[direction] += nbytes
+
+    def count_image(self) -> None:
+        if not self.enabled:
+            return
+        with self._lock:
+            self._images += 1
+
+    def count_error(self, error: BaseException) -> None:
+        if not self.enabled:
+            return
+        name = type(error).__name__
+        with self._lock:
+            self._errors[name] = self._errors.get(name, 0) + 1
+
+    def count_segmentation(self, method: str) -> None:
+        """累計各去背方式（沿用透明度、單色背景、去背模型、沿用近似重複圖片的結果）處理的張數"""
+        if not self.enabled:
+            return
+        with self._lock:
+            self._segmentation[method] = self._segmentation.get(method, 0) + 1
+
+    @contextmanager
+    def track_inflight(self) -> Iterator[None]:
+        """在區塊執行期間將處理中的圖片數加一"""
+        if not self.enabled:
+            yield
+            return
+        with self._lock:
+            self._inflight += 1
+        try:
+            yield
+        finally:
+            with self._lock:
+                self._inflight -= 1
+
+    def register_gauge(self, name: str, read: Callable[[], float]) -> Callable[[], None]:
+        """
+        註冊執行時讀取的量測值，同名的量測值會加總（例如多個批次同時處理中的圖片數）。
+        回傳取消註冊的函式。
+        """
+        with self._lock:
+            self._gauges.setdefault(name, []).append(read)
+
+        def unregister() -> None:
+            with self._lock:
+                self._gauges[name].remove(read)
+
+        return unregister
+
+    def snapshot(self) -> dict[str, Any]:
+        """目前所有指標的數值"""
+        with self._lock:
+            stages = {
+                name: {
+                    "count": histogram.count,
+                    "sum": histogram.sum,
+                    "mean": histogram.sum / histogram.count if histogram.count else 0.0,
+                    "buckets": dict(histogram.cumulative()),
+                }
+                for name, histogram in self._stages.items()
+            }
+            gauges = {name: list(reads) for name, reads in self._gauges.items()}
+            snapshot = {
+                "enabled": self.enabled,
+                "images_processed": self._images,
+                "bytes": dict(self._bytes),
+                "errors": dict(self._errors),
+                "segmentation": dict(self._segmentation),
+                "stages": stages,
+            }
+            inflight = self._inflight
+        # 量測值在鎖外讀取，讀取函式可以自由使用其他鎖
+        values = {name: float(sum(read() for read in reads)) for name, reads in gauges.items()}
+        values["inflight_images"] = values.get("inflight_images", 0.0) + inflight
+        snapshot["gauges"] = values
+        return snapshot
+
+    def render_prometheus(self) -> str:
+        """以 Prometheus 文字格式 (text/plain; version=0.0.4) 輸出所有指標"""
+        snapshot = self.snapshot()
+        lines = [
+            "# HELP itemglow_stage_duration_seconds 各處理階段每張圖片的耗時",
+            "# TYPE itemglow_stage_duration_seconds histogram",
+        ]
+        for stage, data in sorted(snapshot["stages"].items()):
+            for bound, count in data["buckets"].items():
+                lines.append(f'itemglow_stage_duration_seconds_bucket{{stage="{stage}",le="{bound}"}} {count}')
+            lines.append(f'itemglow_stage_duration_seconds_sum{{stage="{stage}"}} {data["sum"]}')
+            lines.append(f'itemglow_stage_duration_seconds_count{{stage="{stage}"}} {data["count"]}')
+        lines += [
+            "# HELP itemglow_images_processed_total 處理完成的圖片數",
+            "# TYPE itemglow_images_processed_total counter",
+            f"itemglow_images_processed_total {snapshot['images_processed']}",
+            "# HELP itemglow_bytes_total 輸入與輸出的圖片檔案位元組數",
+            "# TYPE itemglow_bytes_total counter",
+        ]
+        for direction, nbytes in snapshot["bytes"].items():
+            lines.append(f'itemglow_bytes_total{{direction="{direction}"}} {nbytes}')
+        lines += [
+            "# HELP itemglow_errors_total 依例外類型分類的處理錯誤數",
+            "# TYPE itemglow_errors_total counter",
+        ]
+        for name, count in sorted(snapshot["errors"].items()):
+            lines.append(f'itemglow_errors_total{{type="{name}"}} {count}')
+        lines += [
+            "# HELP itemglow_segmentation_total 依去背方式分類的圖片數",
+            "# TYPE itemglow_segmentation_total counter",
+        ]
+        for method, count in sorted(snapshot["segmentation"].items()):
+            lines.append(f'itemglow_segmentation_total{{method="{method}"}} {count}')
+        for name, value in sorted(snapshot["gauges"].items()):
+            lines += [f"# TYPE itemglow_{name} gauge", f"itemglow_{name} {value}"]
+        return "\n".join(lines) + "\n"
+
+    def serve(self, port: int, host: str = "0.0.0.0") -> ThreadingHTTPServer:
+        """在背景線程啟動 HTTP 伺服器，於 /metrics 提供 Prometheus 文字格式的指標"""
+        metrics = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self) -> None:
+                if self.path.split("?")[0] != "/metrics":
+                    self.send_error(404)
+                    return
+                body = metrics.render_prometheus().encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args: Any) -> None:
+                pass
+
+        server = ThreadingHTTPServer((host, port), Handler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        return server
+
+# 全域指標
+metrics = Metrics(config.METRICS_ENABLED)
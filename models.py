@@ -0,0 +1,109 @@
+import os
+import threading
+from dataclasses import dataclass
+from typing import TYPE_CHECKING, Any
+
+# rembg 與 onnxruntime 載入很慢，等到第一次使用時才匯入
+if TYPE_CHECKING:
+    import onnxruntime as ort
+    from rembg.sessions.base import BaseSession
+
+# U2Net 系列模型：輸入尺寸與正規化參數相同，可批次推論，量化後以 rembg 的 u2net_custom session 載入
+U2NET_FAMILY = {"u2net", "u2netp", "u2net_human_seg", "silueta"}
+# INT8 量化版本的名稱後綴
+QUANTIZED_SUFFIX = "-int8"
+
+@dataclass(frozen=True)
+class ModelSpec:
+    """去背模型：使用哪個 rembg 模型的權重，以及是否使用 INT8 動態量化的版本"""
+    name: str
+    base: str
+    quantized: bool = False
+    description: str = ""
+
+    @property
+    def batchable(self) -> bool:
+        return self.base in U2NET_FAMILY
+
+def _registry() -> dict[str, ModelSpec]:
+    models = [
+        ModelSpec("u2net", "u2net", description="完整 U2Net，約 176 MB（預設）"),
+        ModelSpec("u2netp", "u2netp", description="輕量 U2Net，約 4.7 MB，速度最快"),
+        ModelSpec("silueta", "silueta", description="精簡的 U2Net，約 43 MB"),
+        ModelSpec("u2net_human_seg", "u2net_human_seg", description="人像專用 U2Net"),
+        ModelSpec("isnet-general-use", "isnet-general-use", description="IS-Net 通用模型，邊緣較精細但較慢"),
+    ]
+    models += [
+        ModelSpec(f"{spec.name}{QUANTIZED_SUFFIX}", spec.base, True, f"{spec.name} 的 INT8 量化版本，模型約為四分之一大小")
+        for spec in list(models) if spec.batchable
+    ]
+    return {spec.name: spec for spec in models}
+
+# 已知的去背模型；其他名稱直接視為 rembg 的 session 名稱
+MODEL_REGISTRY = _registry()
+
+def get_model_spec(name: str) -> ModelSpec:
+    spec = MODEL_REGISTRY.get(name)
+    if spec is not None:
+        return spec
+    if name.endswith(QUANTIZED_SUFFIX):
+        raise ValueError(f"只有 U2Net 系列模型提供 INT8 量化版本: {name}")
+    return ModelSpec(name, name)
+
+_quantize_lock = threading.Lock()
+
+def quantize_model(src: str, dst: str) -> None:
+    """以 ONNX Runtime 動態量化把權重轉為 INT8，先寫入暫存檔再改名，中斷時不會留下不完整的模型"""
+    try:
+        from onnxruntime.quantization import QuantType, quantize_dynamic
+    except ImportError as e:
+        raise RuntimeError("INT8 量化需要安裝 onnx 套件：pip install onnx") from e
+    tmp = f"{dst}.{os.getpid()}.tmp"
+    try:
+        quantize_dynamic(src, tmp, weight_type=QuantType.QUInt8)
+        os.replace(tmp, dst)
+    finally:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+
+def quantized_model_path(base: str) -> str:
+    """
+    取得 base 模型 INT8 量化版本的路徑，第一次使用時由原始模型（必要時先由 rembg 下載）量化產生，
+    存放在原始模型旁，之後直接沿用。
+    """
+    from rembg.sessions import sessions_class
+
+    session_class = next((sc for sc in sessions_class if sc.name() == base), None)
+    if session_class is None:
+        raise ValueError(f"找不到去背模型: {base}")
+    src = str(session_class.download_models())
+    dst = os.path.join(os.path.dirname(src), f"{base}{QUANTIZED_SUFFIX}.onnx")
+    with _quantize_lock:
+        if not os.path.exists(dst):
+            print(f"產生 {base} 的 INT8 量化模型: {dst}")
+            quantize_model(src, dst)
+    return dst
+
+def session_options(intra_op_threads: int, inter_op_threads: int) -> "ort.SessionOptions":
+    """
+    ONNX Runtime 的線程設定：intra_op_threads 為單一運算內部的線程數，inter_op_threads 大於 1 時才平行執行不同運算。
+    設為 0 表示由 ONNX Runtime 自行決定（使用全部核心）。
+    """
+    import onnxruntime as ort
+
+    sess_opts = ort.SessionOptions()
+    sess_opts.intra_op_num_threads = intra_op_threads
+    sess_opts.inter_op_num_threads = inter_op_threads
+    sess_opts.execution_mode = (
+        ort.ExecutionMode.ORT_PARALLEL if inter_op_threads > 1 else ort.ExecutionMode.ORT_SEQUENTIAL
+    )
+    return sess_opts
+
+def new_model_session(name: str, sess_opts: "ort.SessionOptions", **kwargs: Any) -> "BaseSession":
+    """依模型名稱建立 rembg session；INT8 量化版本以 u2net_custom session 載入量化後的模型"""
+    from rembg import new_session
+
+    spec = get_model_spec(name)
+    if spec.quantized:
+        return new_session("u2net_custom", sess_opts=sess_opts, model_path=quantized_model_path(spec.base), **kwargs)
+    return new_session(spec.base, sess_opts=sess_opts, **kwargs)
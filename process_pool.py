@@ -0,0 +1,196 @@
+import asyncio
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import suppress
+from multiprocessing.shared_memory import SharedMemory
+from typing import Optional
+import cv2
+import numpy as np
+from color_pipeline import render_white_background, render_white_background_tiled
+from fast_path import FastPathClassifier, fast_path
+from segmentation import SessionPool, cutout
+
+class SharedFrame:
+    """
+    放在共享記憶體中的圖片。傳給其他行程時只序列化名稱、形狀與型別，圖片內容不經過 pickle。
+    建立者負責在用完後呼叫 release() 釋放。
+    """
+
+    def __init__(self, shm: SharedMemory, shape: tuple[int, ...], dtype: np.dtype):
+        self.shm = shm
+        self.shape = shape
+        self.dtype = np.dtype(dtype)
+
+    @classmethod
+    def create(cls, shape: tuple[int, ...], dtype: np.dtype = np.uint8) -> "SharedFrame":
+        size = int(np.prod(shape)) * np.dtype(dtype).itemsize
+        return cls(SharedMemory(create=True, size=max(size, 1)), tuple(shape), dtype)
+
+    @classmethod
+    def from_array(cls, array: np.ndarray) -> "SharedFrame":
+        frame = cls.create(array.shape, array.dtype)
+        frame.array()[...] = array
+        return frame
+
+    @classmethod
+    def attach(cls, name: str, shape: tuple[int, ...], dtype: str) -> "SharedFrame":
+        return cls(SharedMemory(name=name), shape, np.dtype(dtype))
+
+    def __reduce__(self):
+        return (SharedFrame.attach, (self.shm.name, self.shape, self.dtype.str))
+
+    def array(self) -> np.ndarray:
+        """共享記憶體的 ndarray 視圖；呼叫 close() 或 release() 前必須先丟棄所有視圖"""
+        return np.ndarray(self.shape, self.dtype, buffer=self.shm.buf)
+
+    def close(self) -> None:
+        self.shm.close()
+
+    def release(self) -> None:
+        self.shm.close()
+        self.shm.unlink()
+
+# 工作行程中的去背模型，每個行程只載入一次
+_worker_pool: Optional[SessionPool] = None
+_worker_lowres_side = 0
+_worker_tiled_min_pixels = 0
+_worker_tile_rows = 256
+_worker_fast_path: Optional[FastPathClassifier] = None
+
+def _init_worker(
+    model_name: str,
+    threads: int,
+    lowres_side: int,
+    tiled_min_pixels: int,
+    tile_rows: int,
+    fast_path_modes: frozenset[str],
+    backdrop_tolerance: int
+) -> None:
+    global _worker_pool, _worker_lowres_side, _worker_tiled_min_pixels, _worker_tile_rows, _worker_fast_path
+    cv2.setNumThreads(threads)
+    _worker_pool = SessionPool(model_name, 1, intra_op_threads=threads)
+    _worker_pool.preload()
+    _worker_lowres_side = lowres_side
+    _worker_tiled_min_pixels = tiled_min_pixels
+    _worker_tile_rows = tile_rows
+    _worker_fast_path = FastPathClassifier(fast_path_modes, backdrop_tolerance)
+    # 先編譯（或由磁碟快取載入）調色核心，避免第一張圖片承擔這段時間
+    render_white_background(np.zeros((8, 8, 4), dtype=np.uint8), 1.0, 1.0, stats_side=lowres_side)
+    if tiled_min_pixels > 0:
+        render_white_background_tiled(
+            np.zeros((8, 8, 3), dtype=np.uint8), np.zeros((8, 8), dtype=np.uint8), 1.0, 1.0,
+            stats_side=lowres_side, tile_rows=4
+        )
+
+def _render_frame(
+    frame: SharedFrame,
+    result: SharedFrame,
+    saturation_scale: float,
+    brightness_multiplier: float,
+    alpha_frame: Optional[SharedFrame]
+) -> str:
+    image = frame.array()
+    fast = _worker_fast_path.classify(image, alpha_frame.array() if alpha_frame is not None else None)
+    method = fast[0] if fast is not None else "model"
+    if 0 < _worker_tiled_min_pixels <= image.shape[0] * image.shape[1]:
+        # 分塊處理：只產生遮罩，調色與白底合成逐塊寫入結果
+        mask = fast[1] if fast is not None else _worker_pool.segment_mask(image, _worker_lowres_side)
+        render_white_background_tiled(
+            image, mask, saturation_scale, brightness_multiplier, out=result.array(),
+            stats_side=_worker_lowres_side, tile_rows=_worker_tile_rows
+        )
+        return method
+    if fast is not None:
+        image_np = cutout(image, fast[1])
+    else:
+        image_np = _worker_pool.remove_background(image, _worker_lowres_side)
+    render_white_background(
+        image_np, saturation_scale, brightness_multiplier, out=result.array(), stats_side=_worker_lowres_side
+    )
+    return method
+
+def _process_frame(
+    frame: SharedFrame,
+    result: SharedFrame,
+    saturation_scale: float,
+    brightness_multiplier: float,
+    alpha_frame: Optional[SharedFrame] = None
+) -> str:
+    """在工作行程中去背並調色，結果直接寫入 result 的共享記憶體，回傳去背方式"""
+    try:
+        return _render_frame(frame, result, saturation_scale, brightness_multiplier, alpha_frame)
+    finally:
+        # 只關閉對應，共享記憶體由建立者釋放；發生錯誤時 traceback 可能仍引用視圖，留待回收時關閉
+        with suppress(BufferError):
+            frame.close()
+            result.close()
+            if alpha_frame is not None:
+                alpha_frame.close()
+
+class ProcessBackend:
+    """
+    多行程處理：每個工作行程各自載入一次去背模型，並限制自身的運算線程數，
+    圖片透過共享記憶體在行程間傳遞。只使用 CPU 處理。
+    """
+
+    def __init__(
+        self,
+        model_name: str,
+        workers: int,
+        threads_per_worker: int,
+        lowres_side: int = 0,
+        tiled_min_pixels: int = 0,
+        tile_rows: int = 256
+    ):
+        self.workers = workers
+        self.executor = ProcessPoolExecutor(
+            max_workers=workers,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=_init_worker,
+            initargs=(
+                model_name, threads_per_worker, lowres_side, tiled_min_pixels, tile_rows,
+                fast_path.modes, fast_path.tolerance
+            )
+        )
+
+    async def process(
+        self,
+        image: np.ndarray,
+        saturation_scale: float,
+        brightness_multiplier: float,
+        out: Optional[np.ndarray] = None,
+        alpha: Optional[np.ndarray] = None
+    ) -> np.ndarray:
+        """
+        BGR 圖片 -> 白底 BGR 圖片，去背與調色在工作行程中完成。可傳入 out 接收結果，省去另外配置。
+        傳入圖片既有的 alpha 時，工作行程可沿用它而不執行去背模型；各去背方式的張數記錄在 fast_path 中。
+        """
+        loop = asyncio.get_running_loop()
+        frame = SharedFrame.from_array(image)
+        alpha_frame = SharedFrame.from_array(alpha) if alpha is not None else None
+        try:
+            result = SharedFrame.create((image.shape[0], image.shape[1], 3))
+            try:
+                method = await loop.run_in_executor(
+                    self.executor,
+                    _process_frame,
+                    frame,
+                    result,
+                    saturation_scale,
+                    brightness_multiplier,
+                    alpha_frame
+                )
+                fast_path.record(method)
+                if out is None:
+                    return result.array().copy()
+                out[...] = result.array()
+                return out
+            finally:
+                result.release()
+        finally:
+            frame.release()
+            if alpha_frame is not None:
+                alpha_frame.release()
+
+    def shutdown(self) -> None:
+        self.executor.shutdown()
@@ -0,0 +1,133 @@
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+from typing import Optional
+import numpy as np
+
+class ResultCache:
+    """
+    處理結果快取：以輸入檔案內容的雜湊加上處理參數為鍵。
+    結果存放在磁碟上，總大小超過上限時依最久未使用 (LRU) 的順序淘汰；
+    另可在記憶體中保留最近的去背遮罩，參數改變但模型相同時仍可略過去背。
+    """
+
+    def __init__(self, directory: str, max_bytes: int, fingerprint: str, mask_items: int = 0):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.fingerprint = fingerprint
+        self.mask_items = mask_items
+        self.hits = 0
+        self.misses = 0
+        self.mask_hits = 0
+        self.mask_misses = 0
+        self._lock = threading.Lock()
+        self._entries: OrderedDict[str, int] = OrderedDict()
+        self._masks: OrderedDict[str, np.ndarray] = OrderedDict()
+        self._total = 0
+        self._load_index()
+
+    def _load_index(self) -> None:
+        """掃描既有的快取檔案，依修改時間還原使用順序"""
+        os.makedirs(self.directory, exist_ok=True)
+        found = []
+        for root, _, files in os.walk(self.directory):
+            for file in files:
+                if file.endswith(".tmp"):
+                    continue
+                stat = os.stat(os.path.join(root, file))
+                found.append((stat.st_mtime, file, stat.st_size))
+        for _, key, size in sorted(found):
+            self._entries[key] = size
+            self._total += size
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, key[:2], key)
+
+    @staticmethod
+    def content_hash(data: bytes) -> str:
+        return hashlib.sha256(data).hexdigest()
+
+    def key(self, content_hash: str, ext: str) -> str:
+        """結果的快取鍵：輸入內容、處理參數與輸出格式"""
+        return hashlib.sha256(f"{self.fingerprint}|{ext.lower()}|{content_hash}".encode()).hexdigest()
+
+    def get(self, key: str) -> Optional[bytes]:
+        with self._lock:
+            if key not in self._entries:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+        try:
+            with open(self._path(key), "rb") as f:
+                data = f.read()
+            # 以修改時間記錄使用順序，重新啟動後仍可依此淘汰
+            os.utime(self._path(key))
+        except FileNotFoundError:
+            with self._lock:
+                self._total -= self._entries.pop(key, 0)
+                self.misses += 1
+            return None
+        with self._lock:
+            self.hits += 1
+        return data
+
+    def put(self, key: str, data: bytes) -> None:
+        if len(data) > self.max_bytes:
+            return
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+
+        evicted = []
+        with self._lock:
+            self._total += len(data) - self._entries.pop(key, 0)
+            self._entries[key] = len(data)
+            while self._total > self.max_bytes and self._entries:
+                old_key, size = self._entries.popitem(last=False)
+                self._total -= size
+                evicted.append(old_key)
+        for old_key in evicted:
+            try:
+                os.remove(self._path(old_key))
+            except FileNotFoundError:
+                pass
+
+    def get_mask(self, key: str) -> Optional[np.ndarray]:
+        with self._lock:
+            mask = self._masks.get(key)
+            if mask is None:
+                self.mask_misses += 1
+                return None
+            self._masks.move_to_end(key)
+            self.mask_hits += 1
+            return mask
+
+    def put_mask(self, key: str, mask: np.ndarray) -> None:
+        if self.mask_items <= 0:
+            return
+        with self._lock:
+            self._masks[key] = mask
+            self._masks.move_to_end(key)
+            while len(self._masks) > self.mask_items:
+                self._masks.popitem(last=False)
+
+    def stats(self) -> dict[str, int]:
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "mask_hits": self.mask_hits,
+                "mask_misses": self.mask_misses,
+                "entries": len(self._entries),
+                "bytes": self._total,
+            }
+
+    def report(self) -> str:
+        stats = self.stats()
+        return (f"結果快取 - 命中 {stats['hits']}，未命中 {stats['misses']}；"
+                f"遮罩快取 - 命中 {stats['mask_hits']}，未命中 {stats['mask_misses']}；"
+                f"共 {stats['entries']} 筆，{stats['bytes'] / 1024 / 1024:.1f} MB")
@@ -0,0 +1,151 @@
+import asyncio
+from concurrent.futures import BrokenExecutor
+from dataclasses import dataclass
+from typing import Any, Awaitable, Callable, Iterator, Optional
+
+@dataclass
+class Stage:
+    """管線中的一個處理階段：name 用於回報佇列深度，fn 處理一個工作並回傳交給下一階段的工作"""
+    name: str
+    fn: Callable[[Any], Awaitable[Any]]
+    workers: int = 1
+
+class InflightLimiter:
+    """
+    限制同時處理中的圖片數量與估計記憶體用量。
+    單一工作超過記憶體上限時，只要目前沒有其他工作在處理中仍會放行，避免永遠等待。
+    """
+
+    def __init__(self, max_items: int, max_bytes: int):
+        self.max_items = max_items
+        self.max_bytes = max_bytes
+        self.items = 0
+        self.bytes = 0
+        self._condition = asyncio.Condition()
+
+    def _fits(self, nbytes: int) -> bool:
+        if self.items == 0:
+            return True
+        return self.items < self.max_items and self.bytes + nbytes <= self.max_bytes
+
+    async def acquire(self, nbytes: int) -> None:
+        async with self._condition:
+            await self._condition.wait_for(lambda: self._fits(nbytes))
+            self.items += 1
+            self.bytes += nbytes
+
+    async def release(self, nbytes: int) -> None:
+        async with self._condition:
+            self.items -= 1
+            self.bytes -= nbytes
+            self._condition.notify_all()
+
+_STOP = object()
+
+# 基礎設施錯誤：線程池或行程池已無法使用，之後的工作也都會失敗，因此停止整條管線
+FATAL_ERRORS = (BrokenExecutor,)
+
+class StreamingPipeline:
+    """
+    串流式批次排程：逐一取得工作（不預先建立完整清單），依序流經各階段。
+    階段之間以有上限的佇列相連，處理中的工作數與估計記憶體用量受 InflightLimiter 限制，
+    因此記憶體用量與輸入數量無關。
+    單一工作失敗時只略過該工作並交給 on_error，其他工作照常處理；
+    只有取得工作本身失敗或 FATAL_ERRORS 等基礎設施錯誤才停止整條管線並拋出錯誤。
+    """
+
+    def __init__(self, stages: list[Stage], queue_size: int, limiter: InflightLimiter):
+        self.stages = stages
+        self.queue_size = queue_size
+        self.limiter = limiter
+        self.max_depths = {stage.name: 0 for stage in stages}
+        self.failed = 0
+        self._queues: list[asyncio.Queue] = []
+        self._on_error: Optional[Callable[[Any, Exception], None]] = None
+
+    def queue_depths(self) -> dict[str, int]:
+        """各階段輸入佇列目前等待中的工作數"""
+        return {stage.name: queue.qsize() for stage, queue in zip(self.stages, self._queues)}
+
+    async def _put(self, index: int, item: Any) -> None:
+        queue = self._queues[index]
+        await queue.put(item)
+        if item is not _STOP:
+            name = self.stages[index].name
+            self.max_depths[name] = max(self.max_depths[name], queue.qsize())
+
+    async def _fail(self, job: Any, error: Exception, nbytes: Optional[int]) -> None:
+        """一個工作失敗：歸還其額度並交給 on_error，管線繼續處理其他工作"""
+        if nbytes is not None:
+            await self.limiter.release(nbytes)
+        self.failed += 1
+        if self._on_error is not None:
+            self._on_error(job, error)
+
+    async def _produce(self, source: Iterator[Any], cost: Callable[[Any], int]) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            # 檔案搜尋與大小估計會碰到磁碟，放到線程中執行
+            job = await loop.run_in_executor(None, next, source, _STOP)
+            if job is _STOP:
+                break
+            try:
+                nbytes = await loop.run_in_executor(None, cost, job)
+            except Exception as e:
+                # 例如檔案在搜尋後被刪除
+                await self._fail(job, e, None)
+                continue
+            await self.limiter.acquire(nbytes)
+            await self._put(0, (job, nbytes))
+        for _ in range(self.stages[0].workers):
+            await self._put(0, _STOP)
+
+    async def _work(self, index: int, on_done: Optional[Callable[[Any], None]]) -> None:
+        stage = self.stages[index]
+        last = index == len(self.stages) - 1
+        while True:
+            item = await self._queues[index].get()
+            if item is _STOP:
+                return
+            job, nbytes = item
+            try:
+                job = await stage.fn(job)
+            except FATAL_ERRORS:
+                raise
+            except Exception as e:
+                await self._fail(job, e, nbytes)
+                continue
+            if last:
+                await self.limiter.release(nbytes)
+                if on_done is not None:
+                    on_done(job)
+            else:
+                await self._put(index + 1, (job, nbytes))
+
+    async def _run_stage(self, index: int, on_done: Optional[Callable[[Any], None]]) -> None:
+        await asyncio.gather(*(self._work(index, on_done) for _ in range(self.stages[index].workers)))
+        # 此階段全部結束後，通知下一階段的每個工作者停止
+        if index + 1 < len(self.stages):
+            for _ in range(self.stages[index + 1].workers):
+                await self._put(index + 1, _STOP)
+
+    async def run(
+        self,
+        source: Iterator[Any],
+        cost: Callable[[Any], int],
+        on_done: Optional[Callable[[Any], None]] = None,
+        on_error: Optional[Callable[[Any, Exception], None]] = None
+    ) -> None:
+        """處理 source 中的所有工作；on_done 與 on_error 分別在每個工作完成或失敗時呼叫"""
+        self._queues = [asyncio.Queue(self.queue_size) for _ in self.stages]
+        self._on_error = on_error
+        try:
+            async with asyncio.TaskGroup() as group:
+                group.create_task(self._produce(source, cost))
+                for index in range(len(self.stages)):
+                    group.create_task(self._run_stage(index, on_done))
+        except ExceptionGroup as e:
+            # 其餘工作已被取消；只有一個錯誤時直接拋出，否則保留全部錯誤
+            if len(e.exceptions) == 1:
+                raise e.exceptions[0]
+            raise
@@ -0,0 +1,356 @@
+import asyncio
+import queue
+import threading
+import time
+from concurrent.futures import Executor
+from contextlib import contextmanager
+from typing import TYPE_CHECKING, Any, Iterator, Optional
+import cv2
+import numpy as np
+from numba import jit
+from PIL import Image
+import config
+from models import get_model_spec, new_model_session, session_options
+
+# rembg 與 onnxruntime 載入很慢，等到第一次使用時才匯入
+if TYPE_CHECKING:
+    from rembg.sessions.base import BaseSession
+
+# 可批次推論的 U2Net 系列模型的輸入尺寸與正規化參數，與 rembg 相同
+MODEL_INPUT_SIZE = (320, 320)
+_MEAN = np.array([0.485, 0.456, 0.406], dtype=np.float32)
+_STD = np.array([0.229, 0.224, 0.225], dtype=np.float32)
+
+def _preprocess(image: np.ndarray) -> np.ndarray:
+    """
+    BGR 圖片 -> 模型輸入 (3, H, W) float32，與 rembg 的 normalize 相同：
+    以 PIL 的 LANCZOS 縮放（縮小時會先抗鋸齒，cv2.INTER_LANCZOS4 不會）並取整數後再正規化。
+    """
+    rgb = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
+    resized = np.asarray(Image.fromarray(rgb).resize(MODEL_INPUT_SIZE, Image.Resampling.LANCZOS), dtype=np.float32)
+    resized /= max(float(resized.max()), 1e-6)
+    return ((resized - _MEAN) / _STD).transpose(2, 0, 1)
+
+def _postprocess(pred: np.ndarray, shape: tuple[int, ...]) -> np.ndarray:
+    """模型輸出 (H, W) -> 原圖尺寸的 uint8 遮罩"""
+    mi, ma = float(pred.min()), float(pred.max())
+    pred = (pred - mi) / max(ma - mi, 1e-6)
+    mask = (pred.clip(0, 1) * 255).astype(np.uint8)
+    return cv2.resize(mask, (shape[1], shape[0]), interpolation=cv2.INTER_LANCZOS4)
+
+def _cutout_table() -> np.ndarray:
+    """去背的查表 [alpha, 像素值]：像素值 * alpha / 255 以單精度四捨五入，與 rembg.remove 的結果相同"""
+    alpha = np.arange(256, dtype=np.float32)[:, None] * np.float32(1.0 / 255.0)
+    pixel = np.arange(256, dtype=np.float32)[None, :]
+    return (pixel * alpha + np.float32(0.5)).astype(np.uint8)
+
+CUTOUT_TABLE = _cutout_table()
+
+@jit(nopython=True, nogil=True, cache=True)
+def _cutout_pass(image, mask, table, out):
+    for i in range(image.shape[0]):
+        for j in range(image.shape[1]):
+            row = table[mask[i, j]]
+            for c in range(3):
+                out[i, j, c] = row[image[i, j, c]]
+            out[i, j, 3] = mask[i, j]
+    return out
+
+def cutout(image: np.ndarray, mask: np.ndarray, out: Optional[np.ndarray] = None) -> np.ndarray:
+    """
+    以遮罩去背，產生與 rembg.remove 相同的 BGRA 圖片（顏色乘上 alpha），單次逐像素運算寫出結果。
+    可傳入 out 直接寫入既有的 (H, W, 4) uint8 緩衝區。
+    """
+    if out is None:
+        out = np.empty((image.shape[0], image.shape[1], 4), dtype=np.uint8)
+    return _cutout_pass(image, mask, CUTOUT_TABLE, out)
+
+def downscale(image: np.ndarray, max_side: int) -> np.ndarray:
+    """長邊超過 max_side 時等比例縮小（INTER_AREA），否則直接回傳原圖"""
+    height, width = image.shape[:2]
+    scale = max_side / max(height, width)
+    if max_side <= 0 or scale >= 1:
+        return image
+    size = (max(1, round(width * scale)), max(1, round(height * scale)))
+    return cv2.resize(image, size, interpolation=cv2.INTER_AREA)
+
+@jit(nopython=True, nogil=True, cache=True)
+def _guided_upsample_pass(image, coef_a, coef_b, out):
+    """以雙線性內插放大係數並套用到原圖灰階：out = a * 灰階 + b，單次逐像素運算"""
+    height, width = out.shape
+    small_h, small_w = coef_a.shape
+    scale_y = small_h / height
+    scale_x = small_w / width
+    # 每一欄的來源座標與權重只需計算一次
+    x0 = np.empty(width, dtype=np.int64)
+    x1 = np.empty(width, dtype=np.int64)
+    wx = np.empty(width, dtype=np.float32)
+    for j in range(width):
+        fx = min(max((j + 0.5) * scale_x - 0.5, 0.0), small_w - 1.0)
+        x0[j] = int(fx)
+        x1[j] = min(x0[j] + 1, small_w - 1)
+        wx[j] = fx - x0[j]
+    row_a = np.empty(small_w, dtype=np.float32)
+    row_b = np.empty(small_w, dtype=np.float32)
+    for i in range(height):
+        fy = min(max((i + 0.5) * scale_y - 0.5, 0.0), small_h - 1.0)
+        y0 = int(fy)
+        y1 = min(y0 + 1, small_h - 1)
+        wy = np.float32(fy - y0)
+        # 先在縮圖寬度上完成垂直方向的內插
+        for k in range(small_w):
+            row_a[k] = coef_a[y0, k] + (coef_a[y1, k] - coef_a[y0, k]) * wy
+            row_b[k] = (coef_b[y0, k] + (coef_b[y1, k] - coef_b[y0, k]) * wy) * np.float32(255.0) + np.float32(0.5)
+        for j in range(width):
+            a = row_a[x0[j]] + (row_a[x1[j]] - row_a[x0[j]]) * wx[j]
+            b = row_b[x0[j]] + (row_b[x1[j]] - row_b[x0[j]]) * wx[j]
+            gray = (np.float32(0.114) * np.float32(image[i, j, 0]) + np.float32(0.587) * np.float32(image[i, j, 1])
+                    + np.float32(0.299) * np.float32(image[i, j, 2]))
+            value = a * gray + b
+            out[i, j] = np.uint8(min(max(value, np.float32(0.0)), np.float32(255.0)))
+    return out
+
+def refine_mask(image: np.ndarray, small: np.ndarray, small_mask: np.ndarray, radius: int = 4, eps: float = 1e-3) -> np.ndarray:
+    """
+    以快速導向濾波 (fast guided filter) 把縮圖上的遮罩放大回原圖尺寸：
+    在縮圖上以灰階圖為導引求出局部線性係數，放大係數後套用到原圖灰階上，讓遮罩邊緣貼齊原圖的細節。
+    原圖尺寸只需一次逐像素運算。
+    """
+    ksize = (2 * radius + 1, 2 * radius + 1)
+    guide = cv2.cvtColor(small[:, :, :3], cv2.COLOR_BGR2GRAY).astype(np.float32) / 255.0
+    p = small_mask.astype(np.float32) / 255.0
+    mean_i = cv2.boxFilter(guide, -1, ksize)
+    mean_p = cv2.boxFilter(p, -1, ksize)
+    cov_ip = cv2.boxFilter(guide * p, -1, ksize) - mean_i * mean_p
+    var_i = cv2.boxFilter(guide * guide, -1, ksize) - mean_i * mean_i
+    a = cov_ip / (var_i + eps)
+    b = mean_p - a * mean_i
+    mean_a = cv2.boxFilter(a, -1, ksize)
+    mean_b = cv2.boxFilter(b, -1, ksize)
+    out = np.empty(image.shape[:2], dtype=np.uint8)
+    return _guided_upsample_pass(image, mean_a, mean_b, out)
+
+def upsample_mask(image: np.ndarray, small: np.ndarray, small_mask: np.ndarray) -> np.ndarray:
+    """縮圖遮罩 -> 原圖尺寸的遮罩；small 即原圖時直接回傳"""
+    if small is image:
+        return small_mask
+    return refine_mask(image, small, small_mask)
+
+def segment_lowres(
+    image: np.ndarray, small: np.ndarray, small_mask: np.ndarray, out: Optional[np.ndarray] = None
+) -> np.ndarray:
+    """縮圖遮罩 -> 原圖尺寸的去背 BGRA 圖片；small 即原圖時直接套用遮罩。可傳入 out 直接寫入既有的緩衝區"""
+    return cutout(image, upsample_mask(image, small, small_mask), out)
+
+class SessionPool:
+    """
+    去背模型 session 池：模型只載入一次，由線程池中的工作者輪流借用。
+    session 在第一次被借用時才建立，最多建立 size 個；同一個 session 同一時間只會被一個工作者使用。
+    model_name 為 models.MODEL_REGISTRY 中的模型（含 INT8 量化版本）或任一 rembg 的 session 名稱。
+    """
+
+    def __init__(self, model_name: str, size: int, intra_op_threads: int = 0, inter_op_threads: int = 1):
+        if size < 1:
+            raise ValueError(f"session 池大小必須大於 0: {size}")
+        self.model_name = model_name
+        self.spec = get_model_spec(model_name)
+        self.size = size
+        # ONNX Runtime 每個 session 的運算線程數，0 表示由 ONNX Runtime 自行決定；
+        # 池中的 session 可能同時推論，合計不宜超過 CPU 核心數
+        self.intra_op_threads = intra_op_threads
+        self.inter_op_threads = inter_op_threads
+        self._idle: queue.LifoQueue = queue.LifoQueue()
+        self._created = 0
+        self._lock = threading.Lock()
+        self.cold_times: list[float] = []
+        self.warm_times: list[float] = []
+
+    def _acquire(self) -> tuple["BaseSession", bool]:
+        """借出一個 session，回傳 (session, 是否為新建立)"""
+        try:
+            return self._idle.get_nowait(), False
+        except queue.Empty:
+            pass
+
+        with self._lock:
+            can_create = self._created < self.size
+            if can_create:
+                self._created += 1
+
+        if can_create:
+            try:
+                sess_opts = session_options(self.intra_op_threads, self.inter_op_threads)
+                return new_model_session(self.model_name, sess_opts), True
+            except Exception:
+                with self._lock:
+                    self._created -= 1
+                raise
+
+        # 已達上限，等待其他工作者歸還
+        return self._idle.get(), False
+
+    @contextmanager
+    def session(self) -> Iterator["BaseSession"]:
+        session, _ = self._acquire()
+        try:
+            yield session
+        finally:
+            self._idle.put(session)
+
+    def preload(self) -> None:
+        """預先建立所有 session，避免第一批圖片承擔模型載入時間"""
+        sessions = [self._acquire()[0] for _ in range(self.size)]
+        for session in sessions:
+            self._idle.put(session)
+
+    def _record(self, cold: bool, elapsed: float, count: int = 1) -> None:
+        """記錄 count 張圖片共用的去背耗時，每張平均分攤"""
+        with self._lock:
+            (self.cold_times if cold else self.warm_times).extend([elapsed / count] * count)
+
+    def remove(self, data: Any, **kwargs: Any) -> Any:
+        """以池中的 session 執行 rembg.remove，並記錄冷啟動／熱啟動耗時"""
+        start = time.perf_counter()
+        session, cold = self._acquire()
+        try:
+            from rembg import remove
+
+            return remove(data, session=session, **kwargs)
+        finally:
+            self._idle.put(session)
+            self._record(cold, time.perf_counter() - start)
+
+    def remove_background(self, image: np.ndarray, max_side: int = 0, out: Optional[np.ndarray] = None) -> np.ndarray:
+        """
+        BGR 圖片 -> 去背後的 BGRA 圖片，全程以 ndarray 傳遞，不經過 PNG 編解碼。
+        max_side > 0 時在長邊縮至 max_side 的縮圖上去背，再把遮罩放大回原圖尺寸，結果寫入 out（若有傳入）；
+        未縮圖時直接回傳 rembg 的結果，不使用 out。
+        """
+        small = downscale(image, max_side)
+        rgba = self.remove(cv2.cvtColor(small, cv2.COLOR_BGR2RGB))
+        bgra = cv2.cvtColor(rgba, cv2.COLOR_RGBA2BGRA)
+        if small is image:
+            return bgra
+        return segment_lowres(image, small, bgra[:, :, 3], out)
+
+    def segment_mask(self, image: np.ndarray, max_side: int = 0) -> np.ndarray:
+        """
+        BGR 圖片 -> 原圖尺寸的 uint8 遮罩，不產生完整的去背圖片（分塊處理使用）。
+        max_side > 0 時在長邊縮至 max_side 的縮圖上去背，再把遮罩放大回原圖尺寸。
+        """
+        small = downscale(image, max_side)
+        mask = np.asarray(self.remove(cv2.cvtColor(small, cv2.COLOR_BGR2RGB), only_mask=True))
+        return upsample_mask(image, small, mask)
+
+    def predict_masks(self, images: list[np.ndarray]) -> list[np.ndarray]:
+        """對多張 BGR 圖片一次推論，回傳各自原尺寸的 uint8 遮罩；耗時平均分攤到每張圖片，記錄為冷啟動或熱啟動"""
+        start = time.perf_counter()
+        session, cold = self._acquire()
+        try:
+            if not self.spec.batchable:
+                # 非 U2Net 系列模型的前處理各不相同，交由 rembg 逐張處理
+                from rembg import remove
+
+                masks = [
+                    np.asarray(remove(cv2.cvtColor(image, cv2.COLOR_BGR2RGB), session=session, only_mask=True))
+                    for image in images
+                ]
+            else:
+                masks = self._infer(session, images)
+        finally:
+            self._idle.put(session)
+        self._record(cold, time.perf_counter() - start, len(images))
+        return masks
+
+    def _infer(self, session: "BaseSession", images: list[np.ndarray]) -> list[np.ndarray]:
+        """U2Net 系列模型：直接以 ONNX Runtime 對整批圖片推論"""
+        model_input = session.inner_session.get_inputs()[0]
+        batch = np.stack([_preprocess(image) for image in images])
+        if isinstance(model_input.shape[0], int):
+            # 模型的批次維度固定，只能逐張推論
+            preds = np.concatenate([
+                session.inner_session.run(None, {model_input.name: batch[i:i + 1]})[0]
+                for i in range(len(images))
+            ])
+        else:
+            preds = session.inner_session.run(None, {model_input.name: batch})[0]
+        return [_postprocess(pred[0], image.shape) for pred, image in zip(preds, images)]
+
+    def timing_report(self) -> str:
+        """冷啟動（含模型載入）與熱啟動的每張圖片平均去背耗時"""
+        with self._lock:
+            cold, warm = list(self.cold_times), list(self.warm_times)
+
+        def fmt(times: list[float]) -> str:
+            if not times:
+                return "無資料"
+            return f"{len(times)} 張，平均 {sum(times) / len(times) * 1000:.1f} ms"
+
+        return f"去背耗時 - 冷啟動: {fmt(cold)}；熱啟動: {fmt(warm)}"
+
+class SegmentationBatcher:
+    """
+    批次去背：收集最多 batch_size 張圖片（或 max_wait 秒內到達的圖片）後一次推論，
+    再把各自的遮罩交回對應的 process_image。必須在事件迴圈中使用。
+    """
+
+    def __init__(self, pool: SessionPool, executor: Executor, batch_size: int, max_wait: float):
+        self.pool = pool
+        self.executor = executor
+        self.batch_size = batch_size
+        self.max_wait = max_wait
+        self._queue: asyncio.Queue = asyncio.Queue()
+        self._collector: Optional[asyncio.Task] = None
+        self._inflight: set[asyncio.Task] = set()
+
+    async def segment(self, image: np.ndarray) -> np.ndarray:
+        """送出一張 BGR 圖片，等待所屬批次推論完成後取得遮罩"""
+        if self._collector is None:
+            self._collector = asyncio.create_task(self._collect())
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put((image, future))
+        return await future
+
+    async def _collect(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self._queue.get()]
+            deadline = loop.time() + self.max_wait
+            while len(batch) < self.batch_size:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+
+            # 推論在線程池中進行，收集器立即開始湊下一批
+            task = asyncio.create_task(self._infer(batch))
+            self._inflight.add(task)
+            task.add_done_callback(self._inflight.discard)
+
+    async def _infer(self, batch: list[tuple[np.ndarray, asyncio.Future]]) -> None:
+        loop = asyncio.get_running_loop()
+        try:
+            masks = await loop.run_in_executor(self.executor, self.pool.predict_masks, [image for image, _ in batch])
+        except Exception as e:
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        for (_, future), mask in zip(batch, masks):
+            if not future.done():
+                future.set_result(mask)
+
+    async def close(self) -> None:
+        if self._collector is not None:
+            self._collector.cancel()
+            await asyncio.gather(self._collector, return_exceptions=True)
+            self._collector = None
+        await asyncio.gather(*self._inflight, return_exceptions=True)
+
+# 全域共用的 session 池
+session_pool = SessionPool(
+    config.MODEL_NAME, config.SESSION_POOL_SIZE, config.ORT_INTRA_OP_THREADS, config.ORT_INTER_OP_THREADS
+)
@@ -0,0 +1,183 @@
+import asyncio
+import threading
+from collections import OrderedDict, deque
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Any, Coroutine, Optional, TypeVar, Union
+import aiofiles
+import config
+from main import create_batcher, estimate_image_bytes, process_bytes
+from metrics import metrics
+from scheduler import InflightLimiter
+from segmentation import SegmentationBatcher
+
+T = TypeVar("T")
+
+class ServiceBusy(Exception):
+    """排隊中的圖片已達上限，暫時不接受新的工作"""
+
+@dataclass
+class _Job:
+    user: str
+    # 圖片檔案路徑或檔案內容
+    source: Union[Path, bytes] = field(repr=False)
+    # 輸出格式的副檔名
+    ext: str
+    future: asyncio.Future = field(repr=False)
+
+class PipelineService:
+    """
+    所有使用者共用的長駐處理服務：在背景線程中執行單一事件迴圈，共用批次去背器，
+    不同請求的圖片可合併成同一批推論。
+    圖片依使用者分別排隊、輪流取出（公平排程），每位使用者同時處理中的圖片數有上限；
+    全體處理中的圖片數與估計記憶體用量超過上限時繼續排隊，排隊數超過上限時拒絕新的工作。
+    """
+
+    def __init__(self, max_inflight_images: int, max_inflight_bytes: int, per_user_limit: int, max_queued: int):
+        self.max_inflight_images = max_inflight_images
+        self.max_inflight_bytes = max_inflight_bytes
+        self.per_user_limit = per_user_limit
+        self.max_queued = max_queued
+        self.loop: Optional[asyncio.AbstractEventLoop] = None
+        self._thread: Optional[threading.Thread] = None
+        self._start_lock = threading.Lock()
+        self._queues: OrderedDict[str, deque[_Job]] = OrderedDict()
+        self._user_inflight: dict[str, int] = {}
+        self._queued = 0
+        self._batcher: Optional[SegmentationBatcher] = None
+        self._tasks: set[asyncio.Task] = set()
+
+    def start(self) -> None:
+        """啟動背景事件迴圈（重複呼叫不會重複啟動）"""
+        with self._start_lock:
+            if self._thread is not None:
+                return
+            ready = threading.Event()
+
+            def run() -> None:
+                self.loop = asyncio.new_event_loop()
+                asyncio.set_event_loop(self.loop)
+                self.loop.run_until_complete(self._setup())
+                ready.set()
+                self.loop.run_forever()
+
+            self._thread = threading.Thread(target=run, name="pipeline-service", daemon=True)
+            self._thread.start()
+            ready.wait()
+        metrics.register_gauge("queued_images", lambda: self._queued)
+
+    async def _setup(self) -> None:
+        self._batcher = create_batcher()
+        self._limiter = InflightLimiter(self.max_inflight_images, self.max_inflight_bytes)
+        self._changed = asyncio.Condition()
+        self._dispatcher = asyncio.create_task(self._dispatch())
+
+    def run(self, coro: Coroutine[Any, Any, T]) -> T:
+        """從其他線程（例如 Gradio 的處理函式）在服務的事件迴圈中執行協程並等待結果"""
+        self.start()
+        return asyncio.run_coroutine_threadsafe(coro, self.loop).result()
+
+    async def run_async(self, coro: Coroutine[Any, Any, T]) -> T:
+        """從其他事件迴圈（例如 HTTP API）在服務的事件迴圈中執行協程並等待結果，取消時一併取消該協程"""
+        self.start()
+        return await asyncio.wrap_future(asyncio.run_coroutine_threadsafe(coro, self.loop))
+
+    def check_capacity(self, count: int) -> None:
+        """一次送出 count 張圖片前先檢查排隊空間，避免整批只處理一部分就被拒絕"""
+        if self._queued + count > self.max_queued:
+            raise ServiceBusy("目前處理中的圖片過多，請稍後再試")
+
+    async def process(self, user: str, source: Union[Path, bytes], ext: Optional[str] = None) -> bytes:
+        """
+        排入一張圖片並等待處理結果（必須在服務的事件迴圈中呼叫）。
+        source 為圖片檔案路徑或檔案內容；ext 為輸出格式，未指定時沿用檔案路徑的副檔名。
+        """
+        if ext is None:
+            if isinstance(source, bytes):
+                raise ValueError("以檔案內容送出圖片時必須指定輸出格式")
+            ext = source.suffix
+        future = asyncio.get_running_loop().create_future()
+        async with self._changed:
+            if self._queued >= self.max_queued:
+                raise ServiceBusy("目前處理中的圖片過多，請稍後再試")
+            self._queues.setdefault(user, deque()).append(_Job(user, source, ext, future))
+            self._queued += 1
+            self._changed.notify_all()
+        return await future
+
+    def _next_job(self) -> Optional[_Job]:
+        """依序輪流檢查每位使用者，取出第一個未達個人上限的使用者的下一張圖片"""
+        for user, queue in self._queues.items():
+            if self._user_inflight.get(user, 0) >= self.per_user_limit:
+                continue
+            job = queue.popleft()
+            self._queued -= 1
+            if queue:
+                # 取出後排到最後，下次先輪到其他使用者
+                self._queues.move_to_end(user)
+            else:
+                del self._queues[user]
+            return job
+        return None
+
+    async def _dispatch(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            async with self._changed:
+                job = None
+                while job is None:
+                    await self._changed.wait_for(lambda: any(
+                        self._user_inflight.get(user, 0) < self.per_user_limit for user in self._queues
+                    ))
+                    job = self._next_job()
+                    if job.future.cancelled():
+                        # 請求已取消（例如同一請求中其他圖片失敗），略過
+                        job = None
+                self._user_inflight[job.user] = self._user_inflight.get(job.user, 0) + 1
+
+            # 全體處理中的圖片數與記憶體用量超過上限時在此等待
+            source = job.source if isinstance(job.source, bytes) else str(job.source)
+            nbytes = await loop.run_in_executor(None, estimate_image_bytes, source)
+            await self._limiter.acquire(nbytes)
+            task = asyncio.create_task(self._run(job, nbytes))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    async def _run(self, job: _Job, nbytes: int) -> None:
+        try:
+            if not job.future.cancelled():
+                if isinstance(job.source, bytes):
+                    data = job.source
+                else:
+                    async with aiofiles.open(job.source, "rb") as f:
+                        data = await f.read()
+                # 使用者上傳的圖片預設不寫入處理結果快取
+                result = await process_bytes(data, job.ext, self._batcher, config.SERVICE_CACHE)
+                if not job.future.cancelled():
+                    job.future.set_result(result)
+        except Exception as e:
+            if not job.future.cancelled():
+                job.future.set_exception(e)
+        finally:
+            await self._limiter.release(nbytes)
+            async with self._changed:
+                self._user_inflight[job.user] -= 1
+                if self._user_inflight[job.user] == 0:
+                    del self._user_inflight[job.user]
+                self._changed.notify_all()
+
+    def stats(self) -> dict[str, Any]:
+        """目前排隊與處理中的狀態"""
+        return {
+            "queued": self._queued,
+            "queued_by_user": {user: len(queue) for user, queue in list(self._queues.items())},
+            "inflight_by_user": dict(self._user_inflight),
+        }
+
+# 全域共用的處理服務，第一次使用時啟動
+pipeline_service = PipelineService(
+    config.MAX_INFLIGHT_IMAGES,
+    config.MAX_INFLIGHT_MB * 1024 * 1024,
+    config.USER_MAX_INFLIGHT_IMAGES,
+    config.MAX_QUEUED_IMAGES
+)
@@ -0,0 +1,27 @@
+from io import BytesIO
+import numpy as np
+import pytest
+from PIL import Image
+import main
+
+def encode_with_orientation(rgba: np.ndarray, fmt: str, orientation: int) -> bytes:
+    exif = Image.Exif()
+    exif[0x0112] = orientation
+    buffer = BytesIO()
+    Image.fromarray(rgba, "RGBA").save(buffer, fmt, exif=exif.tobytes(), lossless=True, exact=True)
+    return buffer.getvalue()
+
+@pytest.mark.parametrize("fmt", ["PNG", "WEBP"])
+@pytest.mark.parametrize("orientation", range(1, 9))
+def test_alpha_input_follows_exif_orientation(monkeypatch, fmt, orientation):
+    monkeypatch.setattr(main.fast_path, "modes", frozenset({"alpha"}))
+    # 不對稱的圖片，alpha 與藍色通道相同，方便檢查兩者是否一起轉正
+    rng = np.random.default_rng(orientation)
+    rgba = rng.integers(0, 256, (24, 40, 4), dtype=np.uint8)
+    rgba[:, :, 3] = rgba[:, :, 2]
+    data = encode_with_orientation(rgba, fmt, orientation)
+
+    image, alpha = main.decode_input(data)
+
+    np.testing.assert_array_equal(image, main.decode_image(data))
+    np.testing.assert_array_equal(alpha, image[:, :, 0])
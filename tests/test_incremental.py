@@ -0,0 +1,68 @@
+import asyncio
+import json
+import os
+import cv2
+import pytest
+import config
+import main
+from benchmarks.common import install_stub_segmenter, synthetic_images
+from manifest import MANIFEST_NAME
+
+@pytest.fixture(autouse=True)
+def stub_pipeline(monkeypatch):
+    # 以 stub 遮罩取代去背模型，並停用快取與快速去背，只測試批次處理與處理紀錄
+    install_stub_segmenter()
+    monkeypatch.setattr(config, "CACHE_MAX_MB", 0)
+    monkeypatch.setattr(config, "DEDUP_MAX_MB", 0)
+    monkeypatch.setattr(main.fast_path, "modes", frozenset())
+
+@pytest.fixture
+def input_dir(tmp_path):
+    path = tmp_path / "input"
+    path.mkdir()
+    for i, image in enumerate(synthetic_images(3, (120, 160))):
+        cv2.imwrite(str(path / f"{i}.jpg"), image)
+    (path / "corrupt.jpg").write_bytes(os.urandom(4096))
+    return path
+
+def run(input_dir, output_dir, **kwargs) -> None:
+    asyncio.run(main.process_multiple_images(str(input_dir), str(output_dir), incremental=True, **kwargs))
+
+def manifest_status(output_dir) -> dict[str, str]:
+    with open(output_dir / MANIFEST_NAME, encoding="utf-8") as f:
+        return {path: entry["status"] for path, entry in json.load(f)["files"].items()}
+
+def test_corrupt_input_does_not_stop_batch(input_dir, tmp_path, capsys):
+    output_dir = tmp_path / "output"
+    run(input_dir, output_dir)
+
+    assert sorted(os.listdir(output_dir)) == sorted(["0.jpg", "1.jpg", "2.jpg", MANIFEST_NAME])
+    assert manifest_status(output_dir) == {"0.jpg": "done", "1.jpg": "done", "2.jpg": "done", "corrupt.jpg": "failed"}
+    out = capsys.readouterr().out
+    assert "共處理 3 個圖片檔案" in out
+    assert "1 個圖片檔案處理失敗" in out
+
+def test_unchanged_failed_input_is_skipped_on_rerun(input_dir, tmp_path, capsys):
+    output_dir = tmp_path / "output"
+    run(input_dir, output_dir)
+    capsys.readouterr()
+
+    run(input_dir, output_dir)
+    out = capsys.readouterr().out
+    assert "略過 3 個輸出已是最新的圖片檔案" in out
+    assert "略過 1 個上次處理失敗且沒有變更的圖片檔案" in out
+    assert "處理失敗，已略過" not in out
+
+    run(input_dir, output_dir, retry_failed=True)
+    out = capsys.readouterr().out
+    assert "略過 3 個輸出已是最新的圖片檔案" in out
+    assert "1 個圖片檔案處理失敗" in out
+
+def test_fixed_input_is_processed_on_rerun(input_dir, tmp_path):
+    output_dir = tmp_path / "output"
+    run(input_dir, output_dir)
+
+    cv2.imwrite(str(input_dir / "corrupt.jpg"), synthetic_images(1, (120, 160), seed=1)[0])
+    run(input_dir, output_dir)
+    assert manifest_status(output_dir)["corrupt.jpg"] == "done"
+    assert os.path.exists(output_dir / "corrupt.jpg")
@@ -0,0 +1,23 @@
+from types import SimpleNamespace
+import cv2
+import numpy as np
+import pytest
+from PIL import Image
+from segmentation import MODEL_INPUT_SIZE, _MEAN, _STD, _preprocess
+
+def textured_image() -> np.ndarray:
+    """有細紋理與漸層的 BGR 圖片：縮小時有無抗鋸齒的差異明顯"""
+    rng = np.random.default_rng(0)
+    image = rng.integers(0, 256, (900, 1200, 3), dtype=np.uint8)
+    image[:, :, 0] = np.linspace(0, 255, 1200, dtype=np.uint8)[None, :]
+    cv2.circle(image, (600, 450), 300, (30, 160, 220), -1)
+    return image
+
+def test_preprocess_matches_rembg_normalize():
+    base = pytest.importorskip("rembg.sessions.base")
+    session = SimpleNamespace(inner_session=SimpleNamespace(get_inputs=lambda: [SimpleNamespace(name="input")]))
+    image = textured_image()
+    rgb = Image.fromarray(cv2.cvtColor(image, cv2.COLOR_BGR2RGB))
+    expected = base.BaseSession.normalize(session, rgb, tuple(_MEAN), tuple(_STD), MODEL_INPUT_SIZE)["input"][0]
+
+    np.testing.assert_allclose(_preprocess(image), expected, atol=1e-5)
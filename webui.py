@@ -1,60 +1,82 @@
 import gradio as gr
 import tempfile
-import shutil
 import zipfile
 import asyncio
 from pathlib import Path
-from io import BytesIO
+import shutil
 import datetime
 import os
-from main import process_multiple_images
+from main import get_all_images, is_image_file, warm_up
+from service import ServiceBusy, pipeline_service
 from typing import Any
+from metrics import metrics
+import config
 
-async def process_files(files: Any) -> str:
-    """處理上傳的檔案並返回 ZIP"""
-    with tempfile.TemporaryDirectory() as temp_dir:
-        input_dir = Path(temp_dir) / "input"
-        output_dir = Path(temp_dir) / "output"
-        input_dir.mkdir()
-        output_dir.mkdir()
-        
-        # 處理上傳的檔案或資料夾
-        for file in files:
-            file_path = Path(file.name)
-            if file_path.is_dir():
-                # 複製整個資料夾結構
-                shutil.copytree(
-                    file_path, 
-                    input_dir / file_path.name,
-                    dirs_exist_ok=True
-                )
-            else:
-                # 複製單一檔案
-                shutil.copy2(file_path, input_dir)
-        
-        await process_multiple_images(str(input_dir), str(output_dir))
-        
-        # 建立 ZIP
-        memory_zip = BytesIO()
-        with zipfile.ZipFile(memory_zip, 'w') as zf:
-            for file in output_dir.rglob('*'):
-                if file.is_file():
-                    zf.write(file, file.relative_to(output_dir))
-        
-        # 使用時間戳記建立有意義的檔名
-        timestamp = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
-        output_filename = f'ItemGlow_{timestamp}.zip'
-        
-        # 在系統臨時目錄建立具名檔案
-        temp_dir = tempfile.gettempdir()
-        output_path = os.path.join(temp_dir, output_filename)
-        
-        with open(output_path, 'wb') as f:
-            f.write(memory_zip.getvalue())
-        
-        return output_path
+# 已壓縮的圖片格式再壓縮幾乎沒有效果，直接存入 ZIP
+STORED_EXTENSIONS = {".jpg", ".jpeg", ".png", ".webp"}
+
+def write_zip_entry(zf: zipfile.ZipFile, arcname: Path, data: bytes) -> None:
+    compress_type = zipfile.ZIP_STORED if arcname.suffix.lower() in STORED_EXTENSIONS else zipfile.ZIP_DEFLATED
+    zf.writestr(str(arcname), data, compress_type=compress_type)
+
+async def process_files(files: Any, user: str = "anonymous") -> str:
+    """
+    處理上傳的檔案並返回 ZIP：圖片交由共用的處理服務排程，在記憶體中處理，不另外複製到暫存目錄；
+    每張圖片處理完成就直接寫入磁碟上的 ZIP，不在記憶體中保留整個壓縮檔。
+    必須在 pipeline_service 的事件迴圈中執行。
+    """
+    # 處理上傳的檔案或資料夾，ZIP 內保留資料夾結構
+    sources = []
+    for file in files:
+        file_path = Path(getattr(file, "name", file))
+        if file_path.is_dir():
+            for image_path in map(Path, get_all_images(str(file_path))):
+                sources.append((image_path, Path(file_path.name) / image_path.relative_to(file_path)))
+        elif is_image_file(file_path.name):
+            sources.append((file_path, Path(file_path.name)))
+
+    pipeline_service.check_capacity(len(sources))
+
+    # 使用時間戳記建立有意義的檔名；每個請求各自一個臨時目錄，同時上傳時不會互相覆蓋
+    timestamp = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
+    output_path = os.path.join(tempfile.mkdtemp(prefix="ItemGlow_"), f'ItemGlow_{timestamp}.zip')
+
+    async def process_one(source: Path, arcname: Path) -> tuple[Path, bytes]:
+        return arcname, await pipeline_service.process(user, source)
+
+    loop = asyncio.get_running_loop()
+    tasks = [asyncio.create_task(process_one(source, arcname)) for source, arcname in sources]
+    try:
+        with zipfile.ZipFile(output_path, 'w') as zf:
+            # 依完成順序寫入，寫入後即釋放該張圖片的結果
+            for task in asyncio.as_completed(tasks):
+                arcname, data = await task
+                await loop.run_in_executor(None, write_zip_entry, zf, arcname, data)
+    except BaseException:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        shutil.rmtree(os.path.dirname(output_path), ignore_errors=True)
+        raise
+
+    return output_path
+
+def handle_upload(files: Any, request: gr.Request) -> str:
+    """Gradio 的上傳處理函式：以瀏覽器工作階段區分使用者，交由共用的處理服務執行"""
+    user = request.session_hash if request is not None else "anonymous"
+    try:
+        return pipeline_service.run(process_files(files, user))
+    except ServiceBusy as e:
+        raise gr.Error(str(e))
 
 def launch_ui():
+    # 啟動前先載入模型並編譯運算核心，第一位使用者上傳時不必等待
+    print(f"預熱完成，耗時 {warm_up():.1f} 秒")
+    pipeline_service.start()
+    if config.METRICS_PORT:
+        metrics.serve(config.METRICS_PORT)
+        print(f"效能指標: http://0.0.0.0:{config.METRICS_PORT}/metrics")
+
     with gr.Blocks(css="body{max-width: 800px;align-self: center;}") as app:
         app.title = "ItemGlow 商品照片優化器 - 榛果繽紛樂"
         app.head = "<meta name=\"description\" content=\"ItemGlow 是一個專為電商賣家設計的商品照優化器，可自動去背、調整色溫、飽和度、亮度，快速製作商品照片。\">"
@@ -93,10 +115,12 @@ def launch_ui():
             )
             output = gr.File(label="下載處理後的照片")
         
+        # Gradio 預設同一事件一次只處理一個請求；改由 pipeline_service 排程與限制，多位使用者的上傳才能同時處理
         file_input.upload(
-            fn=lambda x: asyncio.run(process_files(x)),
+            fn=handle_upload,
             inputs=file_input,
-            outputs=output
+            outputs=output,
+            concurrency_limit=None
         )
     
     app.launch(server_name="0.0.0.0", server_port=7860, favicon_path="favicon.ico")
@@ -3,7 +3,7 @@ import numpy as np
 from typing import Any
 from numba import jit, cuda
 
-@jit(nopython=True)
+@jit(nopython=True, cache=True)
 def adjust_channels_gray_world(b: np.ndarray, g: np.ndarray, r: np.ndarray) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
     avg_b, avg_g, avg_r = np.mean(b), np.mean(g), np.mean(r)
     avg_gray = (avg_b + avg_g + avg_r) / 3
@@ -14,7 +14,7 @@ def adjust_channels_gray_world(b: np.ndarray, g: np.ndarray, r: np.ndarray) -> t
 
     return b, g, r
 
-@jit(nopython=True)
+@jit(nopython=True, cache=True)
 def adjust_channels_perfect_reflector(b: np.ndarray, g: np.ndarray, r: np.ndarray) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
     max_b, max_g, max_r = np.max(b), np.max(g), np.max(r)
 
@@ -24,7 +24,7 @@ def adjust_channels_perfect_reflector(b: np.ndarray, g: np.ndarray, r: np.ndarra
 
     return b, g, r
 
-@jit(nopython=True)
+@jit(nopython=True, cache=True)
 def adjust_channels_white_patch(b: np.ndarray, g: np.ndarray, r: np.ndarray) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
     max_b, max_g, max_r = np.max(b), np.max(g), np.max(r)
 
@@ -34,7 +34,7 @@ def adjust_channels_white_patch(b: np.ndarray, g: np.ndarray, r: np.ndarray) ->
 
     return b, g, r
 
-@jit(nopython=True)
+@jit(nopython=True, cache=True)
 def adjust_channels_adaptive(b: np.ndarray, g: np.ndarray, r: np.ndarray) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
     avg_b, avg_g, avg_r = np.mean(b), np.mean(g), np.mean(r)
     avg_gray = (avg_b + avg_g + avg_r) / 3
@@ -45,7 +45,7 @@ def adjust_channels_adaptive(b: np.ndarray, g: np.ndarray, r: np.ndarray) -> tup
 
     return b, g, r
 
-@cuda.jit
+@cuda.jit(cache=True)
 def adjust_channels_perfect_reflector_cuda(b, g, r, max_b, max_g, max_r):
     i, j = cuda.grid(2)
     if i < b.shape[0] and j < b.shape[1]:
@@ -53,7 +53,7 @@ def adjust_channels_perfect_reflector_cuda(b, g, r, max_b, max_g, max_r):
         g[i, j] = min(g[i, j] * (255 / max_g), 255)
         r[i, j] = min(r[i, j] * (255 / max_r), 255)
 
-@cuda.jit
+@cuda.jit(cache=True)
 def adjust_channels_gray_world_cuda(b, g, r, avg_gray, avg_b, avg_g, avg_r):
     i, j = cuda.grid(2)
     if i < b.shape[0] and j < b.shape[1]:
@@ -61,7 +61,7 @@ def adjust_channels_gray_world_cuda(b, g, r, avg_gray, avg_b, avg_g, avg_r):
         g[i, j] = min(g[i, j] * (avg_gray / avg_g), 255)
         r[i, j] = min(r[i, j] * (avg_gray / avg_r), 255)
 
-@cuda.jit
+@cuda.jit(cache=True)
 def adjust_channels_white_patch_cuda(b, g, r, max_b, max_g, max_r):
     i, j = cuda.grid(2)
     if i < b.shape[0] and j < b.shape[1]:
@@ -69,7 +69,7 @@ def adjust_channels_white_patch_cuda(b, g, r, max_b, max_g, max_r):
         g[i, j] = min(g[i, j] * (255 / max_g), 255)
         r[i, j] = min(r[i, j] * (255 / max_r), 255)
 
-@cuda.jit
+@cuda.jit(cache=True)
 def adjust_channels_adaptive_cuda(b, g, r, avg_gray, avg_b, avg_g, avg_r):
     i, j = cuda.grid(2)
     if i < b.shape[0] and j < b.shape[1]:
@@ -230,6 +230,9 @@ def brighten_shadows(image: Any, threshold: int = 60, factor: float = 1.5) -> An
     hsv = cv2.merge([h, s, v])
     return cv2.cvtColor(hsv, cv2.COLOR_HSV2BGR)
 
+# apply_multiple_white_balance 依序套用的白平衡算法
+WHITE_BALANCE_CHAIN = ("white_patch", "gray_world", "perfect_reflector", "adaptive")
+
 # 使用多種白平衡算法多次處理並調整暗部亮度
 def apply_multiple_white_balance(image: Any, support_cuda: bool) -> Any:
     image = white_patch_white_balance(image, support_cuda)
@@ -237,4 +240,58 @@ def apply_multiple_white_balance(image: Any, support_cuda: bool) -> Any:
     image = perfect_reflector_white_balance(image, support_cuda)
     image = adaptive_white_balance(image, support_cuda)
     # image = brighten_shadows(image, 80, 1.2)
-    return image
\ No newline at end of file
+    return image
+
+@jit(nopython=True, nogil=True, cache=True)
+def channel_histograms(image: np.ndarray) -> np.ndarray:
+    """單次掃描統計前三個通道的直方圖，可直接接受 BGRA 圖片"""
+    hist = np.zeros((3, 256), dtype=np.int64)
+    for i in range(image.shape[0]):
+        for j in range(image.shape[1]):
+            for c in range(3):
+                hist[c, image[i, j, c]] += 1
+    return hist
+
+@jit(nopython=True, nogil=True, cache=True)
+def sampled_channel_histograms(image: np.ndarray, step: int) -> np.ndarray:
+    """
+    每隔 step 個像素取樣統計前三個通道的直方圖；BGRA 圖片只統計 alpha 大於 0 的前景像素。
+    去背後的透明像素顏色為 0，不影響各白平衡步驟的增益，略過它們只是省下掃描時間。
+    """
+    hist = np.zeros((3, 256), dtype=np.int64)
+    has_alpha = image.shape[2] > 3
+    for i in range(0, image.shape[0], step):
+        for j in range(0, image.shape[1], step):
+            if has_alpha and image[i, j, 3] == 0:
+                continue
+            for c in range(3):
+                hist[c, image[i, j, c]] += 1
+    return hist
+
+def _max_gains(hist: np.ndarray, lut: np.ndarray) -> list[float]:
+    gains = []
+    for c in range(3):
+        present = lut[c][hist[c] > 0]
+        max_c = present.max() if present.size else 0
+        gains.append(255 / max_c if max_c > 0 else 1.0)
+    return gains
+
+def _mean_gains(hist: np.ndarray, lut: np.ndarray) -> list[float]:
+    total = hist[0].sum()
+    avg_b, avg_g, avg_r = [(hist[c] * lut[c].astype(np.int64)).sum() / total for c in range(3)]
+    avg_gray = (avg_b + avg_g + avg_r) / 3
+    return [avg_gray / avg if avg > 0 else 1.0 for avg in (avg_b, avg_g, avg_r)]
+
+# 以直方圖推算 apply_multiple_white_balance 的效果
+def multiple_white_balance_lut(hist: np.ndarray) -> np.ndarray:
+    """
+    每個白平衡步驟都是逐通道的 x -> clip(x * 增益)，前一步的結果可由直方圖經查表得到，
+    因此整條白平衡鏈可以只掃描一次圖片，化為每通道 256 項的查表 (3, 256)。
+    """
+    lut = np.tile(np.arange(256, dtype=np.uint8), (3, 1))
+    # 依序為白點法、灰度世界、完美反射、自適應，與 apply_multiple_white_balance 相同
+    for step in (_max_gains, _mean_gains, _max_gains, _mean_gains):
+        gains = step(hist, lut)
+        for c in range(3):
+            lut[c] = np.clip(lut[c] * gains[c], 0, 255).astype(np.uint8)
+    return lut